@@ -1,10 +1,12 @@
 # appconfig - remote control for DLCE apps
 
+import os
 import pathlib
+import functools
 
 from . import config
 
-__all__ = ['PKG_DIR', 'APPS_DIR', 'CONFIG_FILE', 'APPS']
+__all__ = ['PKG_DIR', 'APPS_DIR', 'CONFIG_FILE', 'CONFIG_DIR', 'CONFIG_PATH', 'CACHE_DIR', 'APPS']
 
 PKG_DIR = pathlib.Path(__file__).parent
 
@@ -12,7 +14,18 @@ APPS_DIR = PKG_DIR.parent / 'apps'
 
 CONFIG_FILE = APPS_DIR / 'apps.ini'
 
-APPS = config.Config.from_file(CONFIG_FILE)
+# If it exists, a directory in apps.d layout takes precedence over apps.ini:
+CONFIG_DIR = APPS_DIR / 'apps.d'
+
+CONFIG_PATH = CONFIG_DIR if CONFIG_DIR.is_dir() else CONFIG_FILE
+
+CACHE_DIR = pathlib.Path(
+    os.environ.get('APPCONFIG_CACHE_DIR') or pathlib.Path.home() / '.cache' / 'appconfig')
+
+# APPS is only loaded - from a snapshot in CACHE_DIR if the config didn't change - when accessed.
+APPS = config.LazyConfig(
+    functools.partial(config.Config.from_snapshot, CONFIG_PATH, CACHE_DIR),
+    functools.partial(config.load_app, CONFIG_PATH))
 
 # TODO: consider https://pypi.python.org/pypi/pyvbox
 #       for scripting tests with virtualbox
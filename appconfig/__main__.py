@@ -1,9 +1,16 @@
 # __main__.py - command line interface
 
+import sys
+import pathlib
 import argparse
+import subprocess
 from urllib.request import urlopen, HTTPError
 
-from . import APPS
+from . import APPS, CONFIG_PATH
+from . import config
+from . import probes
+from . import smoke as smoke_
+from . import fleet as fleet_
 
 
 def ls(args):
@@ -11,8 +18,10 @@ def ls(args):
     List registered apps.
 
     -p to sort by port
+    --live to probe the apps' /_ping URLs (concurrently) and add status columns; rows are
+    then listed in the order in which the probes complete.
     """
-    table = []
+    table, urls = [], []
     for a in APPS.values():
         table.append((
             a.name,
@@ -21,6 +30,7 @@ def ls(args):
             '{0}'.format(a.port),
             a.stack,
             '{0}'.format(a.public)))
+        urls.append('https://{0}/_ping'.format(a.domain))
         if a.test:
             table.append((
                 '{0} [test]'.format(a.name),
@@ -29,11 +39,24 @@ def ls(args):
                 '{0}'.format(a.port),
                 a.stack,
                 '{0}'.format(False)))
+            urls.append('https://{0}/{1}/_ping'.format(a.test, a.name))
+    cols = ['#', 'id', 'url', 'server', 'port', 'stack', 'public']
     cwidth = [2] + [max(map(len, c)) for c in zip(*table)]
+    if args and '--live' in args:
+        cols.extend(['status', 'code', 'ms'])
+        cwidth.extend([12, 4, 6])
     tmpl = ' '.join('{:%d}' % w for w in cwidth)
-    print(tmpl.format('#', 'id', 'url', 'server', 'port', 'stack', 'public'))
+    print(tmpl.format(*cols))
     print(tmpl.format(*('-' * w for w in cwidth)))
 
+    if args and '--live' in args:
+        rows = dict(zip(urls, table))
+        for i, res in enumerate(probes.iter_probes(urls), start=1):
+            r = ['{0}'.format(i)] + list(rows[res.url]) + [
+                res.status, '{0}'.format(res.code or '-'), '{0:.0f}'.format(res.latency * 1000)]
+            print(tmpl.format(*r), flush=True)
+        return
+
     if args and '-p' in args:
         sortkey = lambda t: t[3]
     else:
@@ -45,7 +68,16 @@ def ls(args):
 
 
 def test_error(appid):
-    """Test the error reporting of an app by requesting its /_raise URL."""
+    """
+    Test the error reporting of an app by requesting its /_raise URL.
+
+    With appid --all, the error reporting of all public apps is tested concurrently.
+    """
+    if appid == '--all':
+        if smoke(['--raise']):
+            raise RuntimeError('error reporting failed for some apps')
+        return
+
     raise_url = 'http://{0.domain}/_raise'.format(APPS[appid])
     try:
         u = urlopen(raise_url)
@@ -56,9 +88,136 @@ def test_error(appid):
         raise RuntimeError('url %r did not raise' % raise_url)
 
 
+def smoke(args):
+    """
+    Smoke test the apps given by name (default: all public apps) concurrently, see
+    appconfig.smoke. Results are listed as they come in; returns the number of failed checks.
+
+    --raise to only check the /_raise URLs.
+    """
+    names = [a for a in args if not a.startswith('-')]
+    apps = [APPS[n] for n in names] if names else [a for a in APPS.values() if a.public]
+
+    tmpl = '{0:>4} {1:20} {2:60} {3:>8} {4:>4} {5:>6} {6}'
+    print(tmpl.format('#', 'app', 'url', 'expected', 'code', 'ms', 'result'))
+    passed = failed = 0
+    for i, res in enumerate(smoke_.run(apps, raise_only='--raise' in args), start=1):
+        if res.passed:
+            passed += 1
+        else:
+            failed += 1
+        print(tmpl.format(
+            i,
+            res.check.app.name,
+            res.check.url,
+            res.check.expected,
+            res.probe.code or '-',
+            '{0:.0f}'.format(res.probe.latency * 1000),
+            'PASS' if res.passed else 'FAIL ({0})'.format(res.probe.status)), flush=True)
+    print('{0} passed, {1} failed'.format(passed, failed))
+    return failed
+
+
+def fleet(args):
+    """
+    Run a task from appconfig.tasks for a selection of apps, in parallel across hosts, and
+    report the results; see appconfig.fleet. Returns the number of failures.
+    """
+    parser = argparse.ArgumentParser(prog='appconfig fleet', description=fleet.__doc__)
+    parser.add_argument('task', help='name of the task, e.g. pip_freeze')
+    parser.add_argument('task_args', nargs='*', help='positional arguments for the task')
+    parser.add_argument('--env', default='production', choices=['production', 'test'])
+    parser.add_argument('--host', help='only select apps deployed to HOST')
+    parser.add_argument('--stack', help='only select apps of STACK')
+    parser.add_argument('--name', help='only select apps with names matching a wildcard pattern')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='number of hosts run in parallel')
+    opts = parser.parse_args(args)
+
+    apps = APPS.select(opts.env, host=opts.host, stack=opts.stack, pattern=opts.name)
+    return fleet_.report(
+        fleet_.run(opts.task, apps, opts.env, args=opts.task_args, workers=opts.jobs))
+
+
+def render(args):
+    """
+    Render the config files which deploy would upload for an app in an environment locally,
+    e.g. to review changes of templates or settings. Files are printed or - with -o - written
+    to a directory, mirroring their remote paths.
+    """
+    parser = argparse.ArgumentParser(prog='appconfig render', description=render.__doc__)
+    parser.add_argument('app', help='name of the app')
+    parser.add_argument('environment', choices=['production', 'test', 'staging'])
+    parser.add_argument('--host', help="host to render for (default: the app's host)")
+    parser.add_argument('-o', '--outdir', type=pathlib.Path, help='directory to write files to')
+    opts = parser.parse_args(args)
+
+    from fabric.api import settings
+    from .tasks import deployment
+
+    app = APPS[opts.app]
+    host = opts.host or (getattr(app, opts.environment) if opts.environment != 'staging' else None)
+    if not host:
+        parser.error('no {0} host for {1}, use --host'.format(opts.environment, app.name))
+
+    with settings(host_string=host, host=host, environment=opts.environment):
+        files = deployment.render_config_files(app)
+
+    for path, text in files:
+        if opts.outdir:
+            target = opts.outdir / path.lstrip('/')
+            if not target.parent.exists():
+                target.parent.mkdir(parents=True)
+            target.write_text(text, encoding='utf-8')
+            print(target)
+        else:
+            print('# {0}\n{1}\n'.format(path, text))
+
+
+def config_at_revision(rev, path=CONFIG_PATH):
+    """Read the text of the config at `path` as of git revision `rev`."""
+    def git(*args):
+        cwd = path if path.is_dir() else path.parent
+        return subprocess.check_output(('git',) + args, cwd=str(cwd)).decode('utf-8-sig')
+
+    if not path.is_dir():
+        return git('show', '{0}:./{1}'.format(rev, path.name))
+    names = [n for n in git('ls-tree', '--name-only', rev, './').split() if n.endswith('.ini')]
+    # Shared files go first, as in config.source_files:
+    names = sorted(names, key=lambda n: (not n.startswith('_'), n))
+    return '\n'.join(git('show', '{0}:./{1}'.format(rev, n)) for n in names)
+
+
+def diff(args):
+    """
+    List apps whose effective settings differ between a git revision (default: HEAD) of
+    apps.ini and the working tree.
+
+    --names to only print the names of affected apps, e.g. to target a redeploy.
+    """
+    rev = ([a for a in args if not a.startswith('-')] or ['HEAD'])[0]
+    # Settings added since `rev` are read with their current defaults:
+    current = config.ConfigParser.from_files(config.source_files(CONFIG_PATH))
+    old = config.Config.from_string(
+        config_at_revision(rev), validate=False, defaults=current.defaults())
+
+    for name, changes in sorted(old.diff(APPS).items()):
+        if '--names' in args:
+            print(name)
+            continue
+        if name not in APPS:
+            print('- {0}'.format(name))
+        elif name not in old:
+            print('+ {0}'.format(name))
+        else:
+            print('~ {0}'.format(name))
+            for field, (a, b) in sorted(changes.items()):
+                print('    {0}: {1} -> {2}'.format(field, a, b))
+
+
 def main():  # pragma: no cover
     parser = argparse.ArgumentParser(prog='appconfig', description='')
-    parser.add_argument('command', choices=['ls', 'test_error'])
+    parser.add_argument(
+        'command', choices=['ls', 'test_error', 'smoke', 'fleet', 'render', 'diff'])
     parser.add_argument('args', nargs=argparse.REMAINDER)
     args = parser.parse_args()
 
@@ -66,5 +225,15 @@ def main():  # pragma: no cover
         ls(args.args)
     elif args.command == 'test_error':
         test_error(args.args[0])
+    elif args.command == 'smoke':
+        if smoke(args.args):
+            sys.exit(1)
+    elif args.command == 'fleet':
+        if fleet(args.args):
+            sys.exit(1)
+    elif args.command == 'render':
+        render(args.args)
+    elif args.command == 'diff':
+        diff(args.args)
     else:
         raise NotImplementedError
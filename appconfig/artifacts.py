@@ -0,0 +1,104 @@
+# artifacts.py - build native dependencies once, copy them to the hosts
+
+"""Natively compiled dependencies of apps - like bibutils or the pg_collkey extension - built
+once per platform and cached as tarballs.
+
+Compiling such a dependency on every host requires build tools and takes time. Instead, an
+`Artifacts` cache
+
+- builds an artifact on the first host which lacks it, installing it into a staging directory,
+- packs the staging directory into a tarball, which is downloaded and cached locally - keyed by
+  name, version and platform, e.g. distro codename and PostgreSQL version - with its checksum,
+- uploads the cached tarball to other hosts of the same platform, where it is unpacked into `/`
+  if its checksum matches.
+"""
+import shutil
+import hashlib
+import pathlib
+import tempfile
+
+from fabric.api import env, settings, hide
+
+from . import CACHE_DIR
+
+__all__ = ['Artifacts', 'file_checksum']
+
+REMOTE_DIR = '/tmp/appconfig-artifacts'
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with pathlib.Path(path).open('rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Artifacts(object):
+    """Local cache of artifact tarballs.
+
+    :param directory: Local cache directory, defaults to a subdirectory of `CACHE_DIR`.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = pathlib.Path(directory or CACHE_DIR / 'artifacts')
+
+    def path(self, *key):
+        """Local path of the tarball of the artifact identified by `key`, e.g. name and version."""
+        return self.directory / '{0}.tar.gz'.format('-'.join(key))
+
+    def cached(self, *key):
+        """Whether the tarball for `key` is cached - and matches the checksum it was cached with."""
+        path = self.path(*key)
+        checksum = path.with_name(path.name + '.sha256')
+        return path.exists() and checksum.exists() and \
+            checksum.read_text(encoding='ascii').strip() == file_checksum(path)
+
+    def require(self, key, build, sudo=None, put=None, get=None):
+        """Install the artifact for `key` on the current host, building it if it isn't cached.
+
+        :param key: `tuple` of strings identifying the artifact.
+        :param build: Callable building the artifact, installing it into the staging directory \
+        it is passed.
+        :return: `bool` indicating whether the artifact was built.
+        """
+        if sudo is None:
+            from fabric.api import sudo
+        remote = '{0}/{1}'.format(REMOTE_DIR, self.path(*key).name)
+        built = not self.cached(*key)
+        if built:
+            self._build(key, build, remote, sudo, get)
+            if env.get('appconfig_plan'):  # Nothing has been built, thus nothing to install.
+                return built
+        else:
+            if put is None:
+                from fabric.api import put
+            sudo('mkdir -p {0}'.format(REMOTE_DIR))
+            put(str(self.path(*key)), remote, use_sudo=True)
+        # --no-overwrite-dir: The staging directory must not alter existing directories like /usr.
+        sudo('echo "{0}  {1}" | sha256sum -c --quiet && tar xzf {1} --no-overwrite-dir -C / '
+             '&& rm -f {1}'.format(file_checksum(self.path(*key)), remote))
+        return built
+
+    def _build(self, key, build, remote, sudo, get):
+        if get is None:
+            from fabric.api import get
+        stage = '{0}/{1}'.format(REMOTE_DIR, '-'.join(key))
+        sudo('rm -rf {0} && mkdir -p {0}'.format(stage))
+        build(stage)
+        sudo('cd {0} && tar czf {1} $(ls -A) && cd / && rm -rf {0}'.format(stage, remote))
+        if env.get('appconfig_plan'):
+            return
+
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix='appconfig-artifacts-'))
+        try:
+            with settings(hide('running')):
+                get(remote, str(tmp / 'artifact.tar.gz'))
+            path = self.path(*key)
+            if not path.parent.exists():
+                path.parent.mkdir(parents=True)
+            shutil.move(str(tmp / 'artifact.tar.gz'), str(path))
+            path.with_name(path.name + '.sha256').write_text(
+                file_checksum(path) + '\n', encoding='ascii')
+        finally:
+            shutil.rmtree(str(tmp))
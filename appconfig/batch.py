@@ -0,0 +1,151 @@
+# batch.py - run queued remote commands in one round trip
+
+"""Batches of idempotent remote commands, run as one generated shell script per host.
+
+Steps like `deployment.http_auth` or `systemd.enable` issue many small commands, each costing
+a round trip. Queued in a `Batch`, they are shipped as one script - run with a single `sudo` -
+which reports exit status and output per command, so results can still be inspected one by
+one. The script stops at the first failing command; if the script itself fails - e.g. sudo or
+the connection - a `BatchError` is raised as well.
+
+Only some steps queue their commands: deb packages, the app user, its directories and log
+directory (in one batch per deploy), `http_auth` with the nginx directories, the postgres role,
+database and extensions, supervisor updates with the nginx reload, and `systemd`. Most remote
+commands of a deploy - e.g. of the venv and assets phases - still come from fabtools' `require`
+functions, which inspect the host one command at a time; `benchmarks/remote_commands.py` counts
+commands per phase.
+
+Setting `env.appconfig_batch = False` (e.g. `fab --set appconfig_batch=` ...) runs the queued
+commands one by one instead, which may help debugging. This is also done in plan mode (see
+`appconfig.session`), to list the commands one by one.
+"""
+import re
+import base64
+import shlex
+import collections
+
+from fabric.api import env, settings, hide
+from fabric.state import output
+
+__all__ = ['Batch', 'Result', 'BatchError']
+
+MARKER = '@@appconfig-batch'
+
+
+class Result(collections.namedtuple('Result', 'command user return_code output')):
+    """Outcome of a queued command; `return_code` is `None` if the command didn't run."""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+
+class BatchError(RuntimeError):
+    def __init__(self, result):
+        self.result = result
+        super(BatchError, self).__init__(
+            'batched command failed with return code {0}: {1}\n{2}'.format(
+                result.return_code, result.command, result.output))
+
+
+class Batch(object):
+    """Queue of remote commands, run as root (or as `user` per command) upon `run`."""
+
+    def __init__(self):
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, command, user=None):
+        self.commands.append((command, user))
+        return self
+
+    def directory(self, path, owner='', group='', mode=''):
+        self.add('mkdir -p "{0}"'.format(path))
+        if owner or group:
+            self.add('chown {0}:{1} "{2}"'.format(owner, group, path))
+        if mode:
+            self.add('chmod {0} "{1}"'.format(mode, path))
+        return self
+
+    def user(self, name, shell='/bin/bash'):
+        """Create user `name` with a home directory - or set the shell of an existing one."""
+        return self.add(
+            'if id -u {0} >/dev/null 2>&1; then usermod -s {1} {0}; '
+            'else useradd --create-home -s {1} {0}; fi'.format(name, shell))
+
+    def packages(self, names):
+        """Install those of the deb packages `names` which are missing."""
+        self.add(
+            'missing=$(for p in {0}; do dpkg -s $p >/dev/null 2>&1 || echo $p; done); '
+            '[ -z "$missing" ] || DEBIAN_FRONTEND=noninteractive '
+            'apt-get install --quiet --assume-yes $missing'.format(' '.join(names)))
+        return self
+
+    def script(self):
+        lines = ['#!/bin/bash']
+        for i, (command, user) in enumerate(self.commands):
+            if user:
+                command = 'sudo -H -u {0} bash -c {1}'.format(user, shlex.quote(command))
+            lines.extend([
+                'out=$( {{ {0} ; }} 2>&1 < /dev/null ); rc=$?'.format(command),
+                'echo "{0} {1} $rc $(printf %s "$out" | base64 -w0)"'.format(MARKER, i),
+                '[ $rc -eq 0 ] || exit $rc',
+            ])
+        return '\n'.join(lines) + '\n'
+
+    def parse(self, stdout):
+        results = [Result(command, user, None, '') for command, user in self.commands]
+        pattern = re.compile(r'{0} (?P<i>[0-9]+) (?P<rc>[0-9]+) ?(?P<out>\S*)'.format(MARKER))
+        for line in stdout.splitlines():
+            m = pattern.match(line.strip())
+            if m:
+                i = int(m.group('i'))
+                results[i] = results[i]._replace(
+                    return_code=int(m.group('rc')),
+                    output=base64.b64decode(m.group('out')).decode('utf-8', errors='replace'))
+        return results
+
+    def run(self, sudo=None, warn_only=False):
+        """Run the queued commands with a single call of `sudo` and empty the queue.
+
+        :param sudo: The function to run commands with, defaults to `fabric.api.sudo`.
+        :return: `list` of `Result`s, one per queued command.
+        :raises BatchError: if a command failed, unless `warn_only` is set.
+        """
+        if sudo is None:
+            from fabric.api import sudo
+        if not self.commands:
+            return []
+
+        if not env.get('appconfig_batch', True) or env.get('appconfig_plan'):
+            results = []
+            with settings(warn_only=True):
+                for command, user in self.commands:
+                    out = sudo(command, user=user)
+                    results.append(Result(
+                        command, user, getattr(out, 'return_code', 0), '{0}'.format(out)))
+                    if not results[-1].ok:
+                        break
+            results.extend(Result(c, u, None, '') for c, u in self.commands[len(results):])
+        else:
+            if output.running:
+                for command, user in self.commands:
+                    print('[{0}] batch: {1}'.format(env.host_string, command))
+            script = base64.b64encode(self.script().encode('utf-8')).decode('ascii')
+            with settings(hide('running', 'stdout'), warn_only=True):
+                out = sudo('echo {0} | base64 -d | bash'.format(script))
+            results = self.parse('{0}'.format(out))
+            if getattr(out, 'failed', False) and all(r.return_code in (0, None) for r in results):
+                # The script itself failed, e.g. sudo or the connection - not a queued command:
+                self.commands = []
+                raise BatchError(Result('batch script', None, out.return_code, '{0}'.format(out)))
+        self.commands = []
+
+        for res in results:
+            if res.return_code not in (0, None) and not warn_only:
+                raise BatchError(res)
+        return results
@@ -1,13 +1,18 @@
 import os
+import pathlib
 
 from pycdstar.api import Cdstar
 from cdstarcat.resources import RollingBlob
 from clldutils.misc import format_size
 
+from . import chunks
+
 SERVICE_URL = os.environ.get('CDSTAR_URL')
 USER = os.environ.get('CDSTAR_USER')
 PWD = os.environ.get('CDSTAR_PWD')
 
+MANIFEST_SUFFIX = '.chunks.json'
+
 
 class NamedBitstream(object):
     def __init__(self, oid, bs):
@@ -22,6 +27,13 @@ class NamedBitstream(object):
     def size(self):
         return self.bitstream._properties['filesize']
 
+    @property
+    def md5(self):
+        """MD5 checksum of the bitstream as computed by CDSTAR - or `None`."""
+        props = self.bitstream._properties
+        if props.get('checksum-algorithm', '').upper() == 'MD5':
+            return props.get('checksum')
+
     @property
     def size_h(self):
         return format_size(self.size)
@@ -34,6 +46,14 @@ class NamedBitstream(object):
     def name(self):
         return self.bitstream.id
 
+    @property
+    def is_manifest(self):
+        """Whether the bitstream is the manifest of a deduplicated backup."""
+        return self.name.endswith(MANIFEST_SUFFIX)
+
+    def read_manifest(self):
+        return chunks.Manifest.from_json(self.bitstream.read().decode('utf8'))
+
 
 def get_api():
     return Cdstar(service_url=SERVICE_URL, user=USER, password=PWD)
@@ -61,3 +81,72 @@ def add_bitstream(oid, fname):
     # Add the sql dump as latest bitstream ...
     rb.add(api, str(fname))
     rb.expunge(api, keep=10)
+
+
+def get_chunk_store(oid, create=False):
+    """The object storing the chunks of deduplicated backups in `oid` - as listed in its metadata.
+
+    :param create: Create the chunk store, if `oid` has none yet.
+    """
+    api = get_api()
+    obj = api.get_object(oid)
+    md = obj.metadata.read()
+    if md.get('chunks'):
+        return api.get_object(md['chunks'])
+    if create:
+        store = api.get_object()
+        store.metadata = {
+            'collection': md.get('collection'),
+            'name': '{0} chunks'.format(md.get('name')),
+            'type': 'ChunkStore'}
+        add_backup_user(store.id)
+        obj.metadata = dict(md, chunks=store.id)
+        return store
+
+
+def get_chunk_urls(oid, manifest):
+    """URLs of the chunks of the backup described by `manifest`, in order."""
+    store = get_chunk_store(oid)
+    return ['{0}/bitstreams/{1}/{2}'.format(SERVICE_URL, store.id, name)
+            for name in manifest.names]
+
+
+def get_chunks(oid):
+    """Names of the chunks stored for deduplicated backups in `oid`."""
+    store = get_chunk_store(oid)
+    return {bs.id for bs in store.bitstreams} if store else set()
+
+
+def add_chunked_backup(oid, manifest, directory, new):
+    """Upload the `new` chunks in `directory`, then add `manifest` as latest bitstream to `oid`."""
+    store = get_chunk_store(oid, create=True)
+    directory = pathlib.Path(directory)
+    for name in new:
+        store.add_bitstream(name=name, fname=str(directory / name), mimetype='application/gzip')
+    fname = directory / 'manifest.json'
+    fname.write_text(manifest.to_json(), encoding='utf8')
+    rb = RollingBlob(oid=oid)
+    api = get_api()
+    rb.add(api, str(fname), suffix=MANIFEST_SUFFIX, mimetype='application/json')
+    rb.expunge(api, keep=10)
+    expunge_chunks(oid)
+
+
+def expunge_chunks(oid):
+    """Delete the chunks which are not referenced by any remaining backup in `oid`.
+
+    :return: Number of deleted chunks.
+    """
+    store = get_chunk_store(oid)
+    if not store:
+        return 0
+    referenced = set()
+    for bs in get_bitstreams(oid):
+        if bs.is_manifest:
+            referenced.update(bs.read_manifest().names)
+    deleted = 0
+    for bs in store.bitstreams:
+        if bs.id not in referenced:
+            bs.delete()
+            deleted += 1
+    return deleted
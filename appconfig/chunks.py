@@ -0,0 +1,150 @@
+# chunks.py - deduplicated backups of SQL dumps
+
+"""Split SQL dumps into content-defined chunks, so successive backups only store what changed.
+
+Successive dumps of a database are mostly identical - but a changed row shifts all following
+bytes, so fixed-size chunks would all change. Instead, chunk boundaries are defined by the content:
+A chunk ends after a line whose CRC-32 matches `MASK` - provided the chunk has at least `MIN_SIZE`
+bytes - or at `MAX_SIZE` bytes. An inserted or changed row thus only changes the chunk it is in.
+
+Chunks are stored as gzip files named by the sha256 sum of their content; a backup is a
+`Manifest`, listing the chunks in order. Since concatenated gzip files are a valid gzip stream,
+a backup is restored by downloading its chunks in order - piping them through `gzip -dc` - and
+verified while it is restored, see `verified_command`.
+"""
+import gzip
+import shlex
+import json
+import zlib
+import hashlib
+import pathlib
+import collections
+
+__all__ = ['Manifest', 'Chunker', 'chunk_name', 'curl_config', 'verified_command']
+
+# Statements appended to a restored SQL stream which doesn't match its manifest. For PostgreSQL,
+# `\.` ends a COPY which may have been cut off - or fails by itself; `psql -1` then rolls back:
+PG_ERROR = "\\.\nDO $$ BEGIN RAISE EXCEPTION 'dump does not match its manifest'; END $$;"
+MYSQL_ERROR = ";\nSELECT * FROM `dump does not match its manifest`;"
+
+
+MIN_SIZE = 256 * 1024
+# One line in 8192 ends a chunk, i.e. chunks of ~1MB for typical rows of ~100 bytes:
+MASK = 0x1fff
+MAX_SIZE = 4 * 1024 * 1024
+FORMAT = 'appconfig-chunks-1'
+
+
+class Manifest(collections.namedtuple('Manifest', 'size sha256 chunks')):
+    """A backup: Its `size` and `sha256` sum, and the chunks - pairs (sha256, size) - in order."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, text):
+        d = json.loads(text)
+        if d.get('format') != FORMAT:
+            raise ValueError('unknown manifest format: %r' % d.get('format'))
+        return cls(d['size'], d['sha256'], [tuple(c) for c in d['chunks']])
+
+    def to_json(self):
+        return json.dumps(collections.OrderedDict([
+            ('format', FORMAT),
+            ('size', self.size),
+            ('sha256', self.sha256),
+            ('chunks', [list(c) for c in self.chunks])]))
+
+    @property
+    def names(self):
+        return [chunk_name(digest) for digest, _ in self.chunks]
+
+
+def chunk_name(digest):
+    return '{0}.gz'.format(digest)
+
+
+class Chunker(object):
+    """Binary file object splitting what is written to it into chunks.
+
+    Chunks which are not `known` are written - gzipped - to `directory`.
+
+    :param known: Names of chunks which are stored already.
+    """
+
+    def __init__(self, directory, known=(), min_size=MIN_SIZE, mask=MASK, max_size=MAX_SIZE):
+        self.directory = pathlib.Path(directory)
+        self.known = set(known)
+        self.min_size, self.mask, self.max_size = min_size, mask, max_size
+        self.new = []
+        self._chunks = []
+        self._digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._lines, self._size, self._total = [], 0, 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self._total += len(data)
+        buf, start = self._buffer, 0
+        buf.extend(data)
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+            self._add(bytes(buf[start:end + 1]))
+            start = end + 1
+        del buf[:start]
+        while len(buf) >= self.max_size:  # Very long lines, or no lines at all.
+            self._add(bytes(buf[:self.max_size]), boundary=True)
+            del buf[:self.max_size]
+        return len(data)
+
+    def _add(self, line, boundary=False):
+        self._lines.append(line)
+        self._size += len(line)
+        if boundary or self._size >= self.max_size or \
+                (self._size >= self.min_size and zlib.crc32(line) & self.mask == self.mask):
+            self._cut()
+
+    def _cut(self):
+        data = b''.join(self._lines)
+        self._lines, self._size = [], 0
+        digest = hashlib.sha256(data).hexdigest()
+        self._chunks.append((digest, len(data)))
+        name = chunk_name(digest)
+        if name not in self.known:
+            self.known.add(name)
+            self.new.append(name)
+            self.directory.joinpath(name).write_bytes(gzip.compress(data))
+
+    def close(self):
+        """Write the last chunk.
+
+        :return: The `Manifest` of all data written.
+        """
+        if self._buffer:
+            self._add(bytes(self._buffer))
+            self._buffer = bytearray()
+        if self._lines:
+            self._cut()
+        return Manifest(self._total, self._digest.hexdigest(), self._chunks)
+
+
+def curl_config(urls):
+    """Config file for `curl -K`, downloading `urls` one after the other to stdout."""
+    return ''.join('url = "{0}"\n'.format(url) for url in urls)
+
+
+def verified_command(command, manifest, error=PG_ERROR):
+    """Shell command writing the output of `command` - followed by `error` unless the output has
+    the size and sha256 sum of `manifest`.
+
+    Piped into an SQL client which stops at the first error - e.g. `psql -1 -v ON_ERROR_STOP=1`
+    - a dump is verified while it is restored, without storing it on the host.
+    """
+    return (
+        '(set -o pipefail; d=$(mktemp -d) && mkfifo $d/sha256 $d/size && {{ '
+        'sha256sum < $d/sha256 > $d/sha256.txt & wc -c < $d/size > $d/size.txt & '
+        '{0} | tee $d/sha256 $d/size; rc=$?; wait; '
+        '[ $rc -eq 0 ] && [ "$(cut -c1-64 $d/sha256.txt)" = {1} ] '
+        '&& [ "$(cat $d/size.txt)" -eq {2} ] || printf "\\n%s\\n" {3}; rm -rf $d; }})'.format(
+            command, manifest.sha256, manifest.size, shlex.quote(error)))
@@ -0,0 +1,82 @@
+# compression.py - compression codecs for dumps and transfers
+
+"""Compression codecs, as shell commands compressing stdin to stdout - and back.
+
+- `gzip`: compatible with everything, but single-threaded,
+- `pigz`: gzip format, compressed with one thread per core,
+- `zstd`: faster and smaller than gzip, multi-threaded,
+- `none`: for fast links, where compression costs more time than it saves.
+
+Compressed files are recognized by their extension - or, if that is unknown, e.g. for dumps
+stored in CDSTAR without extension, by the magic number at the start of the file.
+"""
+import shlex
+import shutil
+import collections
+
+__all__ = [
+    'Codec', 'CODECS', 'FAST_LEVEL', 'get_codec', 'local_gzip', 'gzip_command', 'from_suffix',
+    'decompress_command']
+
+# A low compression level, for dumps which are transferred once rather than archived:
+FAST_LEVEL = 1
+
+
+class Codec(collections.namedtuple('Codec', 'name suffix compress decompress magic')):
+    """`compress` and `decompress` are shell commands; `magic` the first bytes of the output."""
+
+    __slots__ = ()
+
+    def compress_command(self, level=None, threads=0):
+        """
+        :param threads: Number of threads of multi-threaded codecs, `0` meaning one per core.
+        """
+        return self.compress.format(
+            level=' -{0}'.format(level) if level else '',
+            threads=threads or '$(nproc)',
+            zstd_threads=threads)
+
+
+CODECS = collections.OrderedDict((c.name, c) for c in [
+    Codec('gzip', '.gz', 'gzip -c{level}', 'gzip -dc', b'\x1f\x8b'),
+    Codec('pigz', '.gz', 'pigz -c{level} -p {threads}', 'pigz -dc', b'\x1f\x8b'),
+    Codec('zstd', '.zst', 'zstd -c -q{level} -T{zstd_threads}', 'zstd -dc -q', b'\x28\xb5\x2f\xfd'),
+    Codec('none', '', 'cat', 'cat', b''),
+])
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('unknown codec: %r' % name)
+
+
+def local_gzip():
+    """The codec writing gzip format - which any host reads - locally: pigz, if installed."""
+    return CODECS['pigz'] if shutil.which('pigz') else CODECS['gzip']
+
+
+def gzip_command(level=FAST_LEVEL):
+    """Shell command compressing stdin to gzip format on a host - with pigz, if installed."""
+    return '$(command -v pigz || command -v gzip) -c -{0}'.format(level)
+
+
+def from_suffix(path):
+    """The codec to decompress the file at `path` with - or `None` for unknown extensions."""
+    for codec in CODECS.values():
+        if codec.suffix and str(path).endswith(codec.suffix):
+            return codec
+
+
+def decompress_command(path):
+    """Shell command writing the decompressed content of the file at `path` to stdout."""
+    codec = from_suffix(path)
+    if codec:
+        return '{0} < {1}'.format(codec.decompress, shlex.quote(str(path)))
+    # Sniff the magic number:
+    cases = ' '.join(
+        '{0}*) {1};;'.format(c.magic.hex(), c.decompress) for c in CODECS.values()
+        if c.magic and c.name != 'pigz')
+    return 'case $(head -c 4 {0} | od -An -tx1 | tr -d " \\n") in {1} *) cat;; esac < {0}'.format(
+        shlex.quote(str(path)), cases)
@@ -9,36 +9,154 @@
     - ssh config
     - environment variables
 """
-import copy
-import argparse
+import os
+import json
+import types
+import fnmatch
+import hashlib
 import warnings
+import collections
 import configparser
 import pathlib
 
-from . import helpers
 
-__all__ = ['Config']
+__all__ = ['Config', 'LazyConfig']
+
+SNAPSHOT_VERSION = 1
+
+Slot = collections.namedtuple('Slot', 'name program port pid')
 
 
 class Config(dict):
     cfg = None
+    _defaults = None
+    _indexes = None
 
     @property
     def defaults(self):
         if self.cfg:
             return self.cfg['DEFAULT']
+        return self._defaults
+
+    def index(self, attr):
+        """Read-only mapping of (non-empty) values of App attribute `attr` to tuples of apps.
+
+        Indexes are built upon first access and discarded whenever the config is modified.
+        """
+        if self._indexes is None:
+            self._indexes = {}
+        if attr not in self._indexes:
+            index = {}
+            for app in self.values():
+                value = getattr(app, attr)
+                if value:
+                    index.setdefault(value, []).append(app)
+            self._indexes[attr] = types.MappingProxyType(
+                {k: tuple(v) for k, v in index.items()})
+        return self._indexes[attr]
+
+    @property
+    def by_production(self):
+        return self.index('production')
+
+    @property
+    def by_test(self):
+        return self.index('test')
+
+    @property
+    def by_stack(self):
+        return self.index('stack')
+
+    @property
+    def by_domain(self):
+        return self.index('domain')
+
+    @property
+    def by_port(self):
+        return self.index('port')
 
     @property
     def production_hosts(self):
-        return set(app.production for app in self.values())
+        return set(self.by_production)
+
+    def select(self, environment='production', host=None, stack=None, pattern=None):
+        """Select apps deployed in `environment`, sorted by name.
+
+        :param host: Only select apps deployed to `host` in `environment`.
+        :param stack: Only select apps of `stack`.
+        :param pattern: Only select apps with names matching the shell-style wildcard `pattern`.
+        """
+        if host is not None:
+            apps = self.index(environment).get(host, ())
+        else:
+            apps = [app for app in self.values() if getattr(app, environment)]
+        if stack is not None:
+            apps = [app for app in apps if app.stack == stack]
+        if pattern is not None:
+            apps = [app for app in apps if fnmatch.fnmatchcase(app.name, pattern)]
+        return sorted(apps, key=lambda app: app.name)
+
+    def _invalidate(self):
+        self._indexes = None
+
+    def __setitem__(self, key, value):
+        self._invalidate()
+        super(Config, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._invalidate()
+        super(Config, self).__delitem__(key)
+
+    def clear(self):
+        self._invalidate()
+        super(Config, self).clear()
+
+    def pop(self, *args):
+        self._invalidate()
+        return super(Config, self).pop(*args)
+
+    def popitem(self):
+        self._invalidate()
+        return super(Config, self).popitem()
+
+    def setdefault(self, *args):
+        self._invalidate()
+        return super(Config, self).setdefault(*args)
+
+    def update(self, *args, **kwargs):
+        self._invalidate()
+        super(Config, self).update(*args, **kwargs)
 
     @classmethod
-    def from_file(cls, filepath, value_cls=None, validate=True):
+    def from_file(cls, filepath, value_cls=None, validate=True, sections=None):
+        """Load config from an ini file or an `apps.d` directory (see `source_files`).
+
+        :param sections: Names of the only apps to load, or `None` to load all apps.
+        """
+        return cls.from_parser(
+            ConfigParser.from_files(source_files(filepath, sections)),
+            value_cls=value_cls, validate=validate, sections=sections)
+
+    @classmethod
+    def from_string(cls, text, value_cls=None, validate=True, defaults=None):
+        """Load config from the text of an ini file.
+
+        :param defaults: Raw default settings for those missing in `text` - e.g. to read an old \
+        revision of the config, predating settings which were added since.
+        """
+        parser = ConfigParser.from_string(text)
+        for k, v in (defaults or {}).items():
+            if k not in parser.defaults():
+                parser.set('DEFAULT', k, v)
+        return cls.from_parser(parser, value_cls=value_cls, validate=validate)
+
+    @classmethod
+    def from_parser(cls, parser, value_cls=None, validate=True, sections=None):
         if value_cls is None:
             value_cls = App
-        parser = ConfigParser.from_file(filepath)
-        items = {s: value_cls(**parser[s]) for s in parser.sections()
-                if not s.startswith('_')}
+        if sections is None:
+            sections = [s for s in parser.sections() if not s.startswith('_')]
+        items = {s: value_cls(**parser[s]) for s in sections}
         inst = cls(items)
         inst.hostnames = [h for _, h in parser.raw_items('_hosts')]
         if validate:
@@ -46,18 +164,196 @@ class Config(dict):
         inst.cfg = parser
         return inst
 
+    @classmethod
+    def from_snapshot(cls, filepath, cache_dir, value_cls=None, validate=True):
+        """Load config from a compiled snapshot of `filepath` stored in `cache_dir`.
+
+        The snapshot holds the fully interpolated sections, keyed on a hash of the
+        config file(s), so re-loading an unchanged config skips parsing and interpolation.
+        A stale or missing snapshot is recreated; an unwritable `cache_dir` is ignored.
+        """
+        if value_cls is None:
+            value_cls = App
+        filepath = pathlib.Path(filepath)
+        filepaths = source_files(filepath)
+        digest = hashlib.sha256()
+        for p in filepaths:
+            digest.update(p.name.encode('utf-8'))
+            digest.update(p.read_bytes())
+        digest = digest.hexdigest()
+        snapshot = pathlib.Path(cache_dir) / '{0}.json'.format(
+            hashlib.sha1(str(filepath.resolve()).encode('utf-8')).hexdigest())
+
+        data = _read_snapshot(snapshot, digest)
+        if data is None:
+            data = _compile_snapshot(ConfigParser.from_files(filepaths), digest)
+            _write_snapshot(snapshot, data)
+
+        inst = cls({s: value_cls(**kw) for s, kw in data['sections'].items()})
+        inst.hostnames = data['hostnames']
+        inst._defaults = data['defaults']
+        if validate:
+            inst.validate()
+        return inst
+
+    def diff(self, other):
+        """Compare the fully interpolated apps of this config with those of `other`.
+
+        :return: `dict` mapping names of apps which differ to `dict`s mapping changed fields to \
+        pairs `(value in self, value in other)`. For apps missing from one of the configs, all \
+        fields are reported, with `None` as value on the missing side.
+        """
+        res = {}
+        for name in set(self) | set(other):
+            old, new = self.get(name), other.get(name)
+            old = old._asdict() if old is not None else dict.fromkeys(new._fields)
+            new = new._asdict() if new is not None else dict.fromkeys(old)
+            changes = {k: (v, new[k]) for k, v in old.items() if v != new[k]}
+            if changes:
+                res[name] = changes
+        return res
+
     def validate(self):
         mismatch = [(name, app.name) for name, app in self.items() if name != app.name]
         if mismatch:
             raise ValueError('section/name mismatch: %r' % mismatch)
-        duplicates = helpers.duplicates([app.port for app in self.values()])
+        duplicates = [port for port, apps in self.by_port.items() if len(apps) > 1]
         if duplicates:
             raise ValueError('duplicate port(s): %r' % duplicates)
+        releases = [app.name for app in self.values()
+                    if app.venv_releases and app.venv_bin != app.venv_dir / 'current' / 'bin']
+        if releases:
+            raise ValueError('venv_releases require venv_bin in ${venv_dir}/current: %r' % releases)
+        green_ports = [app.green_port for app in self.values() if app.green_port]
+        duplicates = sorted(
+            p for p in set(green_ports) if p in self.by_port or green_ports.count(p) > 1)
+        if duplicates:
+            raise ValueError('duplicate green port(s): %r' % duplicates)
         for app in self.values():
             if not app.fabfile_dir.exists():
                 warnings.warn('missing fabfile dir: %s' % app.name)
 
 
+def source_files(path, sections=None):
+    """List the ini files making up the config at `path`.
+
+    `path` may be a single ini file or a directory in `apps.d` layout, i.e. containing
+    - shared files, named `_*.ini`, providing `[DEFAULT]` and `[_hosts]`, and
+    - one file `<name>.ini` per app, providing section `[<name>]`.
+    For a directory, only the shared files and the files for `sections` are listed, unless
+    `sections` is `None`.
+    """
+    path = pathlib.Path(path)
+    if not path.is_dir():
+        return [path]
+    shared = sorted(path.glob('_*.ini'))
+    if sections is None:
+        return shared + sorted(p for p in path.glob('*.ini') if not p.name.startswith('_'))
+    return shared + [p for p in (path / '{0}.ini'.format(s) for s in sections) if p.exists()]
+
+
+def load_app(filepath, name, value_cls=None):
+    """Load only the app `name` from the config at `filepath`."""
+    return Config.from_file(filepath, value_cls=value_cls, sections=[name])[name]
+
+
+def _compile_snapshot(parser, digest):
+    defaults = {}
+    for k in parser.defaults():
+        try:
+            defaults[k] = parser['DEFAULT'][k]
+        except configparser.Error:  # interpolation requires a section, e.g. ${name}
+            continue
+    return {
+        'version': SNAPSHOT_VERSION,
+        'sha256': digest,
+        'sections': {s: dict(parser[s]) for s in parser.sections() if not s.startswith('_')},
+        'hostnames': [h for _, h in parser.raw_items('_hosts')],
+        'defaults': defaults,
+    }
+
+
+def _read_snapshot(path, digest):
+    try:
+        with path.open(encoding='utf-8') as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') == SNAPSHOT_VERSION and data.get('sha256') == digest:
+        return data
+
+
+def _write_snapshot(path, data):
+    tmp = path.with_name('{0}.{1}.tmp'.format(path.name, os.getpid()))
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open('w', encoding='utf-8') as fp:
+            json.dump(data, fp)
+        os.replace(str(tmp), str(path))
+    except OSError:  # pragma: no cover
+        pass  # A missing snapshot only costs time.
+
+
+class LazyConfig(object):
+    """Proxy for a `Config`, which is loaded by calling `loader` upon first access.
+
+    If `app_loader` is given, looking up single apps by name - e.g. in `tasks.init` - only
+    loads the requested app, by calling `app_loader(name)`, until the full config is loaded.
+    """
+
+    def __init__(self, loader, app_loader=None):
+        self._loader = loader
+        self._app_loader = app_loader
+        self._config = None
+        self._apps = {}
+
+    @property
+    def loaded(self):
+        return self._config is not None
+
+    def load(self):
+        if self._config is None:
+            self._config = self._loader()
+        return self._config
+
+    def reload(self):
+        self._config = None
+        self._apps = {}
+        return self.load()
+
+    def __getattr__(self, name):
+        if name in ('_loader', '_app_loader', '_config', '_apps'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __getitem__(self, key):
+        if self._config is None and self._app_loader is not None:
+            if key not in self._apps:
+                self._apps[key] = self._app_loader(key)
+            return self._apps[key]
+        return self.load()[key]
+
+    def __contains__(self, key):
+        if self._config is None and self._app_loader is not None:
+            try:
+                self[key]
+            except KeyError:
+                return False
+            return True
+        return key in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __repr__(self):
+        if self._config is None:
+            return '<%s (not loaded)>' % self.__class__.__name__
+        return '<%s %r>' % (self.__class__.__name__, sorted(self._config))
+
+
 class ConfigParser(configparser.ConfigParser):
 
     _init_defaults = {
@@ -76,6 +372,20 @@ class ConfigParser(configparser.ConfigParser):
             self.read_file(fd)
         return self
 
+    @classmethod
+    def from_files(cls, filepaths, encoding='utf-8-sig', **kwargs):
+        self = cls(**kwargs)
+        for filepath in filepaths:
+            with pathlib.Path(filepath).open(encoding=encoding) as fd:
+                self.read_file(fd)
+        return self
+
+    @classmethod
+    def from_string(cls, text, **kwargs):
+        self = cls(**kwargs)
+        self.read_string(text)
+        return self
+
     def __init__(self, defaults=None, **kwargs):
         for k, v in self._init_defaults.items():
             kwargs.setdefault(k, v)
@@ -91,10 +401,15 @@ def getboolean(s):
 
 
 def getwords(s):
-    return s.strip().split()
+    return tuple(s.strip().split())
+
 
+class App(object):
+    """Immutable record of the settings of one app, i.e. one section of apps.ini.
 
-class App(argparse.Namespace):
+    Values are stored in slots rather than a per-instance `__dict__`; since records can't be
+    modified, `replace` shares all unchanged values with the original.
+    """
 
     _fields = dict.fromkeys([
         'name', 'test', 'production',
@@ -106,6 +421,7 @@ class App(argparse.Namespace):
 
     _fields.update({
         'port': int,
+        'green_port': int,
         'public': getboolean,
         'with_admin': getboolean,
         'with_blog': getboolean,
@@ -113,11 +429,13 @@ class App(argparse.Namespace):
         'workers': int,
         'timeout': int,
         'deploy_duration': int,
+        'venv_releases': int,
         'require_deb_xenial': getwords,
         'require_deb': getwords,
         'require_pip': getwords,
         'pg_collkey': getboolean,
         'pg_unaccent': getboolean,
+        'smoke_urls': getwords,
     })
 
     _fields.update(dict.fromkeys([
@@ -133,32 +451,78 @@ class App(argparse.Namespace):
         'varnish_site',
     ], pathlib.PurePosixPath))
 
+    __slots__ = tuple(_fields)
+
     def __init__(self, **kwargs):
-        kw = self._fields.copy()
-        for k, f in list(kw.items()):
+        for k, f in self._fields.items():
             try:
                 value = kwargs.pop(k)
             except KeyError:
                 raise ValueError('missing attribute %r' % k)
-            kw[k] = f(value) if f is not None else value
+            object.__setattr__(self, k, f(value) if f is not None else value)
         if kwargs:
             raise ValueError('unknown attribute(s) %r' % kwargs)
-        super(App, self).__init__(**kw)
 
     def replace(self, **kwargs):
-        old, new = self.__dict__, self._fields.copy()
-        for k, f in list(new.items()):
+        unknown = {k: v for k, v in kwargs.items() if k not in self._fields}
+        if unknown:
+            raise ValueError('unknown attribute(s) %r' % unknown)
+        inst = object.__new__(self.__class__)
+        for k, f in self._fields.items():
             if k in kwargs:
-                value = f(kwargs.pop(k)) if f is not None else kwargs.pop(k)
+                value = f(kwargs[k]) if f is not None else kwargs[k]
             else:
-                value = copy.copy(old[k])
-            new[k] = value
-        if kwargs:
-            raise ValueError('unknown attribute(s) %r' % kwargs)
-        inst = object.__new__(self.__class__)
-        inst.__dict__ = new
+                value = getattr(self, k)
+            object.__setattr__(inst, k, value)
         return inst
 
+    def _asdict(self):
+        return {k: getattr(self, k) for k in self._fields}
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __getstate__(self):
+        return self._asdict()
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
+
+    def __eq__(self, other):
+        if not isinstance(other, App):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self._fields)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, k) for k in self._fields))
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            self.__class__.__name__,
+            ', '.join('%s=%r' % (k, getattr(self, k)) for k in self._fields))
+
+    @property
+    def venv(self):
+        """The virtualenv the app runs in, i.e. the current release if `venv_releases` is set."""
+        return self.venv_bin.parent
+
+    @property
+    def slots(self):
+        """The gunicorn slots of the app, i.e. 'blue' and - if `green_port` is set - 'green'."""
+        res = [Slot('blue', self.name, self.port, self.gunicorn_pid)]
+        if self.green_port:
+            pid = self.gunicorn_pid
+            res.append(Slot('green', '%s-green' % self.name, self.green_port,
+                            pid.with_name('%s-green%s' % (pid.stem, pid.suffix))))
+        return res
+
     @property
     def fabfile_dir(self):
         from . import APPS_DIR
@@ -0,0 +1,116 @@
+# dumps.py - PostgreSQL dump formats
+
+"""Commands to dump and restore PostgreSQL databases in one of three formats:
+
+- `plain`: SQL - compressed with one of the codecs in `appconfig.compression` - restored with
+  `psql`, i.e. one stream, processed by one core,
+- `custom`: pg_dump's compressed archive format, restored with `pg_restore -j`, i.e. loading
+  tables and building indexes in parallel,
+- `directory`: pg_dump's directory format - dumped in parallel, too - packed as tar archive.
+
+The format of a dump is detected from its content, so existing `.sql.gz` dumps - or dumps with
+misleading names - can be restored, too.
+"""
+import os
+import shlex
+
+from . import compression
+
+__all__ = [
+    'FORMATS', 'suffix', 'detect_format', 'detect_command', 'parse_detected', 'jobs',
+    'dump_command', 'restore_command']
+
+FORMATS = ('plain', 'custom', 'directory')
+
+SUFFIXES = {'plain': '.sql', 'custom': '.dump', 'directory': '.dir.tar'}
+
+# Shell command printing the format of the dump file $DUMP:
+DETECT_FORMAT = 'if [ "$(head -c 5 "$DUMP")" = PGDMP ]; then echo custom; ' \
+                'elif [ "$(dd if="$DUMP" bs=1 skip=257 count=5 2> /dev/null)" = ustar ]; ' \
+                'then echo directory; else echo plain; fi'
+
+
+def suffix(dump_format='plain', codec='gzip'):
+    """File name extension for dumps in `dump_format`, compressed with `codec` if plain."""
+    if dump_format == 'plain':
+        return SUFFIXES[dump_format] + compression.get_codec(codec).suffix
+    return SUFFIXES[dump_format]
+
+
+def detect_format(path):
+    """Detect the format of the local dump file at `path`."""
+    with open(str(path), 'rb') as fp:
+        head = fp.read(262)
+    if head.startswith(b'PGDMP'):
+        return 'custom'
+    if head[257:262] == b'ustar':
+        return 'directory'
+    return 'plain'
+
+
+def detect_command(path):
+    """Shell command printing the format of the dump file at `path`."""
+    return 'DUMP={0}; {1}'.format(shlex.quote(str(path)), DETECT_FORMAT)
+
+
+def parse_detected(output):
+    """Parse the output of `detect_command` followed by `nproc`.
+
+    :return: pair (format, number of jobs) - defaulting to plain format and one job.
+    """
+    words = '{0}'.format(output).split()
+    dump_format = words[0] if words and words[0] in FORMATS else 'plain'
+    cores = int(words[1]) if len(words) > 1 and words[1].isdigit() else 1
+    return dump_format, jobs(cores)
+
+
+def jobs(cores):
+    """Number of parallel jobs for a machine with `cores` cores - leaving one for other work."""
+    return max(1, (cores or 1) - 1)
+
+
+def local_jobs():
+    return jobs(os.cpu_count())
+
+
+def dump_command(dbname, dump_format='plain', jobs=1, options='--no-owner --no-acl',
+                 codec='gzip', level=None):
+    """Shell command writing a dump of database `dbname` to stdout.
+
+    :param level: Compression level of plain dumps, defaulting to the codec's default.
+    """
+    if dump_format == 'plain':
+        return 'pg_dump {0} {1} | {2}'.format(
+            options, dbname, compression.get_codec(codec).compress_command(level=level))
+    if dump_format == 'custom':
+        return 'pg_dump {0} -Fc {1}'.format(options, dbname)
+    if dump_format == 'directory':
+        # A subshell, so the output of the whole command can be redirected or piped:
+        return '(d=$(mktemp -d) && pg_dump {0} -Fd -j {1} -f $d/dump {2} ' \
+               '&& tar cf - -C $d dump; rc=$?; rm -rf $d; exit $rc)'.format(options, jobs, dbname)
+    raise ValueError('unknown dump format: %r' % dump_format)
+
+
+def restore_command(path, dbname, dump_format, jobs=1, single_transaction=False):
+    """Shell command restoring the dump at `path` into database `dbname`.
+
+    The command fails for empty dumps - rather than replacing a database with nothing.
+    """
+    check = 'test -s {0} || {{ echo "empty dump: {0}" >&2; exit 1; }}'.format(
+        shlex.quote(str(path)))
+    return '({0}) && ({1})'.format(
+        check, _restore_command(path, dbname, dump_format, jobs, single_transaction))
+
+
+def _restore_command(path, dbname, dump_format, jobs, single_transaction):
+    if dump_format == 'plain':
+        return '{0} | psql {1}-d {2}'.format(
+            compression.decompress_command(path), '-1 ' if single_transaction else '', dbname)
+    path = shlex.quote(str(path))
+    restore = 'pg_restore --no-owner --no-acl -j {0} -d {1}'.format(jobs, dbname)
+    if dump_format == 'custom':
+        return '{0} {1}'.format(restore, path)
+    if dump_format == 'directory':
+        return 'd=$(mktemp -d) && tar xf {0} -C $d && {1} $d/dump; rc=$?; rm -rf $d; ' \
+               'exit $rc'.format(path, restore)
+    raise ValueError('unknown dump format: %r' % dump_format)
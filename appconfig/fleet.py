@@ -0,0 +1,104 @@
+# fleet.py - run app tasks for many apps in parallel
+
+"""Run tasks decorated with `tasks.task_app_from_environment` for a selection of apps.
+
+Apps are grouped by the host they are deployed to in the selected environment. Hosts are
+processed in parallel - by a bounded pool of worker processes - while the apps on one host are
+processed one after the other, so that tasks never compete for the same host.
+
+Tasks run non-interactively, i.e. tasks prompting for input fail for the app at hand.
+"""
+import time
+import pickle
+import collections
+import multiprocessing
+import multiprocessing.dummy
+
+from . import APPS
+
+__all__ = ['Result', 'run', 'report']
+
+
+class Result(collections.namedtuple('Result', 'app host value error seconds')):
+    """Outcome of running a task for `app`: Its return `value` or an `error` message."""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return repr(value)
+    return value
+
+
+def _run_host(job):
+    import fabric.api
+    import fabric.state
+    from . import tasks
+
+    task_name, environment, host, app_names, args, kwargs = job
+    task = getattr(tasks, task_name)
+    # Connections inherited from a parent process must not be shared:
+    fabric.state.connections.clear()
+    results = []
+    for name in app_names:
+        start, value, error = time.time(), None, None
+        try:
+            with fabric.api.settings(
+                    host_string=host, host=host, environment=environment, abort_on_prompts=True):
+                value = _picklable(task.execute_inner(APPS[name], *args, **kwargs))
+        except (Exception, SystemExit) as e:  # fabric aborts by raising SystemExit
+            error = '{0}: {1}'.format(e.__class__.__name__, e)
+        results.append(Result(name, host, value, error, time.time() - start))
+    return results
+
+
+def run(task_name, apps, environment='production', args=(), kwargs=None,
+        workers=4, processes=True):
+    """Run task `task_name` from `appconfig.tasks` for `apps`, in parallel across hosts.
+
+    :param workers: Maximal number of hosts processed at the same time.
+    :param processes: Whether to use worker processes or threads. Since fabric's `env` is \
+    global, threads are only suitable for tasks which don't rely on it.
+    :return: `list` of `Result`s, in the order of `apps`.
+    """
+    from . import tasks
+
+    assert environment in ('production', 'test')
+    if not hasattr(getattr(tasks, task_name, None), 'execute_inner'):
+        raise ValueError('not an app task: %r' % task_name)
+
+    by_host = collections.OrderedDict()
+    for app in apps:
+        by_host.setdefault(getattr(app, environment), []).append(app.name)
+    jobs = [
+        (task_name, environment, host, names, tuple(args), kwargs or {})
+        for host, names in by_host.items()]
+
+    pool_cls = multiprocessing.Pool if processes else multiprocessing.dummy.Pool
+    pool = pool_cls(max(1, min(workers, len(jobs))))
+    try:
+        results = {r.app: r for rs in pool.imap_unordered(_run_host, jobs) for r in rs}
+    finally:
+        pool.close()
+        pool.join()
+    return [results[app.name] for app in apps]
+
+
+def report(results):
+    """Print a summary table of `results`, returning the number of failures."""
+    tmpl = '{0:20} {1:30} {2:6} {3:>8} {4}'
+    print(tmpl.format('app', 'host', 'status', 'seconds', 'result'))
+    for r in results:
+        print(tmpl.format(
+            r.app, r.host, 'ok' if r.ok else 'FAILED', '{0:.1f}'.format(r.seconds),
+            r.error if not r.ok else ('' if r.value is None else r.value)))
+    failed = len([r for r in results if not r.ok])
+    print('{0} ok, {1} failed'.format(len(results) - failed, failed))
+    return failed
@@ -0,0 +1,93 @@
+# probes.py - probe app URLs concurrently
+
+"""HTTP(S) probes of app URLs, run concurrently with asyncio.
+
+A probe only needs the status line of a response, so we talk HTTP/1.1 over
+`asyncio.open_connection` rather than requiring an async HTTP client library.
+"""
+import ssl
+import time
+import asyncio
+import collections
+from urllib.parse import urlsplit
+
+__all__ = ['Probe', 'probe', 'iter_probes']
+
+
+class Probe(collections.namedtuple('Probe', 'url code latency error')):
+    """Result of probing `url`: HTTP status `code`, `latency` in seconds or an `error`."""
+
+    __slots__ = ()
+
+    @property
+    def status(self):
+        if self.error:
+            return self.error
+        return 'up' if self.code == 200 else 'down'
+
+
+async def _status_code(url):
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    reader, writer = await asyncio.open_connection(
+        parts.hostname,
+        parts.port or (443 if https else 80),
+        ssl=ssl.create_default_context() if https else None)
+    try:
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        writer.write((
+            'GET {0} HTTP/1.1\r\n'
+            'Host: {1}\r\n'
+            'User-Agent: appconfig\r\n'
+            'Connection: close\r\n\r\n'.format(path, parts.netloc)).encode('ascii'))
+        status_line = await reader.readline()
+    finally:
+        writer.close()
+    try:
+        return int(status_line.split()[1])
+    except (IndexError, ValueError):
+        raise ValueError('invalid status line: %r' % status_line)
+
+
+async def probe(url, timeout=10, semaphore=None):
+    """Request `url`, waiting at most `timeout` seconds for the status line."""
+    semaphore = semaphore or asyncio.Semaphore()
+    async with semaphore:
+        start = time.monotonic()
+        try:
+            code = await asyncio.wait_for(_status_code(url), timeout)
+        except asyncio.TimeoutError:
+            return Probe(url, None, time.monotonic() - start, 'timeout')
+        except ValueError:
+            return Probe(url, None, time.monotonic() - start, 'bad response')
+        except OSError:  # Includes DNS, connection and SSL errors.
+            return Probe(url, None, time.monotonic() - start, 'unreachable')
+        return Probe(url, code, time.monotonic() - start, None)
+
+
+def iter_probes(urls, concurrency=10, timeout=10):
+    """Probe `urls` concurrently, yielding `Probe`s in the order in which they complete.
+
+    :param concurrency: Maximal number of simultaneously open connections.
+    :param timeout: Timeout per request in seconds.
+    """
+    loop, pending = asyncio.new_event_loop(), set()
+    asyncio.set_event_loop(loop)
+    try:
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = {
+            loop.create_task(probe(url, timeout=timeout, semaphore=semaphore)) for url in urls}
+        while pending:
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:  # Only if the generator has been closed early.
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+        asyncio.set_event_loop(None)
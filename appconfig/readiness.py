@@ -0,0 +1,134 @@
+# readiness.py - wait for (re)started apps to respond
+
+"""Poll the /_ping URLs of apps until they respond, with exponential backoff and a deadline.
+
+Apps take very different times to boot, so rather than sleeping for a fixed time before checking
+an app once, we poll - starting at `INITIAL_DELAY` seconds between attempts and doubling up to
+`MAX_DELAY` - until it responds or `deadline(app)` passes, and report the time to ready.
+
+URLs on a host - e.g. `http://localhost:<port>/_ping` - are polled by one shell script run on
+the host, which polls all of them concurrently; public URLs are polled locally with asyncio,
+see `appconfig.probes`.
+"""
+import time
+import base64
+import asyncio
+import collections
+
+from fabric.api import env, settings, hide
+
+from . import probes
+
+__all__ = ['Ready', 'deadline', 'local_url', 'wait', 'wait_remote']
+
+READY_TIMEOUT = 60  # seconds per unit of an app's deploy_duration
+INITIAL_DELAY = 0.25
+MAX_DELAY = 5
+ATTEMPT_TIMEOUT = 5
+
+SCRIPT = """\
+ready() {{
+    local start=$(date +%s%3N) delay={initial} elapsed
+    while :; do
+        curl -sf -m {attempt} -o /dev/null "$2" && {{
+            echo "$1 ready $(( $(date +%s%3N) - start ))"; return; }}
+        elapsed=$(( $(date +%s%3N) - start ))
+        [ $elapsed -lt $3 ] || {{ echo "$1 timeout $elapsed"; return; }}
+        [ $delay -lt $(( $3 - elapsed )) ] || delay=$(( $3 - elapsed ))
+        sleep $(( delay / 1000 )).$(printf %03d $(( delay % 1000 )))
+        delay=$(( delay * 2 < {maximum} ? delay * 2 : {maximum} ))
+    done
+}}
+"""
+
+
+class Ready(collections.namedtuple('Ready', 'url ready seconds')):
+    """Outcome of polling `url`: Whether it responded before the deadline, after `seconds`."""
+
+    __slots__ = ()
+
+    @property
+    def status(self):
+        return 'ready' if self.ready else 'timeout'
+
+
+def deadline(app):
+    """Seconds to wait for `app` to respond, scaled with its `deploy_duration`."""
+    return READY_TIMEOUT * max(app.deploy_duration, 1)
+
+
+def local_url(port):
+    return 'http://localhost:{0}/_ping'.format(port)
+
+
+def delays(initial=INITIAL_DELAY, maximum=MAX_DELAY):
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+async def poll(url, timeout, semaphore=None):
+    """Request `url` until it returns 200 or `timeout` seconds passed."""
+    start = time.monotonic()
+    for delay in delays():
+        elapsed = time.monotonic() - start
+        probe = await probes.probe(
+            url, timeout=max(min(ATTEMPT_TIMEOUT, timeout - elapsed), 0.1), semaphore=semaphore)
+        elapsed = time.monotonic() - start
+        if probe.code == 200:
+            return Ready(url, True, elapsed)
+        if elapsed >= timeout:
+            return Ready(url, False, elapsed)
+        await asyncio.sleep(min(delay, timeout - elapsed))
+
+
+def wait(targets, concurrency=10):
+    """Poll the URLs of `targets` - pairs (url, timeout) - concurrently from here.
+
+    :return: `list` of `Ready`s, in the order of `targets`.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        semaphore = asyncio.Semaphore(concurrency)
+        return loop.run_until_complete(asyncio.gather(
+            *[poll(url, timeout, semaphore=semaphore) for url, timeout in targets]))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def script(targets):
+    """Shell script polling the URLs of `targets` - pairs (url, timeout) - concurrently."""
+    lines = [SCRIPT.format(
+        initial=int(INITIAL_DELAY * 1000), maximum=MAX_DELAY * 1000, attempt=ATTEMPT_TIMEOUT)]
+    lines.extend(
+        'ready {0} "{1}" {2} &'.format(i, url, int(timeout * 1000))
+        for i, (url, timeout) in enumerate(targets))
+    lines.append('wait')
+    return '\n'.join(lines) + '\n'
+
+
+def parse(stdout, targets):
+    res = [Ready(url, False, None) for url, _ in targets]
+    for line in stdout.splitlines():
+        i, status, ms = (line.split() + ['', '', ''])[:3]
+        if i.isdigit() and int(i) < len(res) and ms.isdigit():
+            res[int(i)] = res[int(i)]._replace(ready=status == 'ready', seconds=int(ms) / 1000)
+    return res
+
+
+def wait_remote(targets, run=None):
+    """Poll the URLs of `targets` - pairs (url, timeout) - concurrently on the current host.
+
+    :return: `list` of `Ready`s, in the order of `targets`.
+    """
+    if run is None:
+        from fabric.api import run
+    if env.get('appconfig_plan'):  # There's nothing to wait for.
+        return [Ready(url, True, 0.0) for url, _ in targets]
+    code = base64.b64encode(script(targets).encode('utf-8')).decode('ascii')
+    with settings(hide('running', 'stdout'), warn_only=True):
+        out = run('echo {0} | base64 -d | bash'.format(code))
+    return parse('{0}'.format(out), targets)
@@ -0,0 +1,305 @@
+# session.py - one persistent SSH session per host for a task run
+
+"""Persistent SSH sessions with per-host accounting of remote round trips.
+
+fabric caches one SSH connection per host, but opens a new SFTP session for each `put` and
+`get` - i.e. for each uploaded template - which costs several round trips each time. Within a
+`Session`
+
+- all SFTP operations on a host share one SFTP client, which is closed when the session ends,
+- connections are kept alive by SSH keepalive packets,
+- remote commands and file transfers are counted and timed per host and per named `phase`.
+
+A session in plan mode doesn't execute anything on the remote host: Remote commands and file
+transfers are only listed, commands are assumed to succeed with empty output. Since steps
+relying on remote output will typically fail then, exceptions within a phase are reported as
+"plan incomplete" and the plan continues with the next phase.
+"""
+import os
+import json
+import time
+import functools
+import contextlib
+import collections
+
+import fabric.sftp
+import fabric.state
+import fabric.operations
+from fabric.api import env, settings
+from fabric.state import output
+
+__all__ = ['Session', 'HostStats', 'PhaseStats', 'Operation', 'phase', 'add_transfer']
+
+Operation = collections.namedtuple('Operation', 'host phase kind detail')
+
+
+class HostStats(object):
+    """Numbers of remote `commands` and `transfers`, `bytes` transferred and `seconds` spent."""
+
+    __slots__ = ('commands', 'transfers', 'bytes', 'seconds')
+
+    def __init__(self):
+        self.commands = self.transfers = self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def round_trips(self):
+        return self.commands + self.transfers
+
+    def _asdict(self):
+        return collections.OrderedDict(
+            (name, getattr(self, name))
+            for cls in reversed(type(self).__mro__) for name in getattr(cls, '__slots__', ()))
+
+
+class PhaseStats(HostStats):
+    """`HostStats` of a phase, plus the `wall` time spent in it and the `error` it failed with."""
+
+    __slots__ = ('wall', 'error')
+
+    def __init__(self):
+        super(PhaseStats, self).__init__()
+        self.wall = 0.0
+        self.error = None
+
+
+class _PlanSFTPClient(object):
+    """Stand-in for an SFTP client in plan mode, for which no remote path exists."""
+
+    def normalize(self, path):
+        return path
+
+    def stat(self, path):
+        raise IOError(path)
+
+    lstat = stat
+
+    def close(self):
+        pass
+
+
+def _size(local_path):
+    if hasattr(local_path, 'seek'):
+        pos = local_path.tell()
+        local_path.seek(0, os.SEEK_END)
+        size = local_path.tell()
+        local_path.seek(pos)
+        return size
+    try:
+        return os.path.getsize(local_path)
+    except (OSError, TypeError):
+        return 0
+
+
+class Session(object):
+    """Context manager patching fabric to share SFTP clients and record round trips per host.
+
+    Sessions don't nest: Entering a session while another one is active just re-uses the
+    active one.
+
+    :param keepalive: Interval in seconds for SSH keepalive packets on new connections.
+    :param plan: Only list remote operations in `operations` rather than executing them.
+    """
+
+    _active = None
+
+    def __init__(self, keepalive=30, plan=False):
+        self.keepalive = keepalive
+        self.plan = plan
+        self.stats = collections.OrderedDict()
+        self.phases = collections.OrderedDict()
+        self.operations = []
+        self._phases = []
+        self._sftp = {}
+        self._patched = {}
+        self._settings = None
+        self._outer = None
+
+    def _stats(self):
+        """The stats to account the current remote operation to: per host and per phase."""
+        res = [self.stats.setdefault(env.host_string, HostStats())]
+        if self._phases:
+            res.append(self.phases.setdefault((env.host_string, self._phases[-1]), PhaseStats()))
+        return res
+
+    def _record(self, kind, detail):
+        op = Operation(env.host_string, self._phases[-1] if self._phases else None, kind, detail)
+        self.operations.append(op)
+        # Listing remote operations is the point of a plan, so we print even if running is hidden.
+        if output.status:
+            print('[{0}] plan: {1}: {2}'.format(op.host, kind, detail))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Account the remote operations within the block to phase `name`."""
+        stats, start = self.phases.setdefault((env.host_string, name), PhaseStats()), time.time()
+        self._phases.append(name)
+        try:
+            yield stats
+        except (Exception, SystemExit) as e:
+            if not self.plan:
+                raise
+            stats.error = '{0}: {1}'.format(e.__class__.__name__, e)
+            print('[{0}] plan incomplete: phase {1} failed with {2}'.format(
+                env.host_string, name, stats.error))
+        finally:
+            self._phases.pop()
+            stats.wall += time.time() - start
+
+    def _patch(self, obj, name, value):
+        self._patched[(obj, name)] = obj.__dict__.get(name)
+        setattr(obj, name, value)
+
+    def __enter__(self):
+        if Session._active is not None:
+            self._outer = Session._active
+            return self._outer
+        Session._active = self
+        if self.plan:
+            # Never wait for input, and let tasks know they shouldn't alter local files.
+            self._settings = settings(abort_on_prompts=True, appconfig_plan=True)
+        else:
+            self._settings = settings(keepalive=self.keepalive)
+        self._settings.__enter__()
+
+        execute = fabric.operations._execute
+
+        @functools.wraps(execute)
+        def _execute(*args, **kwargs):
+            stats, start = self._stats(), time.time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                for s in stats:
+                    s.commands += 1
+                    s.seconds += time.time() - start
+
+        def plan_command(command, shell=True, pty=True, combine_stderr=True, sudo=False,
+                         user=None, **kwargs):
+            for s in self._stats():
+                s.commands += 1
+            command = fabric.operations._prefix_commands(command, 'remote')
+            self._record(
+                'sudo' if sudo else 'run', command + (' [as {0}]'.format(user) if user else ''))
+            out = fabric.operations._AttributeString('')
+            out.command = out.real_command = command
+            out.failed, out.succeeded, out.return_code = False, True, 0
+            out.stderr = fabric.operations._AttributeString('')
+            return out
+
+        def sftp_init(sftp, host_string):
+            if self.plan:
+                sftp.ftp = _PlanSFTPClient()
+                return
+            if host_string not in self._sftp:
+                self._sftp[host_string] = fabric.state.connections[host_string].open_sftp()
+            sftp.ftp = self._sftp[host_string]
+
+        def plan_transfer(kind, remote_path_arg):
+            def method(sftp, *args, **kwargs):
+                self._record(kind, args[remote_path_arg])
+                return args[remote_path_arg]
+            return method
+
+        def transfer(method, size_arg):
+            @functools.wraps(method)
+            def wrapper(sftp, *args, **kwargs):
+                stats, start = self._stats(), time.time()
+                try:
+                    return method(sftp, *args, **kwargs)
+                finally:
+                    for s in stats:
+                        s.transfers += 1
+                        s.bytes += _size(args[size_arg] if len(args) > size_arg else None)
+                        s.seconds += time.time() - start
+            return wrapper
+
+        self._patch(fabric.operations, '_execute', _execute)
+        self._patch(fabric.sftp.SFTP, '__init__', sftp_init)
+        self._patch(fabric.sftp.SFTP, 'close', lambda sftp: None)
+        if self.plan:
+            self._patch(fabric.operations, '_run_command', plan_command)
+            self._patch(fabric.sftp.SFTP, 'put', transfer(plan_transfer('put', 1), 0))
+            self._patch(fabric.sftp.SFTP, 'get', transfer(plan_transfer('get', 0), 1))
+        else:
+            self._patch(fabric.sftp.SFTP, 'put', transfer(fabric.sftp.SFTP.put, 0))
+            self._patch(fabric.sftp.SFTP, 'get', transfer(fabric.sftp.SFTP.get, 1))
+        return self
+
+    def __exit__(self, *exc):
+        if self._outer is not None:
+            return
+        for (obj, name), value in self._patched.items():
+            if value is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+        self._patched = {}
+        for client in self._sftp.values():
+            client.close()
+        self._sftp = {}
+        self._settings.__exit__(*exc)
+        Session._active = None
+
+    def report(self):
+        """Print the round trips per host and - if phases were run - per phase."""
+        if not self.stats:
+            return
+        tmpl = '{0:30} {1:>9} {2:>10} {3:>12} {4:>9} {5:>8}'
+        print(tmpl.format('host', 'commands', 'transfers', 'bytes', 'seconds', 'avg ms'))
+        for host, s in self.stats.items():
+            print(tmpl.format(
+                host, s.commands, s.transfers, s.bytes, '{0:.1f}'.format(s.seconds),
+                '{0:.0f}'.format(s.seconds * 1000 / s.round_trips if s.round_trips else 0)))
+
+        if self.phases:
+            print('')
+            tmpl = '{0:30} {1:15} {2:>9} {3:>9} {4:>10} {5:>12} {6}'
+            print(tmpl.format(
+                'host', 'phase', 'wall', 'commands', 'transfers', 'bytes', '').rstrip())
+            for (host, name), s in self.phases.items():
+                print(tmpl.format(
+                    host, name, '{0:.1f}'.format(s.wall), s.commands, s.transfers, s.bytes,
+                    'incomplete' if s.error else '').rstrip())
+
+    def as_json(self):
+        """The recorded stats - and the plan, in plan mode - as JSON-serializable `dict`."""
+        res = collections.OrderedDict([
+            ('plan', self.plan),
+            ('hosts', collections.OrderedDict(
+                (host, s._asdict()) for host, s in self.stats.items())),
+            ('phases', [
+                collections.OrderedDict(
+                    [('host', host), ('phase', name)] + list(s._asdict().items()))
+                for (host, name), s in self.phases.items()]),
+        ])
+        if self.plan:
+            res['operations'] = [op._asdict() for op in self.operations]
+        return res
+
+    def dump(self, path):
+        """Write the recorded stats to a JSON file at `path`."""
+        with open(str(path), 'w') as fp:
+            json.dump(self.as_json(), fp, indent=2)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Account the remote operations within the block to phase `name` of the active session.
+
+    Outside of a `Session` this is a no-op.
+    """
+    if Session._active is None:
+        yield None
+    else:
+        with Session._active.phase(name) as stats:
+            yield stats
+
+
+def add_transfer(nbytes, seconds):
+    """Account a transfer not made via fabric's SFTP - e.g. a stream - to the active session."""
+    if Session._active is not None:
+        for s in Session._active._stats():
+            s.transfers += 1
+            s.bytes += nbytes
+            s.seconds += seconds
@@ -0,0 +1,47 @@
+# smoke.py - concurrent smoke tests of deployed apps
+
+"""Smoke tests request a set of URLs for each app and compare the HTTP status codes with the
+expected ones:
+
+- `/_raise` must return 500 - i.e. error reporting works,
+- `/_ping` and the paths listed in the app's `smoke_urls` setting must return 200.
+
+All requests are run concurrently, see `appconfig.probes`.
+"""
+import collections
+
+from . import probes
+
+__all__ = ['Check', 'Result', 'checks', 'run']
+
+Check = collections.namedtuple('Check', 'app url expected')
+
+
+class Result(collections.namedtuple('Result', 'check probe')):
+
+    __slots__ = ()
+
+    @property
+    def passed(self):
+        return self.probe.code == self.check.expected
+
+
+def checks(app, raise_only=False, scheme='https'):
+    base = '{0}://{1}'.format(scheme, app.domain)
+    paths = [('/_raise', 500)]
+    if not raise_only:
+        paths.append(('/_ping', 200))
+        paths.extend((p, 200) for p in app.smoke_urls)
+    return [Check(app, base + path, code) for path, code in paths]
+
+
+def run(apps, raise_only=False, scheme='https', **kwargs):
+    """Run the checks for `apps`, yielding `Result`s in the order in which they complete.
+
+    :param kwargs: Keyword arguments passed into `probes.iter_probes`.
+    """
+    todo = {}
+    for app in apps:
+        todo.update((c.url, c) for c in checks(app, raise_only=raise_only, scheme=scheme))
+    for probe in probes.iter_probes(list(todo), **kwargs):
+        yield Result(todo[probe.url], probe)
@@ -0,0 +1,100 @@
+# streams.py - stream the output of remote commands to local files
+
+"""Output of remote commands - e.g. compressed database dumps - streamed over the SSH channel.
+
+fabric's `run` and `sudo` collect the output of commands in memory, as text. So large binary
+output like a database dump is usually written to a file on the host first, compressed, and then
+downloaded - writing the data to the host's disk twice and requiring free space of about the
+size of the database. `stream` instead writes the output of a command like `pg_dump | gzip`
+directly to a local file object, chunk by chunk.
+
+Commands are run via `sudo -S`, i.e. the sudo password - if one is needed - is sent on stdin,
+followed by any other `input_lines` for the command.
+"""
+import time
+import shlex
+import threading
+import collections
+
+from fabric.api import env, sudo
+from fabric.state import connections
+from fabric.network import prompt_for_password
+
+from . import session
+
+__all__ = ['Transfer', 'StreamError', 'stream']
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Transfer(collections.namedtuple('Transfer', 'bytes seconds')):
+
+    __slots__ = ()
+
+    @property
+    def rate(self):
+        """Throughput in bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+class StreamError(RuntimeError):
+    def __init__(self, command, return_code, stderr):
+        self.command, self.return_code, self.stderr = command, return_code, stderr
+        super(StreamError, self).__init__(
+            'streamed command failed with return code {0}: {1}\n{2}'.format(
+                return_code, command, stderr))
+
+
+def _exec(client, command, input_lines=()):
+    channel = client.get_transport().open_session()
+    channel.exec_command(command)
+    if input_lines:
+        channel.sendall(''.join(line + '\n' for line in input_lines).encode('utf-8'))
+    channel.shutdown_write()
+    return channel
+
+
+def stream(command, fp, user=None, input_lines=(), chunk_size=CHUNK_SIZE):
+    """Run the shell command `command` via sudo on the current host, writing stdout to `fp`.
+
+    :param fp: Local binary file object.
+    :param user: User to run the command as, defaults to root.
+    :param input_lines: Lines of text to send to the command on stdin.
+    :return: `Transfer`, i.e. the number of bytes written to `fp` and the seconds it took.
+    :raises StreamError: if the command - or any command of a pipeline - failed.
+    """
+    command = 'set -o pipefail; {0}'.format(command)
+    if env.get('appconfig_plan'):
+        sudo(command, user=user)
+        return Transfer(0, 0.0)
+
+    client = connections[env.host_string]
+    input_lines = list(input_lines)
+    if _exec(client, 'sudo -n true').recv_exit_status() != 0:  # A password is needed.
+        if not env.password:
+            env.password = prompt_for_password()
+        input_lines.insert(0, env.password)
+
+    start, nbytes = time.time(), 0
+    channel = _exec(
+        client,
+        "sudo -S -p '' -H {0}bash -c {1}".format(
+            '-u {0} '.format(user) if user else '', shlex.quote(command)),
+        input_lines)
+    # stderr is drained concurrently: A command blocked writing to a full stderr window would
+    # never finish its stdout.
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(channel.makefile_stderr('rb').read()))
+    reader.daemon = True
+    reader.start()
+    for chunk in iter(lambda: channel.recv(chunk_size), b''):
+        fp.write(chunk)
+        nbytes += len(chunk)
+    reader.join()
+    stderr = b''.join(stderr).decode('utf-8', errors='replace')
+    return_code = channel.recv_exit_status()
+    res = Transfer(nbytes, time.time() - start)
+    session.add_transfer(res.bytes, res.seconds)
+    if return_code != 0:
+        raise StreamError(command, return_code, stderr)
+    return res
@@ -1,20 +1,46 @@
 import os
 
-from fabric.api import sudo
-from fabtools import files
+from fabric.api import sudo, put
 
+from .batch import Batch
+from .templating import Uploads, render
 
-def upload_template(p, dest, ctx, mode='644'):
-    files.upload_template(
-        p.name,
-        dest,
-        ctx,
-        use_jinja=True,
-        template_dir=str(p.parent),
-        use_sudo=True,
-        mode=mode,
-        backup=False,
-        chown=True)
+
+def upload_template(uploads, p, dest, ctx, mode='644'):
+    uploads.add(p.name, dest, ctx, template_dir=p.parent, mode=mode)
+
+
+def _units(app, d):
+    """Yield pairs (unit to enable, [(template path, remote path, context, mode)])."""
+    for unit in sorted(d.iterdir()):
+        files = []
+        ctx = dict(app=app, osenv=os.environ)
+        script = unit / 'script'
+        if script.exists():
+            ctx['script_path'] = script_path = '/usr/bin/{0}-{1}'.format(app.name, unit.name)
+            files.append((script, script_path, ctx, '755'))
+
+        enable = 'service'
+        for name in ['service', 'timer']:
+            if name == 'timer':
+                enable = name
+            p = unit / name
+            if p.exists():
+                files.append(
+                    (p, '/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name), ctx,
+                     '644'))
+        yield '{0}-{1}.{2}'.format(app.name, unit.name, enable), files
+
+
+def render_files(app, d):
+    """Render the files for the systemd units in `d` locally.
+
+    :return: `list` of pairs (remote path, content).
+    """
+    if not (d.exists() and d.name == 'systemd'):
+        return []
+    return [(dest, render(p.name, ctx, p.parent))
+            for _, files in _units(app, d) for p, dest, ctx, _ in files]
 
 
 def enable(app, d):
@@ -36,28 +62,24 @@ def enable(app, d):
     - `script_path`: The path of the associated script on the target system.
     """
     if d.exists() and d.name == 'systemd':
-        for unit in d.iterdir():
-            ctx = dict(app=app, osenv=os.environ)
-            script = unit / 'script'
-            if script.exists():
-                ctx['script_path'] = script_path = '/usr/bin/{0}-{1}'.format(app.name, unit.name)
-                upload_template(script, script_path, ctx, mode='755')
+        units, uploads = [], Uploads()
+        for unit, files in _units(app, d):
+            units.append(unit)
+            for p, dest, ctx, mode in files:
+                upload_template(uploads, p, dest, ctx, mode=mode)
 
-            enable = 'service'
-            for name in ['service', 'timer']:
-                if name == 'timer':
-                    enable = name
-                p = unit / name
-                if p.exists():
-                    upload_template(
-                        p, '/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name), ctx)
-            sudo('systemctl start {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            sudo('systemctl enable {0}-{1}.{2}'.format(app.name, unit.name, enable))
-        sudo('systemctl daemon-reload')
+        batch = Batch()
+        if uploads.run(sudo=sudo, put=put):
+            # Changed unit files must be reloaded before starting units.
+            batch.add('systemctl daemon-reload')
+        for unit in units:
+            batch.add('systemctl start {0}'.format(unit)).add('systemctl enable {0}'.format(unit))
+        batch.run(sudo=sudo)
 
 
 def uninstall(app, d):
     if d.exists() and d.name == 'systemd':
+        batch = Batch()
         for unit in d.iterdir():
             delete = ['/usr/bin/{0}-{1}'.format(app.name, unit.name)]
             enable = 'service'
@@ -65,10 +87,7 @@ def uninstall(app, d):
                 if name == 'timer':
                     enable = name
                 delete.append('/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name))
-            sudo('systemctl stop {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            sudo('systemctl disable {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            for p in delete:
-                if files.exists(p):
-                    sudo('rm {0}'.format(p))
-        sudo('systemctl daemon-reload')
-        sudo('systemctl reset-failed')
+            batch.add('systemctl stop {0}-{1}.{2}'.format(app.name, unit.name, enable))
+            batch.add('systemctl disable {0}-{1}.{2}'.format(app.name, unit.name, enable))
+            batch.add('rm -f {0}'.format(' '.join(delete)))
+        batch.add('systemctl daemon-reload').add('systemctl reset-failed').run(sudo=sudo)
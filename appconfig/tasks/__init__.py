@@ -16,6 +16,7 @@ import functools
 import fabric.api
 
 from .. import helpers
+from ..session import Session
 
 __all__ = ['init', 'task_app_from_environment']
 
@@ -33,7 +34,19 @@ def init(app_name=None):
     APP = APPS[app_name]
 
 
-def task_app_from_environment(func_or_environment):
+def task_app_from_environment(func_or_environment=None, session=False):
+    """
+    Turn a function taking an App as first argument into a task taking an environment.
+
+    May be used as plain decorator or - to bind the task to an environment or to pass options -
+    be called with the environment and/or keyword arguments:
+
+    :param session: Run the task within a `session.Session`, i.e. share one SSH session per \
+    host across all steps of the task and report the remote round trips per host at the end. \
+    Such tasks accept two additional keyword arguments: `plan` to only list the remote \
+    operations the task would perform (e.g. `fab deploy:production,plan=true`) and `profile` to \
+    write the recorded stats to a JSON file (e.g. `fab deploy:production,profile=deploy.json`).
+    """
     if callable(func_or_environment):
         func, _environment = func_or_environment, None
     else:
@@ -49,12 +62,23 @@ def task_app_from_environment(func_or_environment):
                 # allow overriding the hosts by using fab's -H option
                 fabric.api.env.hosts = [getattr(APP, environment)]
             fabric.api.env.environment = environment
-            return fabric.api.execute(func, APP, *args, **kwargs)
+            if not session:
+                return fabric.api.execute(func, APP, *args, **kwargs)
+            plan = '{0}'.format(kwargs.pop('plan', '')).lower() in ('1', 'true', 'yes', 'y')
+            profile = kwargs.pop('profile', None)
+            with Session(plan=plan) as s:
+                res = fabric.api.execute(func, APP, *args, **kwargs)
+            s.report()
+            if profile:
+                s.dump(profile)
+            return res
         wrapper.execute_inner = func
         return fabric.api.task(wrapper)
     else:
         def decorator(_func):
-            _wrapper = task_app_from_environment(_func).wrapped
+            if _environment is None:
+                return task_app_from_environment(_func, session=session)
+            _wrapper = task_app_from_environment(_func, session=session).wrapped
             wrapper = functools.wraps(_wrapper)(functools.partial(_wrapper, _environment))
             wrapper.execute_inner = _wrapper.execute_inner
             return fabric.api.task(wrapper)
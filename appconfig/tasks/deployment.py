@@ -10,7 +10,7 @@ import random
 import pathlib
 import re
 
-from fabric.api import env, settings, shell_env, prompt, sudo, run, cd, local
+from fabric.api import env, settings, hide, shell_env, prompt, sudo, run, cd, local, put, get
 from fabric.contrib.files import exists, comment, sed
 from fabric.contrib.console import confirm
 from fabtools import (
@@ -21,15 +21,30 @@ from .. import PKG_DIR
 from .. import helpers
 from .. import cdstar
 from .. import systemd
+from .. import readiness
+from .. import dumps
+from .. import compression
+from .. import transfers
+from .. import chunks
+from ..batch import Batch, BatchError
+from ..session import phase
+from ..templating import Uploads, render
+from ..wheelhouse import Wheelhouse, read_requirements
+from ..artifacts import Artifacts
 from . import letsencrypt
 
 from . import task_app_from_environment
 
-__all__ = ['deploy', 'start', 'stop', 'uninstall', 'sudo_upload_template', 'upgrade']
+__all__ = [
+    'deploy', 'start', 'stop', 'uninstall', 'sudo_upload_template', 'upgrade', 'rollback',
+    'rollback_db']
 
 PLATFORM = platform.system().lower()
 PG_COLLKEY_DIR = PKG_DIR / 'pg_collkey-v0.5'
-TEMPLATE_DIR = PKG_DIR / 'templates'
+SLOT_FILE = 'gunicorn.slot'
+BUILD_STAMP = '.appconfig-{0}.sha256'
+# Reload nginx - unless its config is broken, which would take all sites down:
+NGINX_RELOAD = 'nginx -t -q && service nginx reload'
 
 
 def template_context(app, workers=3, with_blog=False):
@@ -60,32 +75,34 @@ def sudo_upload_template(template,
                          user_own=None,
                          **kwargs):
     """
-    A wrapper around upload_template in fabtools. Used to upload template files.
+    Upload a file rendered from a template in TEMPLATE_DIR, unless the remote file is unchanged.
 
     :param user_own: Set to user name that's supposed to own the file.
         If it is None, the uploading user's rights are used.
     :type user_own: str
 
-    :return: None
+    :return: `bool` indicating whether the file was uploaded.
+    """
+    return bool(queue_upload_template(
+        Uploads(), template, dest, context, mode=mode, user_own=user_own, **kwargs).run(
+        sudo=sudo, put=put))
+
+
+def queue_upload_template(uploads, template, dest, context=None, mode=None, user_own=None,
+                          **kwargs):
+    """
+    Like `sudo_upload_template`, but queue the upload in `uploads`, to be run with the others.
     """
     if kwargs:
         context = (context or {}).copy()
         context.update(kwargs)
-    files.upload_template(
-        template,
-        dest,
-        context,
-        use_jinja=True,
-        template_dir=str(TEMPLATE_DIR),
-        use_sudo=True,
-        backup=False,
-        mode=mode,
-        chown=True,
-        user=user_own)
+    return uploads.add(template, dest, context, mode=mode, user=user_own)
 
 
 def pip_freeze(app, packages=None):
-    with python.virtualenv(str(app.venv_dir)):
+    if env.get('appconfig_plan'):  # Don't overwrite requirements.txt with planned output.
+        return
+    with python.virtualenv(str(app.venv)):
         stdout = run('pip freeze', combine_stderr=False)
 
     def iterlines(lines):
@@ -101,36 +118,62 @@ def pip_freeze(app, packages=None):
         fp.writelines(iterlines(stdout.splitlines()))
 
 
-def check(app):
-    time.sleep(5)
-    res = run('curl http://localhost:%s/_ping' % app.port)
-    assert json.loads(res)['status'] == 'ok'
+def _ping_ok(url):
+    """Whether `url` - fetched from the host - returns the JSON status "ok" of clld's /_ping."""
+    with settings(hide('running', 'stdout'), warn_only=True):
+        out = run('curl -s %s' % url)
+    try:
+        return json.loads('{0}'.format(out))['status'] == 'ok'
+    except (ValueError, KeyError, TypeError):
+        return False
 
-    if env.environment == 'production':
-        if app.public:
-            # Production apps are served over HTTPS. If they are public, we can check the complete
-            # stack:
-            res_https = run('curl https://%s/_ping' % (app.domain))
-            assert json.loads(res_https)['status'] == 'ok'
 
+def check(app):
+    """Wait until the app responds to /_ping, see `appconfig.readiness` - with status "ok".
 
-@task_app_from_environment
+    An error page served with status 200, e.g. a maintenance page, doesn't pass the check.
+
+    :return: `list` of `readiness.Ready`s.
+    """
+    timeout = readiness.deadline(app)
+    res = readiness.wait_remote(
+        [(readiness.local_url(active_slot(app).port), timeout)], run=run)
+    if env.environment == 'production' and app.public and res[0].ready:
+        # Production apps are served over HTTPS. If they are public, we can check the complete
+        # stack:
+        res.extend(readiness.wait([('https://%s/_ping' % app.domain, timeout)]))
+    for r in res:
+        print('{0}: {1} after {2:.1f} secs'.format(r.url, r.status, r.seconds or 0))
+    if not all(r.ready for r in res):
+        raise ValueError('%s is not responding' % app.name)
+    if not env.get('appconfig_plan'):
+        failed = [r.url for r in res if not _ping_ok(r.url)]
+        if failed:
+            raise ValueError('%s does not report status ok: %s' % (app.name, ', '.join(failed)))
+    return res
+
+
+@task_app_from_environment(session=True)
 def upgrade(app, **packages):
-    with python.virtualenv(str(app.venv_dir)):
+    with python.virtualenv(str(app.venv)):
         require.python.packages(
             ['{0}=={1}'.format(*pkg) for pkg in packages.items()], use_sudo=True)
     pip_freeze(app, packages)
-    stop.execute_inner(app)
-    start.execute_inner(app)
+    if app.green_port:
+        switch_slot(app)
+    else:
+        stop.execute_inner(app)
+        start.execute_inner(app)
     check(app)
 
 
 @task_app_from_environment
 def start(app):
     """start app by changing the supervisord config"""
-    require_supervisor(app.supervisor, app)
-    supervisor.update_config()
-    service.reload('nginx')
+    if require_supervisor(app.supervisor, app):
+        Batch().add('supervisorctl update').add(NGINX_RELOAD).run(sudo=sudo)
+        return True
+    return False
 
 
 @task_app_from_environment
@@ -141,22 +184,26 @@ def stop(app, maintenance_hours=1):
     :param maintenance_hours: Number of hours we expect the downtime to last.
     """
     if maintenance_hours is not None:
-        require.directory(str(app.www_dir), use_sudo=True)
+        Batch().directory(app.www_dir).run(sudo=sudo)
         timestamp = helpers.strfnow(add_hours=maintenance_hours)
         sudo_upload_template('503.html', dest=str(app.www_dir / '503.html'),
                              app_name=app.name, timestamp=timestamp)
 
-    require_supervisor(app.supervisor, app, pause=True)
-    supervisor.update_config()
-    service.reload('nginx')
+    if require_supervisor(app.supervisor, app, pause=True):
+        Batch().add('supervisorctl update').add(NGINX_RELOAD).run(sudo=sudo)
 
 
-def require_supervisor(filepath, app, pause=False):
+def require_supervisor(filepath, app, pause=False, active=None):
+    """
+    :param active: Name of the slot to start, see `switch_slot` - defaulting to the active one.
+    """
     # TODO: consider require.supervisor.process
-    sudo_upload_template('supervisor.conf', dest=str(filepath), mode='644', PAUSE=pause, app=app)
+    return sudo_upload_template(
+        'supervisor.conf', dest=str(filepath), mode='644', PAUSE=pause, app=app,
+        ACTIVE=active or active_slot(app).name)
 
 
-@task_app_from_environment
+@task_app_from_environment(session=True)
 def uninstall(app):  # pragma: no cover
     """uninstall the app"""
     for path in (app.nginx_location, app.nginx_site, app.venv_dir):
@@ -181,43 +228,55 @@ def uninstall(app):  # pragma: no cover
     systemd.uninstall(app, pathlib.Path(os.getcwd()) / 'systemd')
 
 
-@task_app_from_environment
-def deploy(app, with_blog=None, with_alembic=False):
-    """deploy the app"""
-    assert system.distrib_id() == 'Ubuntu'
-    lsb_codename = system.distrib_codename()
-    if lsb_codename != 'xenial':
-        raise ValueError('unsupported platform: %s' % lsb_codename)
-
-    # See whether the local appconfig clone is up-to-date with the remot master:
-    remote_repo = local('git ls-remote git@github.com:shh-dlce/appconfig.git HEAD | awk \'{ print $1}\'')
-    local_clone = local('git rev-parse HEAD')
-
-    if remote_repo != local_clone:
-        if confirm('Local appconfig clone is not up-to-date '
-                   'with remote master, continue?', default=False):
-            print("Continuing deployment.")
-        else:
-            print("Deployment aborted.")
-            return
+@task_app_from_environment(session=True)
+def deploy(app, with_blog=None, with_alembic=False, with_wheels=False, with_shadow_db=False,
+           keep_previous_db=False):
+    """deploy the app
 
-    require.deb.packages(getattr(app, 'require_deb_%s' % lsb_codename) + app.require_deb)
-    require.users.user(app.name, create_home=True, shell='/bin/bash')
-    require.directory(str(app.www_dir), use_sudo=True)
-    require.directory(str(app.www_dir / 'files'), use_sudo=True)
-    require_logging(app.log_dir,
-                    logrotate=app.logrotate,
-                    access_log=app.access_log, error_log=app.error_log)
+    :param with_wheels: Install the pinned requirements of the app from wheels, see \
+    `appconfig.wheelhouse`.
+    """
+    with phase('platform'):
+        assert system.distrib_id() == 'Ubuntu'
+        lsb_codename = system.distrib_codename()
+        if lsb_codename != 'xenial':
+            raise ValueError('unsupported platform: %s' % lsb_codename)
+
+    with phase('appconfig'):
+        # See whether the local appconfig clone is up-to-date with the remot master:
+        remote_repo = local(
+            'git ls-remote git@github.com:shh-dlce/appconfig.git HEAD | awk \'{ print $1}\'')
+        local_clone = local('git rev-parse HEAD')
+
+        if remote_repo != local_clone:
+            if confirm('Local appconfig clone is not up-to-date '
+                       'with remote master, continue?', default=False):
+                print("Continuing deployment.")
+            else:
+                print("Deployment aborted.")
+                return
+
+    with phase('system'):
+        batch = Batch()\
+            .packages(app.require_deb_xenial + app.require_deb)\
+            .user(app.name)\
+            .directory(app.www_dir)\
+            .directory(app.www_dir / 'files')
+        require_logging(app.log_dir,
+                        logrotate=app.logrotate,
+                        access_log=app.access_log, error_log=app.error_log, batch=batch)
+        batch.run(sudo=sudo)
 
     workers = 3 if app.workers > 3 and env.environment == 'test' else app.workers
     with_blog = with_blog if with_blog is not None else app.with_blog
 
     if env.environment != 'staging':
-        # Test and production instances are publicly accessible over HTTPS.
-        letsencrypt.require_certbot()
-        letsencrypt.require_cert(env.host)
-        if env.environment == 'production':
-            letsencrypt.require_cert(app)
+        with phase('certificates'):
+            # Test and production instances are publicly accessible over HTTPS.
+            letsencrypt.require_certbot()
+            letsencrypt.require_cert(env.host)
+            if env.environment == 'production':
+                letsencrypt.require_cert(app)
 
     ctx = template_context(app, workers=workers, with_blog=with_blog)
 
@@ -248,46 +307,189 @@ def deploy(app, with_blog=None, with_alembic=False):
     # Create a virtualenv for the app and install the app package in development mode, i.e. with
     # repository working copy in /usr/venvs/<APP>/src
     #
-    require_venv(
-        app.venv_dir,
-        require_packages=[app.app_pkg] + app.require_pip,
-        assets_name=app.name if app.stack == 'clld' else None)
+    with phase('venv'):
+        venv_args = dict(
+            require_packages=[app.app_pkg] + list(app.require_pip),
+            assets_name=app.name if app.stack == 'clld' else None,
+            wheels=app.fabfile_dir / 'requirements.txt' if with_wheels else None)
+        if app.venv_releases:
+            require_release(app, **venv_args)
+        else:
+            require_venv(app.venv_dir, **venv_args)
 
     #
     # If some of the static assets are managed via bower, update them.
     #
-    require_bower(app)
-    require_grunt(app)
+    with phase('assets'):
+        require_bower(app)
+        require_grunt(app)
 
-    require_nginx(ctx)
+    nginx_changed = True  # Unless we know better, we must reload nginx.
+    with phase('nginx'):
+        # nginx must keep passing requests to the slot the app currently runs in.
+        nginx_changed = require_nginx(dict(ctx, app=app.replace(port=active_slot(app).port)))
 
     if app.stack == 'clld':
-        require_bibutils()
-
-    require_postgres(app)
+        with phase('bibutils'):
+            require_bibutils(codename=lsb_codename)
+
+    with phase('postgres'):
+        require_postgres(app, codename=lsb_codename)
+
+    with phase('config'):
+        require_config(app.config, app, ctx)
+
+    if not app.green_port:
+        with phase('reload'):
+            reload_app(app)
+
+    with phase('database'):
+        if not with_alembic and confirm('Recreate database?', default=False):
+            if with_shadow_db:
+                # The app keeps serving the old database while the new one is restored.
+                upload_sqldump(app, shadow=True, keep_previous=keep_previous_db)
+            else:
+                stop.execute_inner(app)
+                upload_sqldump(app)
+        elif exists(str(app.src_dir / 'alembic.ini')) \
+                and confirm('Upgrade database?', default=False):
+            # Note: stopping the app is not strictly necessary, because
+            #       the alembic revisions run in separate transactions!
+            stop.execute_inner(app, maintenance_hours=app.deploy_duration)
+            alembic_upgrade_head(app, ctx)
+
+    with phase('freeze'):
+        pip_freeze(app)
+
+    if app.green_port:
+        # Only switch once the database is in place.
+        with phase('switch'):
+            switch_slot(app)
+
+    with phase('start'):
+        # Starting the app reloads nginx only if the app's supervisor config changed.
+        if not start.execute_inner(app) and nginx_changed:
+            sudo(NGINX_RELOAD)
+    with phase('check'):
+        check(app)
+    if env.environment == 'production':
+        with phase('systemd'):
+            systemd.enable(app, pathlib.Path(os.getcwd()) / 'systemd')
 
-    require_config(app.config, app, ctx)
 
+def reload_app(app):
+    if app.green_port:
+        switch_slot(app)
+        return
+    if app.venv_releases:
+        # gunicorn's master process runs with the python of the release it was started from,
+        # so we must restart it to switch releases.
+        with settings(warn_only=True):
+            sudo('supervisorctl restart %s' % app.name)
+        return
     # if gunicorn runs, make it gracefully reload the app by sending HUP
     # TODO: consider 'supervisorctl signal HUP $name' instead (xenial+)
     sudo('( [ -f {0} ] && kill -0 $(cat {0}) 2> /dev/null '
          '&& kill -HUP $(cat {0}) ) || echo no reload '.format(app.gunicorn_pid))
 
-    if not with_alembic and confirm('Recreate database?', default=False):
-        stop.execute_inner(app)
-        upload_sqldump(app)
-    elif exists(str(app.src_dir / 'alembic.ini')) and confirm('Upgrade database?', default=False):
-        # Note: stopping the app is not strictly necessary, because
-        #       the alembic revisions run in separate transactions!
-        stop.execute_inner(app, maintenance_hours=app.deploy_duration)
-        alembic_upgrade_head(app, ctx)
 
-    pip_freeze(app)
+def active_slot(app):
+    """The gunicorn slot nginx passes requests to, as recorded in the app's home directory."""
+    if len(app.slots) == 1:
+        return app.slots[0]
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        name = run('cat %s' % (app.home_dir / SLOT_FILE)).strip()
+    return {s.name: s for s in app.slots}.get(name, app.slots[0])
 
-    start.execute_inner(app)
-    check(app)
-    if env.environment == 'production':
-        systemd.enable(app, pathlib.Path(os.getcwd()) / 'systemd')
+
+def switch_slot(app):
+    """Restart the app in its idle slot, switch nginx over to it and stop the active slot.
+
+    The active gunicorn is stopped with TERM, i.e. its workers finish the requests in progress.
+    """
+    active = active_slot(app)
+    idle = [s for s in app.slots if s != active][0]
+    # Make sure supervisor knows both slots - the idle one without autostart:
+    if require_supervisor(app.supervisor, app, active=active.name):
+        supervisor.update_config()
+    with settings(warn_only=True):
+        sudo('supervisorctl restart %s' % idle.program)
+    if not check_slot(app, idle):
+        sudo('supervisorctl stop %s' % idle.program)
+        raise ValueError('%s is not responding on port %s' % (idle.program, idle.port))
+
+    if exists(str(app.varnish_site)):
+        # Apps behind varnish - see `varnish.cache` - are passed requests by varnish' backend:
+        conf, reload = app.varnish_site, 'service varnish reload'
+        upstream = '.port = "{0}";'
+    else:
+        conf, reload = app.nginx_location if env.environment == 'test' else app.nginx_site, \
+            NGINX_RELOAD
+        upstream = 'http://127.0.0.1:{0}/'
+    try:
+        Batch()\
+            .add("grep -qF '{0}' {1}".format(upstream.format(active.port), conf))\
+            .add("sed -i -e 's|{0}|{1}|' {2}".format(
+                upstream.format(active.port), upstream.format(idle.port), conf))\
+            .add(reload)\
+            .add('echo %s > %s' % (idle.name, app.home_dir / SLOT_FILE))\
+            .run(sudo=sudo)
+    except BatchError as e:
+        sudo('supervisorctl stop %s' % idle.program)
+        raise ValueError('switching to port %s failed: %s' % (idle.port, e.result.command))
+    sudo('supervisorctl stop %s' % active.program)
+    # Only autostart the new active slot from now on. We don't `update`, because supervisor
+    # would restart the changed program - the one now serving requests:
+    if require_supervisor(app.supervisor, app, active=idle.name):
+        sudo('supervisorctl reread')
+
+
+def check_slot(app, slot):
+    """Wait until the app in `slot` responds to /_ping; return whether it did."""
+    res, = readiness.wait_remote(
+        [(readiness.local_url(slot.port), readiness.deadline(app))], run=run)
+    print('{0}: {1} after {2:.1f} secs'.format(slot.program, res.status, res.seconds or 0))
+    return res.ready
+
+
+@task_app_from_environment
+def rollback(app, release=None):
+    """switch the app back to the previous (or the specified) venv release and reload it"""
+    if not app.venv_releases:
+        raise ValueError('%s does not use venv releases' % app.name)
+    with settings(hide('running', 'stdout')):
+        releases = run('ls -1 %s' % (app.venv_dir / 'releases')).split()
+        current = run('readlink %s' % (app.venv_dir / 'current')).strip().rpartition('/')[2]
+    if release is None:
+        previous = [r for r in sorted(releases) if r < current]
+        if not previous:
+            raise ValueError('no release before %s' % current)
+        release = previous[-1]
+    elif release not in releases:
+        raise ValueError('unknown release: %s' % release)
+    switch_release(app, release)
+    reload_app(app)
+
+
+def require_release(app, **kw):
+    """
+    Build the app's venv as new release in `venv_dir`/releases, and switch to it.
+
+    Only the `venv_releases` most recent releases are kept - and the current one, e.g. after a
+    rollback.
+    """
+    release = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+    require_venv(app.venv_dir / 'releases' / release, **kw)
+    switch_release(app, release)
+    sudo('cd {0} && ls -1 | sort -r | tail -n +{1} | grep -vxF "$(basename $(readlink {2}))" '
+         '| xargs -r rm -rf'.format(
+             app.venv_dir / 'releases', app.venv_releases + 1, app.venv_dir / 'current'))
+
+
+def switch_release(app, release):
+    """Point the `current` symlink in the app's `venv_dir` to `release` - atomically."""
+    current = app.venv_dir / 'current'
+    sudo('ln -sfn releases/{1} {0}.new && mv -Tf {0}.new {0}'.format(current, release))
 
 
 def require_php(app):  # pragma: no cover
@@ -317,64 +519,138 @@ def require_mysql(app):  # pragma: no cover
 def require_bower(app, d=None):
     d = d or app.static_dir
     if exists(str(d / 'bower.json')):
-        require.deb.packages(['npm', 'nodejs-legacy'])
-        sudo('npm install -g bower@1.8.4')
-        with cd(str(d)):
-            sudo('bower --allow-root install')
+        def build():
+            require.deb.packages(['npm', 'nodejs-legacy'])
+            sudo('npm install -g bower@1.8.4')
+            with cd(str(d)):
+                sudo('bower --allow-root install')
+        require_build(d, 'bower', build, paths='bower.json .bowerrc')
 
 
 def require_grunt(app, d=None):
     d = d or app.static_dir
     if exists(str(d / 'Gruntfile.js')):
-        require.deb.packages(['npm', 'nodejs-legacy'])
-        sudo('npm install -g grunt-cli@1.2.0')
-        with cd(str(d)):
-            sudo('npm install')
-            sudo('grunt')
+        def build():
+            require.deb.packages(['npm', 'nodejs-legacy'])
+            sudo('npm install -g grunt-cli@1.2.0')
+            with cd(str(d)):
+                sudo('npm install')
+                sudo('grunt')
+        require_build(d, 'grunt', build)
+
+
+def require_build(d, name, build, paths='.', key=None, exclude='node_modules'):
+    """
+    Run `build` - unless the sources didn't change since the last build in directory `d`.
+
+    The sources are the files below `paths` in `d` - only the files tracked by git, if `d` is in
+    a git working copy, so build output is ignored - and the output of the shell command `key`.
+    Outside of git working copies, directories named in `exclude` and build stamps are skipped,
+    and the hash is computed after the build, so that build output in `paths` doesn't count as
+    a change. The hash is stored in `d` upon a successful build.
+
+    :return: `bool` indicating whether `build` was run.
+    """
+    stamp = BUILD_STAMP.format(name)
+    prune = ' -o '.join('-name {0}'.format(n) for n in exclude.split())
+
+    def fingerprint():
+        with settings(hide('running', 'stdout'), warn_only=True):
+            out = sudo(
+                'cd {0} && {{ if git rev-parse --git-dir > /dev/null 2>&1; '
+                'then git ls-files -z -- {1}; '
+                'else find {1} {4}-type f ! -name "{5}" -print0 2> /dev/null; fi '
+                '| sort -z | xargs -0 -r sha256sum 2> /dev/null; {2}; }} '
+                '| sha256sum | cut -d " " -f 1 && cat {3} 2> /dev/null; true'.format(
+                    d, paths, key or 'true', stamp,
+                    '\\( {0} \\) -prune -o '.format(prune) if prune else '',
+                    BUILD_STAMP.format('*')))
+        digest, _, stored = '{0}'.format(out).strip().partition('\n')
+        return digest, stored.strip()
+
+    digest, stored = fingerprint()
+    if digest and digest == stored:
+        print('{0} build in {1} is up-to-date'.format(name, d))
+        return False
+    build()
+    digest, _ = fingerprint()
+    if digest:
+        sudo('echo {0} > {1}'.format(digest, d / stamp))
+    return True
 
 
 def require_bibutils(executable='/usr/local/bin/bib2xml',
                      url='https://sourceforge.net/projects/bibutils/files/'
-                         'bibutils_6.2_src.tgz/download'):
+                         'bibutils_6.2_src.tgz/download',
+                     codename=None):
+    """Require bibutils, built once per distro release, see `appconfig.artifacts`."""
     if not exists(executable):
         tgz = url.partition('/download')[0].rpartition('/')[2]
         tdir = tgz.partition('_src.tgz')[0]
-        with cd('/tmp'):
-            require.file(tgz, url=url, mode='')
-            run('tar xzf %s' % tgz)
-            with cd(tdir):
-                run('./configure')
-                run('make')
-                sudo('make install')
 
+        def build(stage):
+            install_dir = '%s/%s' % (stage, pathlib.PurePosixPath(executable).parent)
+            with cd('/tmp'):
+                require.file(tgz, url=url, mode='')
+                run('tar xzf %s' % tgz)
+                with cd(tdir):
+                    run('./configure --install-dir %s' % install_dir)
+                    run('make')
+                    sudo('mkdir -p %s && make install' % install_dir)
 
-def require_postgres(app, drop=False):
+        Artifacts().require(
+            (tdir, codename or system.distrib_codename()), build, sudo=sudo, put=put, get=get)
+
+
+def require_postgres(app, drop=False, codename=None, dbname=None):
+    """
+    :param dbname: Name of the database to create for the app - e.g. a shadow database to restore \
+    a dump into, see `upload_sqldump` - defaulting to the app's name.
+    """
+    dbname = dbname or app.name
     if drop:
         with cd('/var/lib/postgresql'):
-            sudo('dropdb %s' % app.name, user='postgres')
+            sudo('dropdb %s' % dbname, user='postgres')
 
     with shell_env(SYSTEMD_PAGER=''):
         require.postgres.server()
-        require.postgres.user(app.name, password=app.name)
-        require.postgres.database(app.name, owner=app.name)
 
+    # Role and database are created - if missing - in one batch with the extensions:
+    sql = Batch()
+    sql.add("psql -tAc \"SELECT 1 FROM pg_roles WHERE rolname = '{0}'\" | grep -q 1 || "
+            "psql -c \"CREATE USER {0} NOSUPERUSER NOCREATEDB NOCREATEROLE LOGIN "
+            "PASSWORD '{0}';\"".format(app.name), user='postgres')
+    sql.add("psql -tAc \"SELECT 1 FROM pg_database WHERE datname = '{0}'\" | grep -q 1 || "
+            "createdb --owner {1} --template template0 --encoding=UTF8 "
+            "--lc-ctype=en_US.UTF-8 --lc-collate=en_US.UTF-8 {0}".format(dbname, app.name),
+            user='postgres')
     if app.pg_unaccent:
-        sql = 'CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public;'
-        sudo('psql -c "%s" -d %s' % (sql, app.name), user='postgres')
+        sql.add('psql -c "CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public;" -d %s'
+                % dbname, user='postgres')
 
     if app.pg_collkey:
         pg_dir, = run('find /usr/lib/postgresql/ -mindepth 1 -maxdepth 1 -type d').splitlines()
         pg_version = pathlib.PurePosixPath(pg_dir).name
         if not exists('/usr/lib/postgresql/%s/lib/collkey_icu.so' % pg_version):
-            require.deb.packages(['postgresql-server-dev-%s' % pg_version, 'libicu-dev'])
-            with cd('/tmp'):
-                sudo_upload_template('pg_collkey.Makefile', dest='Makefile', pg_version=pg_version)
-                require.file('collkey_icu.c', source=str(PG_COLLKEY_DIR / 'collkey_icu.c'))
-                run('make')
-                sudo('make install')
+            def build(stage):
+                require.deb.packages(['postgresql-server-dev-%s' % pg_version, 'libicu-dev'])
+                with cd('/tmp'):
+                    sudo_upload_template(
+                        'pg_collkey.Makefile', dest='Makefile', pg_version=pg_version)
+                    require.file('collkey_icu.c', source=str(PG_COLLKEY_DIR / 'collkey_icu.c'))
+                    run('make')
+                    sudo('make install DESTDIR=%s' % stage)
+
+            Artifacts().require(
+                (PG_COLLKEY_DIR.name, codename or system.distrib_codename(), 'pg' + pg_version),
+                build, sudo=sudo, put=put, get=get)
         with cd('/tmp'):
             require.file('collkey_icu.sql', source=str(PG_COLLKEY_DIR / 'collkey_icu.sql'))
-            sudo('psql -f collkey_icu.sql -d %s' % app.name, user='postgres')
+        # Only register the functions with the database if they are missing:
+        sql.add("psql -tAc \"SELECT 1 FROM pg_proc WHERE proname = 'collkey'\" -d {0} "
+                "| grep -q 1 || psql -f /tmp/collkey_icu.sql -d {0}".format(dbname),
+                user='postgres')
+    sql.run(sudo=sudo)
 
 
 def require_config(filepath, app, ctx):
@@ -391,23 +667,46 @@ def require_config(filepath, app, ctx):
             str(filepath.parent / 'secret_key'), contents=secret_key, use_sudo=True, mode='644')
 
 
-def require_venv(directory, require_packages=None, assets_name=None, requirements=None):
-    require.directory(str(directory), use_sudo=True)
+def require_venv(directory, require_packages=None, assets_name=None, requirements=None,
+                 wheels=None):
+    """
+    :param wheels: Path of a local requirements file, whose pinned requirements are installed \
+    from wheels before any other packages.
+    """
+    Batch().directory(directory).run(sudo=sudo)
 
     with settings(sudo_prefix=env.sudo_prefix + ' -H'):  # set HOME for pip log/cache
         require.python.virtualenv(str(directory), venv_python='python3', use_sudo=True)
 
         with python.virtualenv(str(directory)):
+            if wheels and wheels.exists():
+                pinned = read_requirements(wheels)
+                if not Wheelhouse(os.environ.get('APPCONFIG_BUILD_HOST')).install(
+                        pinned, sudo=sudo, put=put):
+                    # The wheels don't fit the host, thus we install from the index:
+                    require.python.packages(pinned, use_sudo=True)
             if require_packages:
                 require.python.packages(require_packages, use_sudo=True)
             if requirements:
                 require.python.requirements(requirements, use_sudo=True)
             if assets_name:
-                sudo('webassets -m %s.assets build' % assets_name)
+                # Bundles may contain files of the app and of any installed package:
+                require_build(
+                    directory / 'src' / assets_name,
+                    'webassets',
+                    functools.partial(sudo, 'webassets -m %s.assets build' % assets_name),
+                    paths='{0}/static {0}/assets.py'.format(assets_name),
+                    key='ls {0}/lib/*/site-packages'.format(directory))
 
 
-def require_logging(log_dir, logrotate, access_log, error_log):
-    require.directory(str(log_dir), use_sudo=True)
+def require_logging(log_dir, logrotate, access_log, error_log, batch=None):
+    """
+    :param batch: `Batch` to queue the log directory in, rather than creating it right away.
+    """
+    if batch is None:
+        Batch().directory(log_dir).run(sudo=sudo)
+    else:
+        batch.directory(log_dir)
 
     if env.environment == 'production':
         sudo_upload_template('logrotate.conf', dest=str(logrotate),
@@ -415,40 +714,56 @@ def require_logging(log_dir, logrotate, access_log, error_log):
 
 
 def require_nginx(ctx):
+    """Require the nginx config for an app; return whether it changed, i.e. needs a reload."""
     app = ctx['app']
 
     with shell_env(SYSTEMD_PAGER=''):
         require.nginx.server()
 
-    auth, admin_auth = http_auth(app)
+    batch = Batch()
+    if env.environment == 'test':
+        batch.directory(app.nginx_location.parent)
+    auth, admin_auth = http_auth(app, batch=batch)
+    batch.run(sudo=sudo)
 
     # TODO: consider require.nginx.site
+    uploads = Uploads()
     upload_app = functools.partial(
-        sudo_upload_template,
+        queue_upload_template,
+        uploads,
         'nginx-app.conf',
         context=ctx,
-        clld_dir=get_clld_dir(app.venv_dir) if app.stack == 'clld' else '',
+        clld_dir=get_clld_dir(app.venv) if app.stack == 'clld' else '',
         auth=auth,
         admin_auth=admin_auth)
 
-    sudo_upload_template('nginx-default.conf', dest=str(app.nginx_default_site), env=env)
+    queue_upload_template(uploads, 'nginx-default.conf', dest=str(app.nginx_default_site), env=env)
     if env.environment != 'test':
         upload_app(dest=str(app.nginx_site))
-        nginx.enable(app.nginx_site.name)
     else:  # test environment
-        require.directory(str(app.nginx_location.parent), use_sudo=True)
         upload_app(dest=str(app.nginx_location))
+    changed = uploads.run(sudo=sudo, put=put)
+    if env.environment != 'test':
+        sudo('ln -sfn {0} /etc/nginx/sites-enabled/{1}'.format(
+            app.nginx_site, app.nginx_site.name))
+    return bool(changed)
 
 
 def get_clld_dir(venv_dir):
     # /usr/venvs/<app_name>/local/lib/python<version>/site-packages/clld/__init__.pyc
+    # We compute the path relative to the venv, because in a venv release, clld.__file__ is
+    # located in the release directory rather than in the current symlink.
     with python.virtualenv(str(venv_dir)):
-        stdout = sudo('python -c "import clld; print(clld.__file__)"')
-    clld_path = pathlib.PurePosixPath(stdout.split()[-1])
+        stdout = sudo('python -c "import os, sys, clld; '
+                      'print(os.path.relpath(clld.__file__, sys.prefix))"')
+    clld_path = pathlib.PurePosixPath(venv_dir) / stdout.split()[-1]
     return clld_path.parent
 
 
-def http_auth(app):
+def http_auth(app, batch=None):
+    """
+    :param batch: `Batch` to queue the htpasswd commands in, rather than running them right away.
+    """
     pwds = {
         app.name: None,  # Require no HTTP authentication by default in production.
         'admin': 'admin'  # For the /admin path, require trivial HTTP auth by default.
@@ -459,58 +774,228 @@ def http_auth(app):
     if app.with_admin:
         pwds['admin'] = helpers.getpwd('admin')
 
-    require.directory(str(app.nginx_htpasswd.parent), use_sudo=True)
+    queue = Batch() if batch is None else batch
+    queue.directory(app.nginx_htpasswd.parent)
     pairs = [(u, p) for u, p in pwds.items() if p]
     for opts, pairs in [('-bdc', pairs[:1]), ('-bd', pairs[1:])]:
         for u, p in pairs:
-            sudo('htpasswd %s %s %s %s' % (opts, app.nginx_htpasswd, u, p))
+            queue.add('htpasswd %s %s %s %s' % (opts, app.nginx_htpasswd, u, p))
+    if batch is None:
+        queue.run(sudo=sudo)
+    return auth_directives(app, protected=bool(pwds[app.name]))
+
 
+def auth_directives(app, protected):
+    """nginx directives requiring HTTP auth for the app (if `protected`) and its /admin path."""
     auth = ('proxy_set_header Authorization $http_authorization;\n'
             'proxy_pass_header Authorization;\n'
             'auth_basic "%s";\n'
             'auth_basic_user_file %s;\n' % (app.name, app.nginx_htpasswd))
-    return auth if pwds[app.name] else '', auth
+    return auth if protected else '', auth
+
+
+def render_config_files(app):
+    """
+    Render the config files `deploy` uploads for an app in the current environment locally.
+
+    Settings which `deploy` reads from the host - i.e. the location of clld in the app's
+    virtualenv - are rendered as placeholders.
+
+    :return: `list` of pairs (remote path, content).
+    """
+    workers = 3 if app.workers > 3 and env.environment == 'test' else app.workers
+    ctx = template_context(app, workers=workers)
+    auth, admin_auth = auth_directives(
+        app, protected=not (app.public and env.environment == 'production'))
+    clld_dir = '{0}/lib/<python>/site-packages/clld'.format(app.venv) \
+        if app.stack == 'clld' else ''
+    nginx_app = app.nginx_site if env.environment != 'test' else app.nginx_location
+
+    res = [
+        (app.nginx_default_site, render('nginx-default.conf', dict(env=env))),
+        (nginx_app, render('nginx-app.conf', dict(
+            ctx, clld_dir=clld_dir, auth=auth, admin_auth=admin_auth))),
+        (app.config, render('config.ini', dict(ctx, files=app.www_dir / 'files'))),
+        (app.supervisor, render('supervisor.conf', dict(PAUSE=False, ACTIVE=app.slots[0].name, app=app))),
+    ]
+    if env.environment == 'production':
+        res.append((app.logrotate, render('logrotate.conf', dict(
+            access_log=app.access_log, error_log=app.error_log))))
+        res.extend(systemd.render_files(app, app.fabfile_dir / 'systemd'))
+    return [('{0}'.format(path), text) for path, text in res]
 
 
-def upload_sqldump(app):
+def upload_sqldump(app, dump_format='plain', codec=None, shadow=False, keep_previous=False):
+    """
+    Replace the app's database with the latest dump in CDSTAR - or with a dump of a local database.
+
+    Dumps are restored according to their format, see `appconfig.dumps` - i.e. dumps in custom
+    or directory format are restored in parallel. Deduplicated backups, see `appconfig.chunks`,
+    are streamed into the database and verified against their manifest while they are restored.
+
+    :param dump_format: Format for dumps of local databases.
+    :param codec: Compression codec for SQL dumps of local databases, see \
+    `appconfig.compression` - defaulting to pigz, if installed, or gzip at a fast level.
+    :param shadow: Restore into a shadow database `<name>_next` while the app keeps serving \
+    the old one, and only swap databases when the new one is ready, see `swap_database`.
+    :param keep_previous: Keep the old database as `<name>_prev`, see `rollback_db`.
+    """
+    chunked = False
     if app.dbdump:
         if re.match('http(s)?://', app.dbdump):
             fname = 'dump.sql.gz'
             url = app.dbdump
-            auth = ''
+            auth, kw = '', {}
         else:
             latest = cdstar.get_latest_bitstream(app.dbdump)
             fname, url = latest.name, latest.url
-            auth = '-u"{0}:{1}" '.format(os.environ['CDSTAR_USER_BACKUP'], os.environ['CDSTAR_PWD_BACKUP'])
+            auth = '-u"{0}:{1}"'.format(os.environ['CDSTAR_USER_BACKUP'], os.environ['CDSTAR_PWD_BACKUP'])
+            kw = dict(md5=latest.md5, size=latest.size)
+            chunked = latest.is_manifest
         target = pathlib.PurePosixPath('/tmp') / fname
-        run('curl -s -o {0} {1} {2}'.format(target, auth, url))
+        if chunked:
+            # We only upload the list of chunk URLs, for curl to download them one by one:
+            manifest = latest.read_manifest()
+            urls = cdstar.get_chunk_urls(app.dbdump, manifest)
+            config = pathlib.Path(tempfile.mktemp(suffix='.curl'))
+            config.write_text(chunks.curl_config(urls), encoding='utf8')
+            transfers.upload(config, target)
+            config.unlink()
+        else:
+            transfers.fetch(url, target, auth=auth, **kw)
     else:
         db_name = prompt('Replace with dump of local database:', default=app.name)
-        sqldump = pathlib.Path(tempfile.mktemp(suffix='.sql.gz', prefix='%s-' % db_name))
+        codec = codec or compression.local_gzip().name
+        sqldump = pathlib.Path(tempfile.mktemp(
+            suffix=dumps.suffix(dump_format, codec), prefix='%s-' % db_name))
         target = pathlib.PurePosixPath('/tmp') / sqldump.name
 
         db_user = '-U postgres ' if PLATFORM == 'windows' else ''
-        local('pg_dump %s--no-owner --no-acl -Z 9 -f %s %s' % (db_user, sqldump, db_name))
+        local('{0} > {1}'.format(dumps.dump_command(
+            db_name, dump_format, jobs=dumps.local_jobs(),
+            options='%s--no-owner --no-acl' % db_user, codec=codec,
+            level=compression.FAST_LEVEL), sqldump))
 
-        require.file(str(target), source=str(sqldump))
+        transfers.upload(sqldump, target)
         sqldump.unlink()
 
+    if chunked:
+        # Concatenated gzipped chunks are a valid gzip stream, which is verified while it is
+        # restored - a mismatch with the manifest ends it with a failing statement:
+        sql = 'set -o pipefail; ' + chunks.verified_command(
+            'curl -fsS {0} -K {1} | gzip -dc'.format(auth, target), manifest,
+            error=chunks.MYSQL_ERROR if app.stack == 'soundcomparisons' else chunks.PG_ERROR)
+    else:
+        sql = compression.decompress_command(target)
+
+    dbname = app.name + '_next' if shadow else app.name
     if app.stack == 'soundcomparisons':
-        sudo('echo "drop database {0};" | mysql'.format(app.name))
-        require.mysql.database(app.name, owner=app.name)
-        sudo('gunzip -c {0} | mysql -u {1} --password={1} -D {1}'.format(target, app.name), user=app.name)
+        if shadow:
+            sudo('echo "drop database if exists {0}; create database {0};" | mysql'.format(dbname))
+            sudo('{0} | mysql -D {1}'.format(sql, dbname))
+        else:
+            sudo('echo "drop database {0};" | mysql'.format(app.name))
+            require.mysql.database(app.name, owner=app.name)
+            sudo('{0} | mysql -u {1} --password={1} -D {1}'.format(sql, app.name), user=app.name)
     else:
+        if shadow:
+            sudo('dropdb --if-exists %s' % dbname, user='postgres')
+            require_postgres(app, dbname=dbname)
         # TODO: assert supervisor.process_status(app.name) != 'RUNNING'
-        if postgres.database_exists(app.name):
+        elif postgres.database_exists(app.name):
             require_postgres(app, drop=True)
 
-        sudo('gunzip -c %s | psql -d %s' % (target, app.name), user=app.name)
-        sudo('vacuumdb -zf %s' % app.name, user='postgres')
+        with settings(hide('stdout')):
+            dump_format, jobs = dumps.parse_detected(run('{0}; nproc'.format(
+                'echo plain' if chunked else dumps.detect_command(target))))
+        if chunked:
+            # In a single transaction, which is rolled back upon a mismatch:
+            sudo('{0} | psql -1 -v ON_ERROR_STOP=1 -d {1}'.format(sql, dbname), user=app.name)
+        else:
+            sudo(dumps.restore_command(target, dbname, dump_format, jobs=jobs), user=app.name)
+        if shadow:
+            # A freshly restored database has no dead rows to vacuum, we only need statistics:
+            sudo('vacuumdb -Z -j %s %s' % (jobs, dbname), user='postgres')
+        else:
+            sudo('vacuumdb -zf -j %s %s' % (jobs, app.name), user='postgres')
     files.remove(str(target))
+    if shadow:
+        swap_database(app, keep_previous=keep_previous)
+
+
+def _rename_databases(app, renames):
+    """Rename the app's databases according to `renames` - pairs (old, new) - in one transaction."""
+    if app.stack == 'soundcomparisons':
+        # MySQL can't rename databases, but it can move tables atomically between databases:
+        olds = [old for old, _ in renames]
+        with settings(hide('running', 'stdout')):
+            counts = sudo(
+                'mysql -NBe "SELECT COUNT(*) FROM information_schema.views WHERE table_schema IN '
+                '({0}); SELECT COUNT(*) FROM information_schema.triggers WHERE trigger_schema IN '
+                '({0})"'.format(', '.join("'%s'" % name for name in olds))).split()
+            if any(n != '0' for n in counts):
+                raise ValueError('cannot move views or triggers of %s' % app.name)
+            tables = {
+                old: sudo('mysql -NBe "SELECT table_name FROM information_schema.tables '
+                          'WHERE table_schema = \'{0}\'"'.format(old)).split()
+                for old in olds}
+        sudo('echo "{0}" | mysql'.format(' '.join(
+            'create database if not exists {0};'.format(new) for _, new in renames)))
+        moves = ['{0}.{2} TO {1}.{2}'.format(old, new, table)
+                 for old, new in renames for table in tables[old]]
+        if moves:
+            sudo('mysql -e "RENAME TABLE {0}"'.format(', '.join(moves)))
+        for old, new in renames:
+            # Routines aren't moved with the tables, so we copy them:
+            sudo('mysqldump --routines --no-create-info --no-data --no-create-db --skip-triggers '
+                 '{0} | mysql -D {1}'.format(old, new))
+        # Databases which have been renamed - rather than swapped - are empty now:
+        for name in set(olds) - {new for _, new in renames}:
+            _drop_database(app, name)
+        return
+
+    # Databases can't be renamed while they are used - so we pause the app:
+    program = active_slot(app).program
+    sudo('supervisorctl stop %s' % program)
+    try:
+        sudo('psql -c "SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+             'WHERE datname IN ({0}) AND pid <> pg_backend_pid()" > /dev/null'.format(
+                 ', '.join("'%s'" % old for old, _ in renames)), user='postgres')
+        sudo('psql -c "{0}"'.format(' '.join(
+            'ALTER DATABASE {0} RENAME TO {1};'.format(old, new) for old, new in renames)),
+            user='postgres')
+    finally:
+        sudo('supervisorctl start %s' % program)
+
+
+def _drop_database(app, dbname):
+    if app.stack == 'soundcomparisons':
+        sudo('echo "drop database if exists {0};" | mysql'.format(dbname))
+    else:
+        sudo('dropdb --if-exists %s' % dbname, user='postgres')
+
+
+def swap_database(app, keep_previous=False):
+    """
+    Replace the app's database with the shadow database `<name>_next`.
+
+    :param keep_previous: Keep the old database as `<name>_prev` rather than dropping it.
+    """
+    _drop_database(app, app.name + '_prev')
+    _rename_databases(app, [(app.name, app.name + '_prev'), (app.name + '_next', app.name)])
+    if not keep_previous:
+        _drop_database(app, app.name + '_prev')
+
+
+@task_app_from_environment
+def rollback_db(app):
+    """swap the app's database with the one it replaced, kept as <name>_prev"""
+    _drop_database(app, app.name + '_next')
+    _rename_databases(app, [(app.name, app.name + '_next'), (app.name + '_prev', app.name)])
 
 
 def alembic_upgrade_head(app, ctx):
-    with python.virtualenv(str(app.venv_dir)), cd(str(app.src_dir)):
+    with python.virtualenv(str(app.venv)), cd(str(app.src_dir)):
         sudo('%s -n production upgrade head' % (app.alembic), user=app.name)
 
     if confirm('Vacuum database?', default=False):
@@ -2,15 +2,23 @@
 
 import tempfile
 import os
+import shutil
+import getpass
 import subprocess
 import pathlib
 
-from fabric.api import sudo, run, cd, local, get
+from fabric.api import sudo, run, cd, local
 from fabric.contrib.console import confirm
 from fabtools import require, python
+from clldutils.misc import format_size
 
 from .. import APPS_DIR
 from .. import cdstar
+from .. import dumps
+from .. import compression
+from .. import transfers
+from .. import chunks
+from .. import streams
 
 from . import task_app_from_environment
 
@@ -23,28 +31,91 @@ __all__ = [
 ]
 
 
-def dump_db(app, dbname=None):
-    remote_dump = '/tmp/db.sql'
+def _stream_dump(app, dbname, fp, dump_format='plain', codec='gzip'):
+    if app.stack == 'soundcomparisons':
+        # mysqldump reads the password from the environment, which we pass in via stdin:
+        dump_cmd = 'IFS= read -r MYSQL_PWD && export MYSQL_PWD && ' \
+                   'mysqldump -h localhost -u {0} --routines --single-transaction {1}'.format(
+                       app.name, dbname)
+        input_lines = [getpass.getpass('MySQL password for %s: ' % app.name)]
+        dump_cmd += ' | ' + compression.get_codec(codec).compress_command()
+    else:
+        jobs = dumps.jobs(int(run('nproc'))) if dump_format == 'directory' else 1
+        dump_cmd = dumps.dump_command(app.name, dump_format, jobs=jobs, codec=codec)
+        input_lines = []
+    res = streams.stream(dump_cmd, fp, user=app.name, input_lines=input_lines)
+    print('dumped {0} in {1:.1f} secs ({2}/s)'.format(
+        format_size(res.bytes), res.seconds, format_size(res.rate)))
+    return res
+
+
+def dump_db(app, dbname=None, streaming=True, dump_format='plain', codec='gzip'):
+    """Dump the app's database to a local file - by default gzipped SQL.
+
+    :param streaming: Stream the compressed dump over the SSH connection, see \
+    `appconfig.streams`, rather than writing it to a file on the host first.
+    :param dump_format: One of `appconfig.dumps.FORMATS`; PostgreSQL databases can also be \
+    dumped in formats which can be restored in parallel.
+    :param codec: Compression codec for SQL dumps, see `appconfig.compression` - e.g. `pigz` or \
+    `zstd` to compress with all cores of the host, or `none` for fast links.
+    :return: `pathlib.Path` of the local dump.
+    """
     if app.stack == 'soundcomparisons':
         dbname = dbname or app.name
+    else:
+        assert dbname is None
+    if dump_format != 'plain' and (app.stack == 'soundcomparisons' or not streaming):
+        raise ValueError('%s dumps require PostgreSQL and streaming' % dump_format)
+    local_dump = pathlib.Path(tempfile.mktemp(
+        suffix=dumps.suffix(dump_format, codec), prefix='%s-' % app.name))
+    if streaming:
+        with local_dump.open('wb') as fp:
+            _stream_dump(app, dbname, fp, dump_format=dump_format, codec=codec)
+        return local_dump
+
+    remote_dump = '/tmp/db.sql'
+    if app.stack == 'soundcomparisons':
         dump_cmd = 'mysqldump -h localhost -u {0} -p --routines --single-transaction {1} >> {2}'.format(
             app.name, dbname, remote_dump)
     else:
-        assert dbname is None
         dump_cmd = 'pg_dump --no-owner --no-acl -f %s %s' % (remote_dump, app.name)
     sudo(dump_cmd, user=app.name)
-    sudo('gzip -f {0}'.format(remote_dump), user=app.name)
-    remote_dump += '.gz'
-    local_dump = pathlib.Path(tempfile.mktemp(suffix='.sql.gz', prefix='%s-' % app.name))
-    get(remote_path=remote_dump, local_path=str(local_dump))
+    codec = compression.get_codec(codec)
+    if codec.suffix:
+        sudo('{0} < {1} > {1}{2} && rm {1}'.format(
+            codec.compress_command(), remote_dump, codec.suffix), user=app.name)
+        remote_dump += codec.suffix
+    transfers.download(remote_dump, local_dump)
     sudo('rm %s' % remote_dump, user=app.name)
     return local_dump
 
 
-def upload_db_to_cdstar(app, dbname=None):
-    sql_dump = dump_db(app, dbname=dbname)
-    cdstar.add_bitstream(app.dbdump, sql_dump)
-    sql_dump.unlink()
+def upload_db_to_cdstar(app, dbname=None, dedup=False):
+    """Back up the app's database to CDSTAR.
+
+    :param dedup: Only upload the chunks of the dump which aren't stored yet, see \
+    `appconfig.chunks`.
+    """
+    if app.stack == 'soundcomparisons':
+        dbname = dbname or app.name
+    if not dedup:
+        sql_dump = dump_db(app, dbname=dbname)
+        cdstar.add_bitstream(app.dbdump, sql_dump)
+        sql_dump.unlink()
+        return
+
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix='%s-chunks-' % app.name))
+    try:
+        chunker = chunks.Chunker(tmp, known=cdstar.get_chunks(app.dbdump))
+        _stream_dump(app, dbname, chunker, codec='none')
+        manifest = chunker.close()
+        uploaded = sum(tmp.joinpath(name).stat().st_size for name in chunker.new)
+        cdstar.add_chunked_backup(app.dbdump, manifest, tmp, chunker.new)
+    finally:
+        shutil.rmtree(str(tmp))
+    print('backed up {0} in {1} chunks, uploaded {2} new chunks ({3})'.format(
+        format_size(manifest.size), len(manifest.chunks), len(chunker.new),
+        format_size(uploaded)))
 
 
 @task_app_from_environment
@@ -61,13 +132,19 @@ def remove_dumps(app, keep=10):
             if i > int(keep):
                 print('deleting dump {0}'.format(bs.name))
                 bs.bitstream.delete()
+        cdstar.expunge_chunks(app.dbdump)
 
 
 @task_app_from_environment
-def load_db(app, local_name=None):
-    """Dump remote app DB and try loading the dump into a local database."""
+def load_db(app, local_name=None, dump_format='plain', codec='gzip'):
+    """Dump remote app DB and try loading the dump into a local database.
+
+    :param dump_format: Format of the dump, see `appconfig.dumps`; dumps in custom or \
+    directory format are restored in parallel.
+    :param codec: Compression codec for SQL dumps, see `appconfig.compression`.
+    """
     local_name = local_name or app.name
-    local_dump = dump_db(app)
+    local_dump = dump_db(app, dump_format=dump_format, codec=codec)
     assert local_dump.exists()
     try:
         local_dbs = [
@@ -83,7 +160,9 @@ def load_db(app, local_name=None):
         return
 
     local('createdb {0}'.format(local_name))
-    res = local('gunzip -c %s | psql -1 -d %s' % (local_dump, local_name), capture=True)
+    res = local(dumps.restore_command(
+        local_dump, local_name, dumps.detect_format(local_dump),
+        jobs=dumps.local_jobs(), single_transaction=True), capture=True)
     if res.return_code != 0:
         print(res.stdout)
         print('SQL dump downloaded to {0}'.format(local_dump))
@@ -114,15 +193,15 @@ def create_downloads(app):
     require.directory(str(app.download_dir), use_sudo=True, mode='755')
 
 
-@task_app_from_environment
+@task_app_from_environment(session=True)
 def copy_downloads(app, source_dir, pattern='*'):
     """copy downloads for the app"""
     require.directory(str(app.download_dir), use_sudo=True, mode='777')
 
     source_dir = pathlib.Path(source_dir)
     for f in source_dir.glob(pattern):
-        require.file(str(app.download_dir / f.name), source=f,
-                     use_sudo=True, owner=app.name, group=app.name)
+        transfers.upload(
+            f, app.download_dir / f.name, use_sudo=True, owner=app.name, group=app.name)
 
     require.directory(str(app.download_dir), use_sudo=True, mode='755')
 
@@ -136,7 +215,7 @@ def copy_rdfdump(app, source_dir):
 @task_app_from_environment('production')
 def pip_freeze(app):
     """write installed versions to <app_name>/requirements.txt"""
-    with python.virtualenv(str(app.venv_dir)):
+    with python.virtualenv(str(app.venv)):
         stdout = run('pip freeze', combine_stderr=False)
 
     def iterlines(lines):
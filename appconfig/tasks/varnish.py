@@ -1,8 +1,9 @@
 # varnish.py - install, configure, and run varnish cache
 
-from fabric.api import settings, run
+from fabric.api import settings, run, sudo, put
 from fabtools import require, files, service
 
+from ..templating import Uploads
 from . import task_app_from_environment
 from . import deployment  # FIXME
 
@@ -11,7 +12,7 @@ __all__ = ['cache', 'uncache']
 PORT = 6081
 
 
-@task_app_from_environment('production')
+@task_app_from_environment('production', session=True)
 def cache(app):
     """require an app to be put behind varnish
 
@@ -28,20 +29,22 @@ def cache(app):
     """
     require.deb.package('varnish')
 
-    deployment.sudo_upload_template('varnish', dest='/etc/default/varnish')
-    deployment.sudo_upload_template('varnish_main.vcl', dest='/etc/varnish/main.vcl')
-
     require.directory(str(app.varnish_site.parent), use_sudo=True)
-    deployment.sudo_upload_template('varnish_site.vcl', dest=str(app.varnish_site),
-                                    app_name=app.name, app_port=app.port,
-                                    app_domain=app.domain)
+    uploads = Uploads()
+    deployment.queue_upload_template(uploads, 'varnish', dest='/etc/default/varnish')
+    deployment.queue_upload_template(uploads, 'varnish_main.vcl', dest='/etc/varnish/main.vcl')
+    deployment.queue_upload_template(uploads, 'varnish_site.vcl', dest=str(app.varnish_site),
+                                     app_name=app.name,
+                                     app_port=deployment.active_slot(app).port,
+                                     app_domain=app.domain)
+    uploads.run(sudo=sudo, put=put)
 
     _update_varnish_sites(app.varnish_site.parent)
 
     _update_nginx(app, with_varnish=True)
 
 
-@task_app_from_environment('production')
+@task_app_from_environment('production', session=True)
 def uncache(app):
     with settings(warn_only=True):
         files.remove(str(app.varnish_site), use_sudo=True)
@@ -65,5 +68,5 @@ def _update_nginx(app, with_varnish=True, varnish_port=PORT):
     if with_varnish:
         app = app.replace(port=varnish_port)
     ctx = deployment.template_context(app)
-    deployment.require_nginx(ctx)
-    service.reload('nginx')
+    if deployment.require_nginx(ctx):
+        service.reload('nginx')
@@ -0,0 +1,119 @@
+# templating.py - render config file templates and upload them if changed
+
+"""Config files rendered from Jinja templates, uploaded only if they differ from the remote files.
+
+Rendering locally lets us compare a config file with the file on the host by content hash. So
+redeploying an unchanged app doesn't upload anything, and reloads of services depending on the
+files can be skipped. The checksums of all files queued in an `Uploads` object are retrieved
+with one remote command.
+
+Templates are rendered with one shared Jinja environment per template directory, so each
+template is compiled only once per process; compiled templates are also cached on disk in
+`CACHE_DIR`.
+"""
+import io
+import hashlib
+import functools
+import collections
+
+import jinja2
+from fabric.api import env, settings, hide
+
+from . import PKG_DIR, CACHE_DIR
+from .batch import Batch
+
+__all__ = ['TEMPLATE_DIR', 'environment', 'render', 'checksum', 'remote_checksums', 'Uploads']
+
+TEMPLATE_DIR = PKG_DIR / 'templates'
+
+Upload = collections.namedtuple('Upload', 'dest text mode user')
+
+
+@functools.lru_cache(maxsize=None)
+def _environment(template_dir):
+    try:
+        cache_dir = CACHE_DIR / 'jinja'
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir))
+    except OSError:  # pragma: no cover
+        bytecode_cache = None
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(template_dir), bytecode_cache=bytecode_cache)
+
+
+def environment(template_dir=TEMPLATE_DIR):
+    """The shared Jinja environment for the templates in `template_dir`."""
+    return _environment(str(template_dir))
+
+
+def render(template, context=None, template_dir=TEMPLATE_DIR):
+    """Render the template file named `template` in `template_dir`.
+
+    Like `fabric.contrib.files.upload_template`, we strip a trailing newline, so files uploaded
+    with either are identical.
+    """
+    return environment(template_dir).get_template(template).render(**(context or {}))
+
+
+def checksum(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def remote_checksums(paths, sudo):
+    """Retrieve SHA256 checksums of remote files with one command; missing files are omitted.
+
+    :return: `dict` mapping paths to checksums.
+    """
+    if not paths:
+        return {}
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        out = sudo('sha256sum -- {0} 2>/dev/null'.format(
+            ' '.join('"{0}"'.format(p) for p in paths)))
+    res = {}
+    for line in '{0}'.format(out).splitlines():
+        digest, _, path = line.strip().partition('  ')
+        if path in paths:
+            res[path] = digest
+    return res
+
+
+class Uploads(object):
+    """Queue of rendered templates, uploaded upon `run` if they differ from the remote files.
+
+    Note that only the content of files is compared, not their mode or owner.
+    """
+
+    def __init__(self):
+        self.uploads = []
+
+    def __len__(self):
+        return len(self.uploads)
+
+    def add(self, template, dest, context=None, template_dir=TEMPLATE_DIR, mode=None, user=None):
+        """Queue the rendered template for upload to `dest`, to be owned by `user`.
+
+        :param user: Owner of the remote file, defaults to the connecting user.
+        """
+        self.uploads.append(
+            Upload(str(dest), render(template, context, template_dir), mode, user))
+        return self
+
+    def run(self, sudo=None, put=None):
+        """Upload the queued files which changed and empty the queue.
+
+        :return: `list` of remote paths of the uploaded files.
+        """
+        if sudo is None:
+            from fabric.api import sudo
+        if put is None:
+            from fabric.api import put
+        uploads, self.uploads = self.uploads, []
+
+        remote = remote_checksums([u.dest for u in uploads], sudo)
+        changed = [u for u in uploads if remote.get(u.dest) != checksum(u.text)]
+        chown = Batch()
+        for u in changed:
+            put(io.StringIO(u.text), u.dest, use_sudo=True, mode=u.mode)
+            chown.add('chown {0}: "{1}"'.format(u.user or env.user, u.dest))
+        chown.run(sudo=sudo)
+        return [u.dest for u in changed]
@@ -0,0 +1,240 @@
+# transfers.py - resumable, checksum-verified transfers of large files
+
+"""Transfers of large files - database dumps, downloads, archives - which survive interruptions.
+
+fabric's `put` and `get`, fabtools' `require.file` and a plain `curl -o` start over from scratch
+if a transfer of a multi-GB file is interrupted, and - unless an md5 sum is passed - don't check
+what arrived. Here,
+
+- files are transferred to a `.part` file first, in chunks - over SFTP for `upload` and
+  `download`, with `curl -C -`, i.e. HTTP Range requests, for `fetch`,
+- interrupted transfers are retried, resuming at the size of the `.part` file,
+- the sha256 sum of the transferred file - or a checksum passed in, e.g. from CDSTAR - is
+  verified before the `.part` file is moved into place, and the throughput is reported.
+"""
+import os
+import time
+import shlex
+import socket
+import hashlib
+import pathlib
+
+import paramiko
+from fabric.api import env, run, sudo, put, get, settings, hide
+from fabric.state import connections
+from clldutils.misc import format_size
+
+from . import session
+from .streams import Transfer
+from .artifacts import file_checksum
+
+__all__ = ['TransferError', 'upload', 'download', 'fetch']
+
+CHUNK_SIZE = 1024 * 1024
+RETRIES = 5
+REMOTE_DIR = '/tmp/appconfig-transfers'
+
+# Errors of an interrupted connection - rather than of a missing or unreadable file:
+INTERRUPTED = (EOFError, ConnectionError, socket.timeout, paramiko.SSHException)
+
+
+class TransferError(RuntimeError):
+    pass
+
+
+def _report(what, res):
+    print('{0}: {1} in {2:.1f} secs ({3}/s)'.format(
+        what, format_size(res.bytes), res.seconds, format_size(res.rate)))
+
+
+def _remote_checksum(path, algorithm='sha256', use_sudo=False):
+    """Checksum of the remote file at `path` - or `None` if it doesn't exist."""
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        out = (sudo if use_sudo else run)('{0}sum {1} 2> /dev/null'.format(
+            algorithm, shlex.quote(str(path))))
+    words = '{0}'.format(out).split()
+    return words[0] if out.succeeded and words else None
+
+
+def _retrying(transfer, retries):
+    """Call `transfer` with an SFTP client, reconnecting and calling again on interruptions.
+
+    :return: `Transfer` with the number of bytes `transfer` returns.
+    """
+    start = time.time()
+    for attempt in range(retries + 1):
+        try:
+            sftp = connections[env.host_string].open_sftp()
+            try:
+                nbytes = transfer(sftp)
+            finally:
+                sftp.close()
+            break
+        except INTERRUPTED as e:
+            if attempt == retries:
+                raise TransferError('transfer failed after {0} retries: {1}'.format(retries, e))
+            print('[{0}] transfer interrupted ({1}), resuming'.format(env.host_string, e))
+            connections.connect(env.host_string)
+    res = Transfer(nbytes, time.time() - start)
+    session.add_transfer(res.bytes, res.seconds)
+    return res
+
+
+def _put(sftp, local_path, part, size):
+    try:
+        offset = sftp.stat(part).st_size
+    except IOError:
+        offset = 0
+    if offset > size:
+        sftp.remove(part)
+        offset = 0
+    with local_path.open('rb') as src, sftp.open(part, 'ab') as dst:
+        dst.set_pipelined(True)
+        src.seek(offset)
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(chunk)
+    return size - offset
+
+
+def upload(local_path, remote_path, use_sudo=False, owner=None, group=None, mode=None,
+           retries=RETRIES):
+    """Upload the local file at `local_path` to `remote_path` - unless it's there already.
+
+    :return: `Transfer` - with `0` bytes if the remote file was up-to-date.
+    """
+    local_path, remote_path = pathlib.Path(local_path), str(remote_path)
+    if env.get('appconfig_plan'):
+        put(str(local_path), remote_path, use_sudo=use_sudo)
+        return Transfer(0, 0.0)
+
+    checksum = file_checksum(local_path)
+    if _remote_checksum(remote_path, use_sudo=use_sudo) != checksum:
+        # The name of the part file is keyed by checksum, thus we only resume the same file:
+        part = '{0}/{1}.{2}.part'.format(REMOTE_DIR, local_path.name, checksum[:16])
+        run('mkdir -p {0}'.format(REMOTE_DIR))
+        size = local_path.stat().st_size
+        res = _retrying(lambda sftp: _put(sftp, local_path, part, size), retries)
+        if _remote_checksum(part) != checksum:
+            run('rm -f {0}'.format(shlex.quote(part)))
+            raise TransferError('checksum mismatch for upload of {0}'.format(local_path))
+        _report('uploaded {0}'.format(local_path.name), res)
+        (sudo if use_sudo else run)('mv -f {0} {1}'.format(
+            shlex.quote(part), shlex.quote(remote_path)))
+    else:
+        res = Transfer(0, 0.0)
+
+    func = sudo if use_sudo else run
+    if owner or group:
+        func('chown {0}:{1} {2}'.format(owner or '', group or '', shlex.quote(remote_path)))
+    if mode:
+        func('chmod {0} {1}'.format(mode, shlex.quote(remote_path)))
+    return res
+
+
+def _get(sftp, remote_path, part, size, digest):
+    offset = part.stat().st_size if part.exists() else 0
+    if offset > size:
+        part.unlink()
+        offset = 0
+    with part.open('ab') as dst, sftp.open(remote_path, 'rb') as src:
+        src.seek(offset)
+        src.prefetch(size)
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(chunk)
+            digest.update(chunk)
+    return size - offset
+
+
+def download(remote_path, local_path, retries=RETRIES):
+    """Download the remote file at `remote_path` to `local_path`.
+
+    :return: `Transfer`.
+    """
+    local_path, remote_path = pathlib.Path(local_path), str(remote_path)
+    if env.get('appconfig_plan'):
+        get(remote_path, str(local_path))
+        return Transfer(0, 0.0)
+
+    checksum = _remote_checksum(remote_path)
+    if checksum is None:
+        raise TransferError('remote file {0} not found'.format(remote_path))
+    part = local_path.with_name(local_path.name + '.part')
+    state = {}
+
+    def transfer(sftp):
+        # The checksum is computed while downloading - starting with what we have already:
+        digest = hashlib.sha256()
+        if part.exists():
+            with part.open('rb') as fp:
+                for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        nbytes = _get(sftp, remote_path, part, sftp.stat(remote_path).st_size, digest)
+        state['checksum'] = digest.hexdigest()
+        return nbytes
+
+    res = _retrying(transfer, retries)
+    if state['checksum'] != checksum:
+        if part.exists():
+            part.unlink()
+        raise TransferError('checksum mismatch for download of {0}'.format(remote_path))
+    os.replace(str(part), str(local_path))
+    _report('downloaded {0}'.format(local_path.name), res)
+    return res
+
+
+def _fetch_part(url, remote_path, checksum, size):
+    """Name of the part file for a download - keyed by what we know about it."""
+    key = hashlib.sha256('{0} {1} {2}'.format(url, checksum, size).encode('utf8')).hexdigest()
+    return '{0}.{1}.part'.format(remote_path, key[:16])
+
+
+def fetch(url, remote_path, auth='', sha256=None, md5=None, size=None, retries=RETRIES):
+    """Download `url` to `remote_path` on the host, resuming interrupted downloads.
+
+    The download is verified against `sha256` or `md5` or - lacking a checksum - `size`.
+
+    :param auth: curl options for authentication, e.g. `-u"user:password"`.
+    :return: `Transfer`.
+    """
+    remote_path = str(remote_path)
+    algorithm, checksum = ('sha256', sha256) if sha256 else ('md5', md5)
+    if checksum and not env.get('appconfig_plan') and \
+            _remote_checksum(remote_path, algorithm) == checksum:
+        return Transfer(0, 0.0)
+
+    # Thus we only resume downloads of the same file:
+    part = _fetch_part(url, remote_path, checksum, size)
+    if not (checksum or size):
+        # We couldn't tell a stale part file from a good one, thus we start over:
+        run('rm -f {0}'.format(shlex.quote(part)))
+    start = time.time()
+    for attempt in range(retries + 1):
+        with settings(warn_only=True):
+            # -C -: continue at the size of the part file.
+            out = run('curl -fsS -L -C - {0}-o {1} {2}'.format(
+                auth + ' ' if auth else '', shlex.quote(part), shlex.quote(url)))
+        if out.succeeded:
+            break
+        if out.return_code == 33:  # The server doesn't support ranges, thus start over.
+            run('rm -f {0}'.format(shlex.quote(part)))
+        if attempt == retries:
+            raise TransferError('download of {0} failed after {1} retries'.format(url, retries))
+        print('[{0}] download interrupted, resuming'.format(env.host_string))
+
+    if not env.get('appconfig_plan'):
+        with settings(hide('running', 'stdout')):
+            nbytes = int('{0}'.format(run('stat -c %s {0}'.format(shlex.quote(part)))))
+        res = Transfer(nbytes, time.time() - start)
+        session.add_transfer(res.bytes, res.seconds)
+        if checksum:
+            verified = _remote_checksum(part, algorithm) == checksum
+        else:
+            verified = size is None or nbytes == size
+        if not verified:
+            run('rm -f {0}'.format(shlex.quote(part)))
+            raise TransferError('verification failed for download of {0}'.format(url))
+        _report('fetched {0}'.format(url.rpartition('/')[2]), res)
+    else:
+        res = Transfer(0, 0.0)
+    run('mv -f {0} {1}'.format(shlex.quote(part), shlex.quote(remote_path)))
+    return res
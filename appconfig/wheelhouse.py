@@ -0,0 +1,194 @@
+# wheelhouse.py - build wheels once, install them offline on the hosts
+
+"""Wheels for the pinned requirements of apps, built once and installed with `pip --no-index`.
+
+Installing an app's requirements from PyPI means every host downloads all packages - and
+compiles packages like lxml or psycopg2 - on every deploy. A `Wheelhouse`
+
+- builds wheels for the pinned requirements in `apps/<name>/requirements.txt` (except for
+  editable installs like the app package itself) once, either locally or on a build host,
+- caches them locally in one pool per build host, so apps pinning the same versions share
+  wheels, and remembers which wheels make up a set of requirements by hash of the requirements,
+- uploads wheels missing on a host to a directory shared by all apps on the host and
+- installs them from there, without accessing an index.
+
+Wheels contain compiled code for a particular interpreter and platform, so wheels must be built
+on a machine matching the hosts, e.g. on a build host specified via environment variable
+APPCONFIG_BUILD_HOST. Thus, wheels are cached per build host and tag - e.g. `cp35-linux-x86_64`
+- and only installed on hosts with the same tag.
+"""
+import sys
+import warnings
+import sysconfig
+import shlex
+import shutil
+import hashlib
+import pathlib
+import tempfile
+import subprocess
+
+from fabric.api import env, settings, hide, run, get, put
+
+from . import CACHE_DIR
+
+__all__ = ['Wheelhouse', 'read_requirements', 'requirements_hash', 'local_tag']
+
+REMOTE_DIR = '/var/cache/appconfig/wheels'
+# Prints the tag of the python it is run with, like `local_tag`:
+TAG_COMMAND = 'python3 -c "import sys, sysconfig; ' \
+              'print(\'cp%d%d-%s\' % (sys.version_info[:2] + (sysconfig.get_platform(),)))"'
+
+
+def read_requirements(path):
+    """Read the pinned requirements from a `pip freeze` file, skipping editable installs.
+
+    Unpinned requirements are skipped, too - their wheels would never be updated.
+
+    :return: sorted `list` of requirement specifiers.
+    """
+    res = set()
+    with pathlib.Path(path).open(encoding='utf-8') as fp:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith(('#', '-e', '--editable')):
+                if '==' not in line:
+                    warnings.warn('skipping unpinned requirement: %s' % line)
+                    continue
+                res.add(line)
+    return sorted(res)
+
+
+def local_tag():
+    """Interpreter and platform wheels built with the local python are for."""
+    return 'cp%d%d-%s' % (sys.version_info[:2] + (sysconfig.get_platform(),))
+
+
+def requirements_hash(requirements):
+    return hashlib.sha256('\n'.join(sorted(requirements)).encode('utf-8')).hexdigest()
+
+
+class Wheelhouse(object):
+    """Local cache of wheels built on `build_host` (or locally, if `None`).
+
+    :param directory: Local cache directory, defaults to a subdirectory of `CACHE_DIR`.
+    """
+
+    def __init__(self, build_host=None, directory=None):
+        self.build_host = build_host
+        self.root = pathlib.Path(directory or CACHE_DIR / 'wheelhouse') / (build_host or 'local')
+        self._tag = None
+
+    @property
+    def tag(self):
+        """Interpreter and platform tag of the wheels built on the build host."""
+        if self._tag is None:
+            if self.build_host:
+                with settings(hide('running', 'stdout'), host_string=self.build_host):
+                    self._tag = '{0}'.format(run(TAG_COMMAND)).strip()
+            else:
+                self._tag = local_tag()
+        return self._tag
+
+    @property
+    def directory(self):
+        return self.root / self.tag
+
+    @property
+    def manifests(self):
+        return self.directory / 'manifests'
+
+    def _manifest(self, requirements):
+        return self.manifests / '{0}.txt'.format(requirements_hash(requirements))
+
+    def wheels(self, requirements):
+        """Paths of the cached wheels for `requirements`, which are built if necessary.
+
+        In plan mode, missing wheels are not built - and no paths returned.
+        """
+        manifest = self._manifest(requirements)
+        if manifest.exists():
+            paths = [self.directory / n for n in manifest.read_text(encoding='utf-8').split()]
+            if all(p.exists() for p in paths):
+                return paths
+        if env.get('appconfig_plan'):  # Nothing is built when planning.
+            return []
+        return self.build(requirements)
+
+    def build(self, requirements):
+        """Build wheels for `requirements` and add them to the cache.
+
+        Wheels already in the cache are re-used rather than rebuilt.
+        """
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix='appconfig-wheels-'))
+        try:
+            reqs = tmp / 'requirements.txt'
+            reqs.write_text(''.join(r + '\n' for r in requirements), encoding='utf-8')
+            wheel_dir = tmp / 'wheels'
+            wheel_dir.mkdir()
+            if self.build_host:
+                self._build_remote(reqs, wheel_dir, requirements_hash(requirements))
+            else:
+                if not self.directory.exists():
+                    self.directory.mkdir(parents=True)
+                subprocess.check_call([
+                    sys.executable, '-m', 'pip', 'wheel', '--find-links', str(self.directory),
+                    '--wheel-dir', str(wheel_dir), '-r', str(reqs)])
+
+            if not self.manifests.exists():
+                self.manifests.mkdir(parents=True)
+            names = sorted(p.name for p in wheel_dir.glob('*.whl'))
+            for name in names:
+                if not (self.directory / name).exists():
+                    shutil.move(str(wheel_dir / name), str(self.directory / name))
+            self._manifest(requirements).write_text(
+                ''.join(n + '\n' for n in names), encoding='utf-8')
+            return [self.directory / n for n in names]
+        finally:
+            shutil.rmtree(str(tmp))
+
+    def _build_remote(self, reqs, wheel_dir, digest):
+        rtmp = '/tmp/appconfig-wheels-{0}'.format(digest[:12])
+        with settings(host_string=self.build_host):
+            run('mkdir -p {0}/wheels'.format(rtmp))
+            put(str(reqs), '{0}/requirements.txt'.format(rtmp))
+            run('python3 -m pip wheel --find-links {1} --wheel-dir {0}/wheels '
+                '-r {0}/requirements.txt'.format(rtmp, REMOTE_DIR))
+            with hide('running'):
+                get('{0}/wheels/*.whl'.format(rtmp), str(wheel_dir) + '/%(basename)s')
+            run('rm -rf {0}'.format(rtmp))
+
+    def upload(self, wheels, sudo=None, put=None):
+        """Upload those of the `wheels` which are not yet in `REMOTE_DIR` on the current host.
+
+        :return: `list` of names of the uploaded wheels.
+        """
+        if sudo is None:
+            from fabric.api import sudo
+        if put is None:
+            from fabric.api import put
+        with settings(hide('running', 'stdout')):
+            remote = set('{0}'.format(
+                sudo('mkdir -p {0} && chmod 755 {0} && ls -1 {0}'.format(REMOTE_DIR))).split())
+        missing = [p for p in wheels if p.name not in remote]
+        for p in missing:
+            put(str(p), '{0}/{1}'.format(REMOTE_DIR, p.name), use_sudo=True, mode='644')
+        return [p.name for p in missing]
+
+    def install(self, requirements, sudo=None, put=None):
+        """Install `requirements` from wheels into the active virtualenv on the current host.
+
+        :return: Whether the wheels were installed, i.e. whether the host has the wheels' tag.
+        """
+        if sudo is None:
+            from fabric.api import sudo
+        with settings(hide('running', 'stdout')):
+            host_tag = '{0}'.format(sudo(TAG_COMMAND.replace('python3', 'python', 1))).strip()
+        if host_tag != self.tag and not env.get('appconfig_plan'):
+            warnings.warn('wheels built for {0} cannot be installed on {1}, see '
+                          'APPCONFIG_BUILD_HOST'.format(self.tag, host_tag))
+            return False
+        wheels = self.wheels(requirements)
+        self.upload(wheels, sudo=sudo, put=put)
+        sudo('pip install --no-index --find-links {0} {1}'.format(
+            REMOTE_DIR, ' '.join(shlex.quote(r) for r in requirements)))
+        return True
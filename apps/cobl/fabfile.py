@@ -11,5 +11,5 @@ def shutdown(app):
 
 
 @task_app_from_environment
-def backup_to_cdstar(app):
-    upload_db_to_cdstar(app)
+def backup_to_cdstar(app, dedup=False):
+    upload_db_to_cdstar(app, dedup=dedup)
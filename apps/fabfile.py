@@ -9,7 +9,7 @@ env.use_ssh_config = True
 
 
 def run_sql_(sql):
-    apps = [a for a in APPS.values() if a.stack == 'clld' and a.production == env.host]
+    apps = [a for a in APPS.by_production.get(env.host, ()) if a.stack == 'clld']
     if apps:
         with hide('output'):
             dbs = [
@@ -20,4 +20,4 @@ def run_sql_(sql):
 
 
 def run_sql(sql):
-    execute(run_sql_, sql, hosts=set(app.production for app in APPS.values()))
+    execute(run_sql_, sql, hosts=APPS.production_hosts)
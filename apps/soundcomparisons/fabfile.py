@@ -10,6 +10,7 @@ from collections import Counter
 from fabric.api import sudo, get
 from fabric.contrib.files import exists
 from fabtools import require
+from appconfig import compression
 from appconfig.tasks import *
 
 init()
@@ -32,7 +33,7 @@ def read_from_db(app, sql_):
     if exists(remote_path):
         sudo('rm {0}'.format(remote_path))
     sql(app, sql_.replace('OUTFILE', "OUTFILE '{0}'".format(remote_path)))
-    sudo('gzip -f {0}'.format(remote_path))
+    sudo('{0} < {1} > {1}.gz && rm {1}'.format(compression.gzip_command(), remote_path))
     local_file = NamedTemporaryFile(delete=False, suffix='.gz')
     get(remote_path + '.gz', local_file.name)
     sudo('rm {0}.gz'.format(remote_path))
@@ -49,8 +50,8 @@ def shutdown(app):
 
 
 @task_app_from_environment
-def backup_to_cdstar(app):
-    upload_db_to_cdstar(app, dbname='v4')
+def backup_to_cdstar(app, dedup=False):
+    upload_db_to_cdstar(app, dbname='v4', dedup=dedup)
 
 
 #
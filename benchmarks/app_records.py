@@ -0,0 +1,72 @@
+# app_records.py - benchmark App records against the former argparse.Namespace implementation
+"""
+Usage: python benchmarks/app_records.py [NUMBER]
+
+Compares construction time, `replace` time and memory per record of `appconfig.config.App`
+with `NamespaceApp`, a copy of the implementation based on `argparse.Namespace`.
+"""
+import sys
+import copy
+import timeit
+import argparse
+import tracemalloc
+
+from appconfig.config import App
+
+
+class NamespaceApp(argparse.Namespace):
+    _fields = App._fields
+
+    def __init__(self, **kwargs):
+        kw = self._fields.copy()
+        for k, f in list(kw.items()):
+            try:
+                value = kwargs.pop(k)
+            except KeyError:
+                raise ValueError('missing attribute %r' % k)
+            kw[k] = f(value) if f is not None else value
+        if kwargs:
+            raise ValueError('unknown attribute(s) %r' % kwargs)
+        super(NamespaceApp, self).__init__(**kw)
+
+    def replace(self, **kwargs):
+        old, new = self.__dict__, self._fields.copy()
+        for k, f in list(new.items()):
+            if k in kwargs:
+                value = f(kwargs.pop(k)) if f is not None else kwargs.pop(k)
+            else:
+                value = copy.copy(old[k])
+            new[k] = value
+        if kwargs:
+            raise ValueError('unknown attribute(s) %r' % kwargs)
+        inst = object.__new__(self.__class__)
+        inst.__dict__ = new
+        return inst
+
+
+def memory_per_record(cls, kw, n=1000):
+    proto = cls(**kw)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    records = [proto.replace(port=str(i)) for i in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    assert len(records) == n
+    return size / n
+
+
+def main(number=10000):
+    kw = {k: '1' for k in App._fields}
+    kw.update(name='wals3', require_deb='git curl nginx', home_dir='/home/wals3')
+    print('{0:14} {1:>14} {2:>14} {3:>14}'.format('', 'construct us', 'replace us', 'bytes/record'))
+    for cls in [NamespaceApp, App]:
+        inst = cls(**kw)
+        construct = timeit.timeit(lambda: cls(**kw), number=number) / number
+        replace = timeit.timeit(lambda: inst.replace(port='8080'), number=number) / number
+        print('{0:14} {1:14.2f} {2:14.2f} {3:14.0f}'.format(
+            cls.__name__, construct * 1e6, replace * 1e6, memory_per_record(cls, kw)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,68 @@
+# compression.py - benchmark the compression codecs for database dumps
+"""
+Usage: python benchmarks/compression.py [DUMP]
+
+Compresses and decompresses DUMP - an uncompressed SQL dump, by default a synthetic one of about
+50 MB - with each codec of `appconfig.compression` which is installed locally, and reports
+compression ratio and throughput, i.e. MB of uncompressed SQL per second.
+"""
+import sys
+import time
+import random
+import shutil
+import pathlib
+import tempfile
+import subprocess
+
+from appconfig import compression
+
+SIZE = 50 * 1024 * 1024
+
+
+def synthetic_dump(path, size=SIZE):
+    rand = random.Random(42)
+    words = ['lexeme', 'language', 'source', 'parameter', 'value', 'contribution', 'unit']
+    with path.open('w', encoding='utf8') as fp:
+        fp.write('COPY public.value (pk, id, name, description, language_pk) FROM stdin;\n')
+        pk = 0
+        while fp.tell() < size:
+            pk += 1
+            fp.write('{0}\t{1}-{0}\t{2}\t{3}\t{4}\n'.format(
+                pk, rand.choice(words), ' '.join(rand.choice(words) for _ in range(3)),
+                rand.random(), rand.randint(1, 2500)))
+        fp.write('\\.\n')
+
+
+def timed(command, source, target):
+    with source.open('rb') as stdin, target.open('wb') as stdout:
+        start = time.perf_counter()
+        subprocess.check_call(['bash', '-c', command], stdin=stdin, stdout=stdout)
+        return time.perf_counter() - start
+
+
+def main(dump=None):
+    tmp = pathlib.Path(tempfile.mkdtemp())
+    try:
+        if dump is None:
+            dump = tmp / 'dump.sql'
+            synthetic_dump(dump)
+        dump = pathlib.Path(dump)
+        mb = dump.stat().st_size / 1024 / 1024
+        print('{0:6} {1:>7} {2:>16} {3:>18}'.format(
+            'codec', 'ratio', 'compress MB/s', 'decompress MB/s'))
+        for codec in compression.CODECS.values():
+            if not shutil.which(codec.compress.split()[0]):
+                print('{0:6} not installed'.format(codec.name))
+                continue
+            compressed = tmp / ('compressed' + codec.suffix)
+            ctime = timed(codec.compress_command(), dump, compressed)
+            dtime = timed(compression.decompress_command(compressed), compressed, tmp / 'out.sql')
+            print('{0:6} {1:7.2f} {2:16.1f} {3:18.1f}'.format(
+                codec.name, dump.stat().st_size / compressed.stat().st_size,
+                mb / ctime, mb / dtime))
+    finally:
+        shutil.rmtree(str(tmp))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
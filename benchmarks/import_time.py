@@ -0,0 +1,53 @@
+# import_time.py - benchmark start-up cost of importing appconfig and loading APPS
+"""
+Usage: python benchmarks/import_time.py [REPEAT]
+
+Each scenario runs in a fresh interpreter, so module caching doesn't skew the numbers:
+
+- import: `import appconfig.tasks`, as done by every fabfile
+- cold: import plus loading APPS without a snapshot (i.e. parsing and interpolating apps.ini)
+- warm: import plus loading APPS from an up-to-date snapshot
+"""
+import os
+import sys
+import time
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+SCENARIOS = [
+    ('import', 'import appconfig.tasks', False),
+    ('cold', 'import appconfig; appconfig.APPS.load()', False),
+    ('warm', 'import appconfig; appconfig.APPS.load()', True),
+]
+
+
+def measure(code, keep_cache, repeat):
+    timings = []
+    cache_dir = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ, APPCONFIG_CACHE_DIR=cache_dir, PYTHONWARNINGS='ignore')
+        if keep_cache:  # Create the snapshot once, up front.
+            subprocess.check_call([sys.executable, '-c', code], env=env)
+        for _ in range(repeat):
+            if not keep_cache:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code], env=env)
+            timings.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return timings
+
+
+def main(repeat=10):
+    baseline = statistics.median(measure('pass', False, repeat))
+    print('{0:8} {1:>10} {2:>10}'.format('scenario', 'median ms', 'net ms'))
+    for name, code, keep_cache in SCENARIOS:
+        median = statistics.median(measure(code, keep_cache, repeat))
+        print('{0:8} {1:10.1f} {2:10.1f}'.format(name, median * 1000, (median - baseline) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
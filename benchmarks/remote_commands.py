@@ -0,0 +1,109 @@
+# remote_commands.py - count remote invocations of a deploy
+"""
+Usage: python benchmarks/remote_commands.py [APP]
+
+Runs `tasks.deploy` for APP (default: wals3) in production mode against a fake host, with and
+without batching of remote commands (see `appconfig.batch`), and reports the number of remote
+commands and file uploads - in total and per deploy phase. Remote commands are answered with
+canned output; nothing is executed and no connection is made.
+"""
+import sys
+import base64
+import contextlib
+import collections
+
+import mock
+import fabric.sftp
+import fabric.operations
+from fabric.api import settings, hide
+from fabric.operations import _AttributeString
+
+from appconfig import APPS, tasks, readiness
+
+CANNED = [
+    ('uname -s', 'Linux'),
+    ('lsb_release --id', 'Ubuntu'),
+    ('lsb_release --codename', 'xenial'),
+    ('lsb_release -r', '16.04'),
+    ('find /usr/lib/postgresql/', '/usr/lib/postgresql/9.5'),
+    ('clld.__file__', 'lib/python3.5/site-packages/clld/__init__.py'),
+    ('/_ping', '{"status": "ok"}'),
+    # The readiness script, base64 encoded:
+    (base64.b64encode(readiness.SCRIPT[:9].encode('ascii')).decode('ascii'), '0 ready 2000'),
+]
+
+
+class Counter(object):
+    def __init__(self):
+        self.commands, self.uploads = [], []
+        self.phases, self._phase = collections.Counter(), []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._phase.append(name)
+        try:
+            yield
+        finally:
+            self._phase.pop()
+
+    def run_command(self, command, *args, **kwargs):
+        self.commands.append(command)
+        self.phases[self._phase[-1] if self._phase else '-'] += 1
+        out = _AttributeString(next((o for k, o in CANNED if k in command), ''))
+        # A fresh host: no file exists yet, except for the tools we ask about.
+        ok = not command.startswith('test ') or 'lsb_release' in command
+        out.succeeded, out.failed, out.return_code, out.stderr = ok, not ok, 0 if ok else 1, ''
+        return out
+
+    def put(self, sftp, local_path, remote_path, *args, **kwargs):
+        self.uploads.append(remote_path)
+        return remote_path
+
+
+@contextlib.contextmanager
+def fake_host(counter):
+    with mock.patch.multiple(
+            fabric.sftp.SFTP,
+            __init__=lambda self, host_string: setattr(self, 'ftp', mock.Mock()),
+            exists=lambda self, path: False,
+            isdir=lambda self, path: False,
+            put=counter.put), \
+            mock.patch('fabric.operations._run_command', counter.run_command), \
+            mock.patch.multiple(
+                'appconfig.tasks.deployment',
+                local=mock.Mock(return_value='HEAD'),
+                confirm=mock.Mock(return_value=False),
+                pip_freeze=mock.Mock(),
+                time=mock.Mock(),
+                phase=counter.phase), \
+            mock.patch('appconfig.tasks.helpers.getpwd', return_value='pwd'), \
+            mock.patch(
+                'appconfig.readiness.wait',
+                lambda targets: [readiness.Ready(url, True, 0.0) for url, _ in targets]), \
+            settings(hide('everything'), host_string='benchmark', host='benchmark'):
+        yield
+
+
+def count(app, batch=True):
+    counter = Counter()
+    with fake_host(counter), settings(appconfig_batch=batch, environment='production'):
+        tasks.deploy.execute_inner(app, with_blog=False)
+    return counter
+
+
+def main(app='wals3'):
+    app = APPS[app]
+    counters = collections.OrderedDict(
+        (mode, count(app, batch=batch))
+        for mode, batch in [('unbatched', False), ('batched', True)])
+    print('{0:12} {1:>9} {2:>8}'.format('mode', 'commands', 'uploads'))
+    for mode, c in counters.items():
+        print('{0:12} {1:9} {2:8}'.format(mode, len(c.commands), len(c.uploads)))
+    print('\n{0:12} {1:>9} {2:>8}'.format('phase', 'unbatched', 'batched'))
+    for name in counters['unbatched'].phases:
+        print('{0:12} {1:9} {2:8}'.format(
+            name, counters['unbatched'].phases[name], counters['batched'].phases[name]))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
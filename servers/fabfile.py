@@ -30,7 +30,7 @@ def renew_certs():
             certs = set(sudo('ls -1 /etc/letsencrypt/live').split())
         else:
             certs = set()
-        apps = set(a.domain for a in APPS.values() if a.production == env['host'])
+        apps = set(a.domain for a in APPS.by_production.get(env['host'], ()))
         apps.add(env['host'])
         for cert in certs - apps:
             # Obsolete certificate! The app is no longer deployed on this host.
@@ -46,8 +46,8 @@ def renew_certs():
 def last_deploy():
     global ACC
     with settings(warn_only=True):
-        for a in APPS.values():
-            if a.production == env.host and exists(str(a.config)):
+        for a in APPS.by_production.get(env.host, ()):
+            if exists(str(a.config)):
                 res = parse(run('stat -c "%y" {0}'.format(a.config)))
                 ACC.append((a.name, res))
     if env.host == env.hosts[-1]:
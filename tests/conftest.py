@@ -2,6 +2,11 @@
 
 from __future__ import unicode_literals
 
+import time
+import threading
+import http.server
+import socketserver
+
 try:
     import pathlib2 as pathlib
 except ImportError:
@@ -32,3 +37,31 @@ def app(config, name='testapp'):
 @pytest.fixture
 def APP(mocker, app):
     yield mocker.patch('appconfig.tasks.APP', app)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.endswith('/slow'):
+            time.sleep(2)
+        code = {'_ping': 200, '_raise': 500, 'slow': 200}.get(self.path.rpartition('/')[2], 404)
+        self.send_response(code)
+        self.end_headers()
+        self.wfile.write(b'{"status": "ok"}')
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture(scope='session')
+def http_server():
+    """Local stand-in for app servers: /_ping returns 200, /_raise 500, /slow takes 2 secs."""
+    server = _Server(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
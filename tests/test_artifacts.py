@@ -0,0 +1,41 @@
+import shutil
+
+from fabric.api import settings
+
+from appconfig.artifacts import Artifacts, file_checksum, REMOTE_DIR
+
+
+def test_require(tmp_path, mocker):
+    artifacts = Artifacts(directory=tmp_path / 'cache')
+    tarball = tmp_path / 'artifact.tar.gz'
+    tarball.write_bytes(b'binary')
+    build = mocker.Mock()
+    sudo, put = mocker.Mock(), mocker.Mock()
+    get = mocker.Mock(side_effect=lambda remote, local: shutil.copy(str(tarball), local))
+
+    # Not cached, so the artifact is built on the host and downloaded:
+    assert artifacts.require(('bibutils_6.2', 'xenial'), build, sudo=sudo, put=put, get=get)
+    stage = build.call_args[0][0]
+    assert stage.startswith(REMOTE_DIR) and 'tar czf' in sudo.call_args_list[1][0][0]
+    assert get.call_args[0][0] == REMOTE_DIR + '/bibutils_6.2-xenial.tar.gz'
+    assert artifacts.cached('bibutils_6.2', 'xenial')
+    assert file_checksum(tarball) in sudo.call_args[0][0]
+    assert not put.called
+
+    # Cached, so the tarball is uploaded:
+    sudo.reset_mock()
+    assert not artifacts.require(('bibutils_6.2', 'xenial'), build, sudo=sudo, put=put, get=get)
+    assert build.call_count == 1 and put.call_count == 1
+    assert 'sha256sum -c' in sudo.call_args[0][0]
+
+    # A corrupted tarball is rebuilt:
+    artifacts.path('bibutils_6.2', 'xenial').write_bytes(b'corrupt')
+    assert not artifacts.cached('bibutils_6.2', 'xenial')
+    assert artifacts.require(('bibutils_6.2', 'xenial'), build, sudo=sudo, put=put, get=get)
+
+
+def test_require_plan(tmp_path, mocker):
+    build, sudo, get = mocker.Mock(), mocker.Mock(), mocker.Mock()
+    with settings(appconfig_plan=True):
+        assert Artifacts(directory=tmp_path).require(('a', '1'), build, sudo=sudo, get=get)
+    assert build.called and not get.called
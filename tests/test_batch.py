@@ -0,0 +1,64 @@
+import subprocess
+
+import pytest
+
+from appconfig.batch import Batch, BatchError
+
+
+def _bash(cmd, user=None):
+    assert cmd.startswith('echo ') and cmd.endswith(' | base64 -d | bash')
+    # Like fabric's sudo with warn_only, we return the output regardless of the exit status:
+    return subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE).stdout.decode('utf8')
+
+
+def test_batch(tmp_path):
+    batch = Batch().directory(tmp_path / 'a b', mode='700').add('echo "it\'s"; echo err >&2')
+    assert len(batch) == 3
+    results = batch.run(sudo=_bash)
+    assert (tmp_path / 'a b').is_dir()
+    assert [r.ok for r in results] == [True, True, True]
+    assert results[-1].output == "it's\nerr"
+    assert len(batch) == 0 and batch.run(sudo=_bash) == []
+
+
+def test_batch_failure():
+    with pytest.raises(BatchError, match='return code 1'):
+        Batch().add('false').add('echo never').run(sudo=_bash)
+
+    results = Batch().add('exit 3').add('echo never').run(sudo=_bash, warn_only=True)
+    assert [r.return_code for r in results] == [3, None]
+
+
+def test_batch_script_failure():
+    from fabric.operations import _AttributeString
+
+    def sudo(cmd, user=None):  # e.g. a wrong sudo password - no command ran at all.
+        out = _AttributeString('sudo: 3 incorrect password attempts')
+        out.failed, out.return_code = True, 1
+        return out
+
+    batch = Batch().add('true')
+    with pytest.raises(BatchError, match='incorrect password'):
+        batch.run(sudo=sudo)
+    with pytest.raises(BatchError):
+        Batch().add('true').run(sudo=sudo, warn_only=True)
+    assert len(batch) == 0
+
+
+def test_batch_user():
+    batch = Batch().user('app')
+    assert 'usermod -s /bin/bash app' in batch.commands[0][0]
+    assert 'useradd --create-home -s /bin/bash app' in batch.commands[0][0]
+
+
+def test_batch_unbatched(mocker):
+    sudo = mocker.Mock(return_value='')
+    mocker.patch('appconfig.batch.env', {'appconfig_batch': False})
+    results = Batch().add('ls').add('ls', user='postgres').run(sudo=sudo)
+    assert sudo.call_count == 2 and all(r.ok for r in results)
+
+
+def test_batch_packages():
+    batch = Batch().packages(['vim', 'git'])
+    assert len(batch) == 1
+    assert 'dpkg -s $p' in batch.commands[0][0] and 'vim git;' in batch.commands[0][0]
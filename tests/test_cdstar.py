@@ -24,3 +24,27 @@ def test_add_bitstream(mocker, testdir):
     mocker.patch('appconfig.cdstar.RollingBlob', RB)
     cdstar.add_bitstream('oid', testdir / 'apps.ini')
     assert RB.add.called
+
+
+def test_chunked_backup(mocker, tmp_path):
+    from appconfig import chunks
+
+    def bitstream(name):
+        return mocker.Mock(id=name)
+
+    manifest = chunks.Manifest(10, 'x', [('a', 5), ('b', 5)])
+    old = mocker.Mock(is_manifest=True, **{'read_manifest.return_value': manifest})
+    store = mocker.Mock(id='store', bitstreams=[bitstream('a.gz'), bitstream('c.gz')])
+    mocker.patch.multiple(
+        'appconfig.cdstar',
+        RollingBlob=mocker.Mock(),
+        get_api=mocker.Mock(),
+        get_chunk_store=mocker.Mock(return_value=store),
+        get_bitstreams=mocker.Mock(return_value=[old, mocker.Mock(is_manifest=False)]))
+    assert cdstar.get_chunks('oid') == {'a.gz', 'c.gz'}
+
+    cdstar.add_chunked_backup('oid', manifest, tmp_path, ['b.gz'])
+    assert store.add_bitstream.call_args[1]['name'] == 'b.gz'
+    assert tmp_path.joinpath('manifest.json').exists()
+    # Chunks which aren't referenced by any backup are deleted:
+    assert store.bitstreams[1].delete.called and not store.bitstreams[0].delete.called
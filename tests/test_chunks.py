@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+import subprocess
+import random
+
+import pytest
+
+from appconfig import chunks
+
+
+def dump(rows):
+    return ''.join('{0}\t{1}\n'.format(i, row) for i, row in enumerate(rows)).encode('utf8')
+
+
+def backup(directory, data, known=()):
+    chunker = chunks.Chunker(directory, known=known, min_size=1000, mask=0xf, max_size=8000)
+    for i in range(0, len(data), 777):  # Writes don't align with lines.
+        chunker.write(data[i:i + 777])
+    return chunker, chunker.close()
+
+
+def test_chunker(tmp_path):
+    rand = random.Random(1)
+    rows = ['{0:x}'.format(rand.getrandbits(128)) for _ in range(5000)]
+    data = dump(rows)
+    first, manifest = backup(tmp_path, data)
+    assert manifest.size == len(data) and len(manifest.chunks) > 10
+    assert len(first.new) == len(set(manifest.names))
+    # Concatenated chunks restore the dump:
+    assert gzip.decompress(b''.join(
+        tmp_path.joinpath(name).read_bytes() for name in manifest.names)) == data
+
+    # A changed row only changes the chunk it is in - and maybe merges it with the next one:
+    rows[2500] = 'changed'
+    second, manifest2 = backup(tmp_path, dump(rows), known=first.known)
+    assert len(second.new) == 1
+    assert len(set(manifest.names) & set(manifest2.names)) >= len(manifest.chunks) - 2
+
+    assert chunks.Manifest.from_json(manifest2.to_json()) == manifest2
+    with pytest.raises(ValueError):
+        chunks.Manifest.from_json('{}')
+
+
+def test_chunker_long_lines(tmp_path):
+    _, manifest = backup(tmp_path, b'x' * 20000)
+    assert [size for _, size in manifest.chunks] == [8000, 8000, 4000]
+
+
+def test_curl_config():
+    assert chunks.curl_config(['http://example.org/a.gz']) == 'url = "http://example.org/a.gz"\n'
+
+
+@pytest.mark.parametrize('data,ok', [(b'COPY x;\n1\n', True), (b'COPY x;\n2\n', False)])
+def test_verified_command(tmp_path, data, ok):
+    dump = tmp_path / 'dump.sql'
+    dump.write_bytes(data)
+    manifest = chunks.Manifest(10, hashlib.sha256(b'COPY x;\n1\n').hexdigest(), [])
+    out = subprocess.check_output(
+        ['bash', '-c', chunks.verified_command('cat {0}'.format(dump), manifest)])
+    assert out.startswith(data) and (out == data) == ok
+    if not ok:
+        assert out.endswith(b"RAISE EXCEPTION 'dump does not match its manifest'; END $$;\n")
+
+    # A failing download is never taken for a complete dump:
+    out = subprocess.check_output(
+        ['bash', '-c', chunks.verified_command('(cat {0}; false)'.format(dump), manifest)])
+    assert b'\\.' in out
@@ -15,6 +15,18 @@ def test_ls(capsys):
     assert 'wals3' in out
 
 
+def test_ls_live(mocker, capsys):
+    from appconfig.__main__ import ls
+    from appconfig.probes import Probe
+
+    mocker.patch(
+        'appconfig.__main__.probes.iter_probes',
+        lambda urls: (Probe(u, 200, 0.1, None) for u in urls))
+    ls(['--live'])
+    out, err = capsys.readouterr()
+    assert 'status' in out and 'wals3' in out and 'up' in out
+
+
 def test_error(mocker):
     from appconfig.__main__ import test_error
 
@@ -26,3 +38,104 @@ def test_error(mocker):
     mocker.patch(
         'appconfig.__main__.urlopen', mocker.Mock(side_effect=HTTPError('', 500, '', {}, None)))
     test_error('wals3')
+
+
+def test_diff(mocker, capsys, testdir):
+    from appconfig.__main__ import diff
+
+    mocker.patch(
+        'appconfig.__main__.subprocess.check_output',
+        return_value=(testdir / 'apps.ini').read_bytes())
+    diff([])
+    out, err = capsys.readouterr()
+    assert '+ wals3' in out and '- testapp' in out
+
+    diff(['HEAD', '--names'])
+    out, err = capsys.readouterr()
+    assert 'wals3\n' in out
+
+
+def test_diff_revision(mocker, capsys):
+    from appconfig import CONFIG_FILE
+    from appconfig.__main__ import diff
+
+    mocker.patch(
+        'appconfig.__main__.subprocess.check_output',
+        return_value=CONFIG_FILE.read_bytes().replace(b'port = 8887', b'port = 1'))
+    diff(['HEAD~1'])
+    out, err = capsys.readouterr()
+    assert 'port: 1 -> 8887' in out
+
+
+def test_diff_old_schema(mocker, capsys):
+    from appconfig import CONFIG_FILE
+    from appconfig.__main__ import diff
+
+    # A revision predating settings which were added since:
+    lines = CONFIG_FILE.read_text(encoding='utf-8').splitlines()
+    old = '\n'.join(line for line in lines if not line.startswith(
+        ('green_port', 'venv_releases', 'smoke_urls')))
+    mocker.patch(
+        'appconfig.__main__.subprocess.check_output',
+        return_value=old.replace('port = 8887', 'port = 1').encode('utf-8'))
+    diff(['9c82718'])
+    out, err = capsys.readouterr()
+    assert 'port: 1 -> 8887' in out and 'green_port: 0 -> 9887' in out
+    assert 'smoke_urls' not in out
+
+
+def test_config_at_revision(mocker, testdir):
+    from appconfig.__main__ import config_at_revision
+
+    outputs = [b'testapp.ini\n_defaults.ini\n', b'[DEFAULT]', b'[testapp]']
+    mocker.patch('appconfig.__main__.subprocess.check_output', side_effect=outputs)
+    assert config_at_revision('HEAD', testdir / 'apps.d') == '[DEFAULT]\n[testapp]'
+
+
+def test_smoke(mocker, capsys):
+    from appconfig.__main__ import smoke, test_error
+    from appconfig.probes import Probe
+
+    def iter_probes(urls):
+        return (Probe(u, 200 if u.endswith('_ping') else 500, 0.1, None) for u in urls)
+
+    mocker.patch('appconfig.smoke.probes.iter_probes', iter_probes)
+    assert smoke(['wals3']) == 0
+    out, err = capsys.readouterr()
+    assert '2 passed, 0 failed' in out
+
+    test_error('--all')
+    out, err = capsys.readouterr()
+    assert 'wals3' in out and '_ping' not in out
+
+    mocker.patch(
+        'appconfig.smoke.probes.iter_probes', lambda urls: (Probe(u, 200, 0.1, None) for u in urls))
+    with pytest.raises(RuntimeError):
+        test_error('--all')
+
+
+def test_fleet(mocker):
+    from appconfig.__main__ import fleet
+
+    run = mocker.patch('appconfig.__main__.fleet_.run', return_value=[])
+    assert fleet(['pip_freeze', '--stack', 'clld', '--host', 'uri.clld.org', '-j', '2']) == 0
+    task, apps, environment = run.call_args[0]
+    assert task == 'pip_freeze' and environment == 'production'
+    assert apps and all(a.production == 'uri.clld.org' for a in apps)
+    assert run.call_args[1]['workers'] == 2
+
+
+def test_render(capsys, tmp_path):
+    from appconfig.__main__ import render
+
+    render(['cobl', 'production'])
+    out, err = capsys.readouterr()
+    assert '# /etc/supervisor/conf.d/cobl.conf' in out and 'cobl-backup.timer' in out
+
+    render(['wals3', 'staging', '--host', 'vbox', '-o', str(tmp_path)])
+    config = tmp_path / 'home' / 'wals3' / 'config.ini'
+    assert 'wals3@vbox' in config.read_text(encoding='utf8')
+    assert not (tmp_path / 'etc' / 'logrotate.d').exists()
+
+    with pytest.raises(SystemExit):
+        render(['wals3', 'staging'])
@@ -0,0 +1,55 @@
+import gzip
+import shutil
+import subprocess
+
+import pytest
+
+from appconfig import compression
+
+
+def test_get_codec():
+    assert compression.get_codec('gzip').compress_command() == 'gzip -c'
+    assert compression.get_codec('gzip').compress_command(level=1) == 'gzip -c -1'
+    assert compression.get_codec('pigz').compress_command(threads=4) == 'pigz -c -p 4'
+    assert compression.get_codec('zstd').compress_command(level=3) == 'zstd -c -q -3 -T0'
+    with pytest.raises(ValueError):
+        compression.get_codec('lzma')
+
+
+def test_from_suffix():
+    assert compression.from_suffix('dump.sql.gz').name == 'gzip'
+    assert compression.from_suffix('dump.sql.zst').name == 'zstd'
+    assert compression.from_suffix('db_dump_20180101T000000Z') is None
+
+
+@pytest.mark.parametrize('name', ['gzip', 'pigz', 'zstd', 'none'])
+def test_roundtrip(tmp_path, name):
+    codec = compression.get_codec(name)
+    if not shutil.which(codec.compress.split()[0]):
+        pytest.skip('%s not installed' % name)
+    sql = b'CREATE TABLE t (id int);\n' * 100
+    for fname in ['dump.sql' + codec.suffix, 'dump']:  # By extension and by magic number.
+        path = tmp_path / fname
+        path.write_bytes(subprocess.check_output(
+            ['bash', '-c', codec.compress_command()], input=sql))
+        out = subprocess.check_output(['bash', '-c', compression.decompress_command(path)])
+        assert out == sql
+
+
+def test_decompress_command_sniffing(tmp_path):
+    path = tmp_path / "it's a dump"
+    path.write_bytes(gzip.compress(b'SELECT 1;'))
+    assert subprocess.check_output(
+        ['bash', '-c', compression.decompress_command(path)]) == b'SELECT 1;'
+
+
+def test_gzip(mocker):
+    out = subprocess.run(
+        ['bash', '-c', 'echo sql | {0} | gzip -dc'.format(compression.gzip_command())],
+        stdout=subprocess.PIPE).stdout
+    assert out == b'sql\n'
+
+    mocker.patch('appconfig.compression.shutil.which', return_value=None)
+    assert compression.local_gzip().name == 'gzip'
+    mocker.patch('appconfig.compression.shutil.which', return_value='/usr/bin/pigz')
+    assert compression.local_gzip().name == 'pigz'
@@ -1,7 +1,12 @@
 # test_config.py
 
-import pytest
+import sys
+import pickle
+import pathlib
 import argparse
+import subprocess
+
+import pytest
 
 from appconfig import config
 
@@ -16,6 +21,47 @@ def test_config_validate():
             'eggs': argparse.Namespace(name='eggs', port=42),
         }).validate()
 
+    with pytest.raises(ValueError, match='venv_releases'):
+        config.Config({'spam': argparse.Namespace(
+            name='spam', port=42, venv_releases=2,
+            venv_dir=pathlib.PurePosixPath('/usr/venvs/spam'),
+            venv_bin=pathlib.PurePosixPath('/usr/venvs/spam/bin'))}).validate()
+
+    with pytest.raises(ValueError, match='duplicate green port'):
+        config.Config({
+            'spam': argparse.Namespace(name='spam', port=42, venv_releases=0, green_port=43),
+            'eggs': argparse.Namespace(name='eggs', port=43, venv_releases=0, green_port=0),
+        }).validate()
+
+
+def test_config_indexes(config):
+    assert config.production_hosts == {'vbox'}
+    assert {a.name for a in config.by_production['vbox']} == {'testapp', 'testapppublic'}
+    assert [a.name for a in config.by_test['vbox']] == ['testapp']
+    assert len(config.by_stack['clld']) == 2
+    assert config.by_port[9999] == (config['testapp'],)
+    assert config.by_domain['testapp.test.clld.org'] == (config['testapp'],)
+    with pytest.raises(TypeError):
+        config.by_port[1] = ()
+
+
+def test_config_select(config):
+    assert [a.name for a in config.select()] == ['testapp', 'testapppublic']
+    assert [a.name for a in config.select('test')] == ['testapp']
+    assert [a.name for a in config.select(host='vbox', pattern='*public')] == ['testapppublic']
+    assert config.select(host='nonhost') == config.select(stack='django') == []
+
+
+def test_config_index_invalidation():
+    cfg = config.Config(spam=argparse.Namespace(name='spam', port=1))
+    assert list(cfg.by_port) == [1]
+    cfg['eggs'] = argparse.Namespace(name='eggs', port=2)
+    assert sorted(cfg.by_port) == [1, 2]
+    del cfg['spam']
+    assert list(cfg.by_port) == [2]
+    cfg.update(spam=argparse.Namespace(name='spam', port=2))
+    assert len(cfg.by_port[2]) == 2
+
 
 def test_config_hostnames(config):
     assert config.hostnames == ['vbox', 'spam.eggs']
@@ -27,7 +73,7 @@ def test_app():
     assert app.name == app.test == app.production == '1'
     assert app.port == app.workers == app.deploy_duration == 1
     assert app.with_blog == app.pg_collkey == app.pg_unaccent == True
-    assert app.require_deb == app.require_pip == ['1']
+    assert app.require_deb == app.require_pip == ('1',)
     assert app.home_dir / 'spam' == app.www_dir / 'spam' == app.venv_dir / 'spam'
 
     with pytest.raises(ValueError, match='missing'):
@@ -41,10 +87,110 @@ def test_app_fixture(app):
     assert app.name and app.test and app.production
 
 
+def test_app_immutable(app):
+    assert not hasattr(app, '__dict__')
+    assert 'port' in app and 'spam' not in app
+    assert repr(app).startswith("App(name='testapp'")
+    assert hash(app) == hash(app.replace())
+    assert pickle.loads(pickle.dumps(app)) == app
+
+    with pytest.raises(AttributeError, match='immutable'):
+        app.port = 1
+
+    with pytest.raises(AttributeError, match='immutable'):
+        del app.port
+
+
 def test_app_replace(app):
-    assert app.replace().__dict__ == app.__dict__
-    assert app.replace(require_deb='spam eggs').require_deb == ['spam', 'eggs']
-    assert app.replace().require_deb is not app.require_deb
+    assert app.replace() == app
+    assert app.replace(require_deb='spam eggs').require_deb == ('spam', 'eggs')
+    assert app.replace(port='1').port == 1
+    assert app.replace().require_deb is app.require_deb
 
     with pytest.raises(ValueError, match='unknown'):
         app.replace(nonfield='')
+
+
+def test_app_venv(app):
+    assert app.venv == app.venv_dir
+    release = app.replace(venv_releases='2', venv_bin=str(app.venv_dir / 'current' / 'bin'))
+    assert release.venv == app.venv_dir / 'current'
+
+
+def test_app_slots(app):
+    assert [s.port for s in app.slots] == [app.port]
+    slots = app.replace(green_port='8000').slots
+    assert [s.program for s in slots] == [app.name, app.name + '-green']
+    assert slots[1].pid.name == 'gunicorn-green.pid'
+
+
+def test_config_from_snapshot(testdir, tmp_path, mocker):
+    with pytest.warns(UserWarning, match='missing fabfile dir'):
+        cfg = config.Config.from_snapshot(testdir / 'apps.ini', tmp_path)
+    assert len(list(tmp_path.glob('*.json'))) == 1
+    assert cfg.hostnames == ['vbox', 'spam.eggs']
+    assert cfg.defaults['error_email'] == 'lingweb@shh.mpg.de'
+
+    parse = mocker.patch('appconfig.config.ConfigParser.from_files')
+    cached = config.Config.from_snapshot(testdir / 'apps.ini', tmp_path, validate=False)
+    assert not parse.called
+    assert cached['testapp'] == cfg['testapp']
+
+
+def test_lazy_config(mocker):
+    loader = mocker.Mock(return_value=config.Config(spam=mocker.sentinel.app))
+    apps = config.LazyConfig(loader)
+    assert not apps.loaded and 'not loaded' in repr(apps)
+
+    assert apps['spam'] is mocker.sentinel.app
+    assert 'spam' in apps and list(apps) == ['spam'] and len(apps) == 1
+    assert apps.defaults is None
+    assert loader.call_count == 1
+
+    apps.reload()
+    assert loader.call_count == 2
+
+
+def test_import_is_lazy():
+    code = 'import appconfig.tasks, appconfig; assert not appconfig.APPS.loaded'
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_config_diff(config):
+    other = config.__class__(config)
+    assert config.diff(other) == {}
+
+    other['testapp'] = config['testapp'].replace(port='1', require_deb='git')
+    del other['testapppublic']
+    res = config.diff(other)
+    assert res['testapp'] == {
+        'port': (9999, 1), 'require_deb': (config['testapp'].require_deb, ('git',))}
+    assert res['testapppublic']['port'] == (9998, None)
+
+
+def test_config_dir(testdir):
+    assert [p.name for p in config.source_files(testdir / 'apps.d', ['testapp'])] == \
+        ['_defaults.ini', 'testapp.ini']
+
+    with pytest.warns(UserWarning, match='missing fabfile dir'):
+        expected = config.Config.from_file(testdir / 'apps.ini')
+        cfg = config.Config.from_file(testdir / 'apps.d')
+    assert cfg == expected and cfg.hostnames == expected.hostnames
+
+    with pytest.warns(UserWarning, match='missing fabfile dir'):
+        app = config.load_app(testdir / 'apps.d', 'testapp')
+    assert app == expected['testapp']
+
+    with pytest.raises(KeyError):
+        config.load_app(testdir / 'apps.d', 'nonapp')
+
+
+def test_lazy_config_app_loader(mocker):
+    loader = mocker.Mock()
+    apps = config.LazyConfig(loader, mocker.Mock(side_effect=KeyError))
+    assert 'spam' not in apps
+
+    apps = config.LazyConfig(loader, mocker.Mock(return_value=mocker.sentinel.app))
+    assert apps['spam'] is apps['spam'] is mocker.sentinel.app
+    assert 'spam' in apps
+    assert not loader.called and apps._app_loader.call_count == 1
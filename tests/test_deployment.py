@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 import argparse
 
 import pytest
+from fabric.api import settings
 
 from appconfig import tasks
 
@@ -34,6 +35,9 @@ def mocked_deployment(mocker):
         prompt=mocker.Mock(return_value='app'),
         sudo=mocker.Mock(return_value='/usr/venvs/__init__.py'),
         run=mocker.Mock(return_value='{"status": "ok"}'),
+        put=mocker.Mock(),
+        get=mocker.Mock(),
+        Artifacts=mocker.Mock(),
         cd=mocker.DEFAULT,
         local=mocker.Mock(),
         exists=mocker.Mock(side_effect=lambda x: x.endswith('alembic.ini')),
@@ -74,3 +78,230 @@ def test_deploy(mocker, config, mocked_deployment):
         tasks.deploy('production', with_alembic=True)
         tasks.deploy('test')
         tasks.deploy('test', with_alembic=True)
+
+
+def test_start_unchanged(mocker, config):
+    mocker.patch('appconfig.tasks.deployment.require_supervisor', return_value=False)
+    service = mocker.patch('appconfig.tasks.deployment.service')
+    supervisor = mocker.patch('appconfig.tasks.deployment.supervisor')
+    assert not tasks.start.execute_inner(config['testapp'])
+    assert not service.reload.called and not supervisor.update_config.called
+
+
+def test_render_config_files(mocker, config):
+    from appconfig.tasks.deployment import render_config_files
+
+    app = config['testapp']
+    with settings(host='vbox', environment='test'):
+        files = dict(render_config_files(app))
+    assert 'auth_basic' in files[str(app.nginx_location)]
+    assert str(app.logrotate) not in files
+
+    with settings(host='vbox', environment='production'):
+        files = dict(render_config_files(app))
+    assert str(app.nginx_site) in files and str(app.logrotate) in files
+
+
+def test_release(mocker, config):
+    from appconfig.tasks import deployment
+
+    app = config['testapp'].replace(venv_releases='2', venv_bin='/usr/venvs/testapp/current/bin')
+    sudo = mocker.patch('appconfig.tasks.deployment.sudo')
+    require_venv = mocker.patch('appconfig.tasks.deployment.require_venv')
+    deployment.require_release(app, require_packages=['testapp'])
+    release = require_venv.call_args[0][0]
+    assert release.parent == app.venv_dir / 'releases'
+    assert 'releases/%s' % release.name in sudo.call_args_list[0][0][0]
+    assert 'tail -n +3' in sudo.call_args_list[1][0][0]
+
+    run = mocker.patch('appconfig.tasks.deployment.run', side_effect=[
+        '20200101000000\n20200201000000\n20200301000000', 'releases/20200301000000'])
+    sudo.reset_mock()
+    tasks.rollback.execute_inner(app)
+    assert 'releases/20200201000000' in sudo.call_args_list[0][0][0]
+    assert 'supervisorctl restart testapp' in sudo.call_args_list[1][0][0]
+
+    run.side_effect = ['20200101000000', 'releases/20200101000000']
+    with pytest.raises(ValueError, match='no release'):
+        tasks.rollback.execute_inner(app)
+
+    with pytest.raises(ValueError, match='venv releases'):
+        tasks.rollback.execute_inner(config['testapp'])
+
+
+def test_supervisor_autostart(config):
+    from appconfig.templating import render
+
+    app = config['testapp'].replace(green_port='9998')
+    conf = render('supervisor.conf', dict(PAUSE=False, ACTIVE='green', app=app))
+    blue, _, green = conf.partition('[program:testapp-green]')
+    assert 'autostart = false' in blue and 'autostart = true' in green
+    conf = render('supervisor.conf', dict(PAUSE=True, ACTIVE='blue', app=app))
+    assert 'autostart = true' not in conf
+
+
+def test_switch_slot(mocker, config):
+    from appconfig.tasks import deployment
+
+    app = config['testapp'].replace(green_port='9998')
+    run = mocker.patch('appconfig.tasks.deployment.run', side_effect=['green', '0 ready 1200'])
+    sudo = mocker.patch('appconfig.tasks.deployment.sudo', return_value='')
+    supervisor = mocker.patch('appconfig.tasks.deployment.supervisor')
+    require_supervisor = mocker.patch(
+        'appconfig.tasks.deployment.require_supervisor', return_value=True)
+    exists = mocker.patch('appconfig.tasks.deployment.exists', return_value=False)
+    with settings(environment='production', appconfig_batch=False):
+        deployment.switch_slot(app)
+    # The config defining the idle slot is in place before it is restarted:
+    assert supervisor.update_config.called
+    assert [c[1]['active'] for c in require_supervisor.call_args_list] == ['green', 'blue']
+    commands = [c[0][0] for c in sudo.call_args_list]
+    assert commands[0] == 'supervisorctl restart testapp'
+    assert 's|http://127.0.0.1:9998/|http://127.0.0.1:9999/|' in commands[2]
+    assert 'echo blue' in commands[-3]
+    assert commands[-2] == 'supervisorctl stop testapp-green'
+    assert commands[-1] == 'supervisorctl reread'
+
+    run.side_effect = ['', '0 timeout 60000']
+    sudo.reset_mock()
+    with pytest.raises(ValueError, match='not responding'):
+        deployment.switch_slot(app)
+    assert sudo.call_args[0][0] == 'supervisorctl stop testapp-green'
+
+    # Behind varnish, the backend port is switched:
+    exists.return_value = True
+    run.side_effect = ['green', '0 ready 1200']
+    sudo.reset_mock()
+    with settings(environment='production', appconfig_batch=False):
+        deployment.switch_slot(app)
+    commands = [c[0][0] for c in sudo.call_args_list]
+    assert commands[1] == "grep -qF '.port = \"9998\";' /etc/varnish/sites/testapp.vcl"
+    assert 's|.port = "9998";|.port = "9999";|' in commands[2]
+    assert commands[3] == 'service varnish reload'
+
+
+def test_swap_database(mocker, config):
+    from appconfig.tasks import deployment
+
+    app = config['testapp']
+    mocker.patch('appconfig.tasks.deployment.run', return_value='blue')
+    sudo = mocker.patch('appconfig.tasks.deployment.sudo', return_value='')
+    deployment.swap_database(app, keep_previous=True)
+    commands = [c[0][0] for c in sudo.call_args_list]
+    assert commands[0] == 'dropdb --if-exists testapp_prev'
+    assert commands[1] == 'supervisorctl stop testapp'
+    assert 'ALTER DATABASE testapp RENAME TO testapp_prev; ' \
+           'ALTER DATABASE testapp_next RENAME TO testapp;' in commands[3]
+    assert commands[-1] == 'supervisorctl start testapp'
+
+    sudo.reset_mock()
+    deployment.rollback_db.execute_inner(app)
+    assert 'ALTER DATABASE testapp_prev RENAME TO testapp;' in sudo.call_args_list[-2][0][0]
+
+
+def test_swap_database_mysql(mocker, config):
+    from appconfig.tasks import deployment
+
+    app = config['testapp'].replace(stack='soundcomparisons')
+
+    def mysql(cmd, **kw):
+        if 'information_schema.views' in cmd:
+            return '0\n0'
+        return 'a b' if 'information_schema.tables' in cmd else ''
+
+    sudo = mocker.patch('appconfig.tasks.deployment.sudo', side_effect=mysql)
+    deployment.swap_database(app)
+    commands = [c[0][0] for c in sudo.call_args_list]
+    rename, = [c for c in commands if 'RENAME TABLE' in c]
+    assert 'testapp.a TO testapp_prev.a' in rename and 'testapp_next.b TO testapp.b' in rename
+    assert 'drop database if exists testapp_next' in commands[-2]
+    assert 'drop database if exists testapp_prev' in commands[-1]
+
+    sudo.side_effect = lambda cmd, **kw: '1\n0' if 'views' in cmd else ''
+    with pytest.raises(ValueError, match='views'):
+        deployment.swap_database(app)
+
+
+def test_require_postgres(mocker, config):
+    from appconfig.tasks import deployment
+
+    mocker.patch('appconfig.tasks.deployment.require')
+    sudo = mocker.patch('appconfig.tasks.deployment.sudo', return_value='')
+    with settings(appconfig_batch=False):
+        deployment.require_postgres(
+            config['testapp'].replace(pg_collkey='false'), dbname='testapp_next')
+    commands = [c[0][0] for c in sudo.call_args_list]
+    assert 'CREATE USER testapp ' in commands[0]
+    assert commands[1].endswith('createdb --owner testapp --template template0 --encoding=UTF8 '
+                                '--lc-ctype=en_US.UTF-8 --lc-collate=en_US.UTF-8 testapp_next')
+    assert all(c[1]['user'] == 'postgres' for c in sudo.call_args_list)
+
+
+def test_check(mocker, config):
+    from appconfig.tasks import deployment
+
+    app = config['testapp']
+    ping = ['{"status": "ok"}']
+    mocker.patch(
+        'appconfig.tasks.deployment.run',
+        side_effect=lambda cmd: ping[0] if cmd.startswith('curl') else '0 ready 2500')
+    with settings(environment='test'):
+        res, = deployment.check(app)
+    assert res.ready and res.seconds == 2.5 and str(app.port) in res.url
+
+    # A maintenance page, served with status 200:
+    ping[0] = '<html>Maintenance</html>'
+    with settings(environment='test'), pytest.raises(ValueError, match='status ok'):
+        deployment.check(app)
+
+    mocker.patch('appconfig.tasks.deployment.run', return_value='0 timeout 60000')
+    with settings(environment='test'), pytest.raises(ValueError, match='not responding'):
+        deployment.check(app)
+
+
+def test_require_build(mocker, tmp_path):
+    import subprocess
+    from appconfig.tasks import deployment
+
+    def sudo(cmd, **kw):
+        return subprocess.run(
+            ['bash', '-c', cmd], stdout=subprocess.PIPE, cwd=str(tmp_path)).stdout.decode()
+
+    mocker.patch('appconfig.tasks.deployment.sudo', sudo)
+    subprocess.check_call(['git', 'init', '-q', str(tmp_path)])
+    tmp_path.joinpath('Gruntfile.js').write_text('grunt')
+    subprocess.check_call(['git', 'add', 'Gruntfile.js'], cwd=str(tmp_path))
+    build = mocker.Mock(side_effect=lambda: tmp_path.joinpath('out.js').write_text('output'))
+
+    assert deployment.require_build(tmp_path, 'grunt', build)
+    assert not deployment.require_build(tmp_path, 'grunt', build)
+    assert build.call_count == 1
+
+    tmp_path.joinpath('Gruntfile.js').write_text('changed')
+    assert deployment.require_build(tmp_path, 'grunt', build)
+    assert not deployment.require_build(tmp_path, 'grunt', build, key='true')
+    assert deployment.require_build(tmp_path, 'grunt', build, key='echo 2.0')
+
+    nogit = tmp_path.parent / (tmp_path.name + '-nogit')
+    nogit.mkdir()
+    nogit.joinpath('bower.json').write_text('{}')
+    assert deployment.require_build(nogit, 'bower', build)
+    assert not deployment.require_build(nogit, 'bower', build)
+
+    # Build output, stamps of other builds and node_modules don't count as changes:
+    def build_output():
+        nogit.joinpath('dist').mkdir(exist_ok=True)
+        nogit.joinpath('dist', 'app.js').write_text('output')
+        nogit.joinpath('node_modules').mkdir(exist_ok=True)
+        nogit.joinpath('node_modules', 'x.js').write_text(str(build_output.calls))
+        build_output.calls += 1
+
+    build_output.calls = 0
+    assert deployment.require_build(nogit, 'grunt', build_output)
+    nogit.joinpath('node_modules', 'x.js').write_text('installed')
+    assert not deployment.require_build(nogit, 'grunt', build_output)
+    nogit.joinpath(deployment.BUILD_STAMP.format('webassets')).write_text('x')
+    assert not deployment.require_build(nogit, 'grunt', build_output)
+    nogit.joinpath('Gruntfile.js').write_text('changed')
+    assert deployment.require_build(nogit, 'grunt', build_output)
+    assert build_output.calls == 2
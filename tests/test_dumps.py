@@ -0,0 +1,73 @@
+import gzip
+import tarfile
+import subprocess
+
+import pytest
+
+from appconfig import dumps
+
+
+@pytest.fixture
+def dump_files(tmp_path):
+    plain = tmp_path / 'plain.sql.gz'
+    with gzip.open(str(plain), 'wb') as fp:
+        fp.write(b'CREATE TABLE t (id int);')
+    custom = tmp_path / 'dump.sql.gz'  # A misleading name.
+    custom.write_bytes(b'PGDMP\x01\x0e\x00')
+    directory = tmp_path / 'dump.dir.tar'
+    tmp_path.joinpath('toc.dat').write_bytes(b'PGDMP')
+    with tarfile.open(str(directory), 'w') as tar:
+        tar.add(str(tmp_path / 'toc.dat'), arcname='dump/toc.dat')
+    return {'plain': plain, 'custom': custom, 'directory': directory}
+
+
+def test_detect_format(dump_files):
+    for fmt, path in dump_files.items():
+        assert dumps.detect_format(path) == fmt
+        out = subprocess.check_output(['bash', '-c', dumps.detect_command(path)])
+        assert out.decode('ascii').strip() == fmt
+
+
+def test_parse_detected():
+    assert dumps.parse_detected('custom\n8\n') == ('custom', 7)
+    assert dumps.parse_detected('') == ('plain', 1)
+
+
+def test_commands():
+    assert dumps.dump_command('db') == 'pg_dump --no-owner --no-acl db | gzip -c'
+    assert '-Fd -j 3' in dumps.dump_command('db', 'directory', jobs=3)
+    assert dumps.dump_command('db', codec='zstd').endswith('| zstd -c -q -T0')
+    assert dumps.restore_command('/tmp/x.sql.gz', 'db', 'plain', single_transaction=True) \
+        .endswith('(gzip -dc < /tmp/x.sql.gz | psql -1 -d db)')
+    assert dumps.suffix() == '.sql.gz'
+    assert dumps.suffix('plain', 'none') == '.sql'
+    assert dumps.suffix('custom', 'zstd') == '.dump'
+    assert dumps.restore_command('/tmp/x', 'db', 'custom', jobs=4).endswith('-j 4 -d db /tmp/x)')
+    assert 'tar xf /tmp/x' in dumps.restore_command('/tmp/x', 'db', 'directory')
+    with pytest.raises(ValueError):
+        dumps.dump_command('db', 'xml')
+
+
+def test_dump_command_redirect(tmp_path):
+    # A stand-in for pg_dump, writing a directory format dump to the directory passed with -f:
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    bin_dir.joinpath('pg_dump').write_text(
+        '#!/bin/bash\nwhile [ "$1" != -f ]; do shift; done\n'
+        'mkdir -p $2 && echo PGDMP > $2/toc.dat\n')
+    bin_dir.joinpath('pg_dump').chmod(0o755)
+    target = tmp_path / 'dump.dir.tar'
+    subprocess.check_call(
+        ['bash', '-c', 'export PATH={0}:$PATH; {1} > {2}'.format(
+            bin_dir, dumps.dump_command('db', 'directory', jobs=2), target)],
+        stdout=subprocess.DEVNULL)
+    with tarfile.open(str(target)) as tar:
+        assert 'dump/toc.dat' in tar.getnames()
+
+
+def test_restore_empty(tmp_path):
+    empty = tmp_path / 'empty.sql.gz'
+    empty.write_bytes(b'')
+    proc = subprocess.run(
+        ['bash', '-c', dumps.restore_command(empty, 'db', 'plain')], stderr=subprocess.PIPE)
+    assert proc.returncode != 0 and b'empty dump' in proc.stderr
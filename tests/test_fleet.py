@@ -0,0 +1,34 @@
+import pytest
+
+from appconfig import fleet
+
+
+@pytest.fixture
+def task(mocker, config):
+    mocker.patch('appconfig.fleet.APPS', config)
+
+    def execute_inner(app, arg):
+        if app.name == 'testapppublic':
+            raise ValueError(arg)
+        return arg
+
+    return mocker.patch(
+        'appconfig.tasks.pip_freeze', mocker.Mock(execute_inner=mocker.Mock(wraps=execute_inner)))
+
+
+def test_run(task, config, capsys):
+    apps = config.select()
+    results = fleet.run('pip_freeze', apps, args=['x'], processes=False)
+    assert [r.app for r in results] == ['testapp', 'testapppublic']
+    assert results[0].ok and results[0].value == 'x' and results[0].host == 'vbox'
+    assert not results[1].ok and 'ValueError' in results[1].error
+    assert task.execute_inner.call_count == 2
+
+    assert fleet.report(results) == 1
+    out, err = capsys.readouterr()
+    assert '1 ok, 1 failed' in out
+
+
+def test_run_invalid_task(config):
+    with pytest.raises(ValueError, match='not an app task'):
+        fleet.run('init', config.select())
@@ -0,0 +1,28 @@
+import time
+
+from appconfig import probes
+
+
+def test_iter_probes(http_server):
+    urls = [http_server + p for p in ['/_ping', '/_raise', '/slow', '/app/_ping']]
+    urls.append('http://127.0.0.1:1/_ping')
+    start = time.monotonic()
+    res = {p.url: p for p in probes.iter_probes(urls, timeout=5)}
+    # Probes run concurrently, so we only wait for the slowest one:
+    assert time.monotonic() - start < 4
+
+    assert res[urls[0]].status == 'up' and res[urls[0]].code == 200
+    assert res[urls[1]].status == 'down' and res[urls[1]].code == 500
+    assert res[urls[2]].latency >= 2
+    assert res[urls[4]].status == 'unreachable'
+
+
+def test_iter_probes_timeout(http_server):
+    res, = list(probes.iter_probes([http_server + '/slow'], timeout=0.5))
+    assert res.status == 'timeout' and res.code is None
+
+
+def test_iter_probes_closed_early(http_server):
+    it = probes.iter_probes([http_server + '/_ping', http_server + '/slow'], concurrency=1)
+    assert next(it).code == 200
+    it.close()
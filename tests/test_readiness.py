@@ -0,0 +1,40 @@
+import time
+import argparse
+import subprocess
+
+from fabric.api import settings
+
+from appconfig import readiness
+
+
+def test_deadline():
+    assert readiness.deadline(argparse.Namespace(deploy_duration=2)) == 120
+    assert readiness.deadline(argparse.Namespace(deploy_duration=0)) == 60
+
+
+def test_wait(http_server):
+    start = time.monotonic()
+    ready, raising, down = readiness.wait([
+        (http_server + '/_ping', 5), (http_server + '/_raise', 1), ('http://127.0.0.1:1/', 1)])
+    assert time.monotonic() - start < 3
+    assert ready.ready and ready.seconds < 1
+    assert not raising.ready and raising.status == 'timeout' and raising.seconds >= 1
+    assert not down.ready
+
+
+def test_script(http_server):
+    targets = [(http_server + '/_ping', 5), (http_server + '/_raise', 0.6)]
+    out = subprocess.check_output(['bash', '-c', readiness.script(targets)])
+    ready, raising = readiness.parse(out.decode('ascii'), targets)
+    assert ready.ready and ready.seconds < 2
+    assert not raising.ready and raising.seconds >= 0.6
+
+
+def test_wait_remote(mocker):
+    run = mocker.Mock(return_value='1 ready 1500\n0 timeout 60000\n')
+    res = readiness.wait_remote([('http://localhost:1/_ping', 60), ('http://x/_ping', 5)], run=run)
+    assert [r.ready for r in res] == [False, True] and res[1].seconds == 1.5
+    assert 'base64 -d | bash' in run.call_args[0][0]
+
+    with settings(appconfig_plan=True):
+        assert readiness.wait_remote([('http://x/_ping', 5)], run=run)[0].ready
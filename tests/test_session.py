@@ -0,0 +1,111 @@
+import io
+import json
+
+import pytest
+import fabric.sftp
+import fabric.operations
+from fabric.api import settings
+
+from appconfig.session import Session, Operation, phase
+
+
+def test_session(mocker, capsys):
+    execute = mocker.patch('fabric.operations._execute', return_value=('', '', 0))
+    conn = mocker.Mock()
+    mocker.patch('fabric.state.connections', {'host': conn})
+    mocker.patch('appconfig.session.env', mocker.Mock(host_string='host'))
+    put = mocker.patch('fabric.sftp.SFTP.put')
+
+    with Session() as session:
+        assert Session().__enter__() is session
+        fabric.operations._execute(channel=None, command='ls')
+        for _ in range(2):
+            sftp = fabric.sftp.SFTP('host')
+            sftp.put(io.BytesIO(b'abc'), '/tmp/x', False, False, None, False, '')
+            sftp.close()
+
+    assert fabric.operations._execute is execute
+    assert fabric.sftp.SFTP.put is put and 'close' not in fabric.sftp.SFTP.__dict__
+    assert conn.open_sftp.call_count == 1
+    assert conn.open_sftp.return_value.close.call_count == 1
+
+    stats = session.stats['host']
+    assert (stats.commands, stats.transfers, stats.bytes, stats.round_trips) == (1, 2, 6, 3)
+    session.report()
+    out, err = capsys.readouterr()
+    assert out.splitlines()[1].split()[:4] == ['host', '1', '2', '6']
+
+
+def test_task_with_session(mocker, capsys):
+    from appconfig import tasks
+
+    execute = mocker.patch('appconfig.tasks.fabric.api.execute', return_value='ok')
+    mocker.patch('appconfig.tasks.APP', mocker.Mock(test='host'))
+    mocker.patch('appconfig.tasks.Session', mocker.MagicMock())
+    assert tasks.deploy('test') == 'ok'
+    assert execute.called and tasks.Session.called
+
+
+def test_session_phases(mocker, capsys, tmp_path):
+    mocker.patch('fabric.operations._execute', return_value=('', '', 0))
+    mocker.patch('appconfig.session.env', mocker.Mock(host_string='host'))
+
+    with phase('outside'):
+        pass
+
+    with Session() as session:
+        with phase('install') as stats:
+            fabric.operations._execute(channel=None, command='ls')
+        assert stats.commands == 1
+        with pytest.raises(ValueError):
+            with phase('fail'):
+                raise ValueError()
+
+    assert list(session.phases) == [('host', 'install'), ('host', 'fail')]
+    session.report()
+    out, _ = capsys.readouterr()
+    assert 'install' in out
+    session.dump(tmp_path / 'profile.json')
+    res = json.loads((tmp_path / 'profile.json').read_text())
+    assert res['phases'][0]['commands'] == 1 and 'operations' not in res
+
+
+def test_session_plan(mocker, capsys):
+    from fabric.api import sudo, run, put, cd, env
+
+    execute = mocker.patch('fabric.operations._execute')
+    mocker.patch('fabric.state.connections', {})
+
+    with Session(plan=True) as session:
+        with settings(host_string='host'):
+            assert env.appconfig_plan
+            with phase('install'):
+                with cd('/tmp'):
+                    assert sudo('ls', user='root').succeeded
+                put(io.BytesIO(b'abc'), '/tmp/x')
+            with phase('check'):
+                assert run('curl') == ''
+                raise ValueError('no output')
+
+    assert not execute.called
+    assert session.operations == [
+        Operation('host', 'install', 'sudo', 'cd /tmp >/dev/null && ls [as root]'),
+        Operation('host', 'install', 'put', '/tmp/x'),
+        Operation('host', 'check', 'run', 'curl'),
+    ]
+    assert session.phases[('host', 'check')].error == 'ValueError: no output'
+    assert session.stats['host'].bytes == 3
+    out, _ = capsys.readouterr()
+    assert 'plan incomplete' in out and session.as_json()['operations'][0]['kind'] == 'sudo'
+
+
+def test_task_plan(mocker, tmp_path):
+    from appconfig import tasks
+
+    mocker.patch('appconfig.tasks.fabric.api.execute', return_value='ok')
+    mocker.patch('appconfig.tasks.APP', mocker.Mock(test='host'))
+    session = mocker.patch('appconfig.tasks.Session', mocker.MagicMock())
+    assert tasks.deploy('test', plan='true', profile=str(tmp_path / 'p.json')) == 'ok'
+    session.assert_called_once_with(plan=True)
+    session.return_value.__enter__.return_value.dump.assert_called_once_with(
+        str(tmp_path / 'p.json'))
@@ -0,0 +1,19 @@
+from appconfig import smoke
+
+
+def test_checks(app):
+    app = app.replace(smoke_urls='/languages /parameters')
+    assert [c.url.rpartition('/')[2] for c in smoke.checks(app)] == \
+        ['_raise', '_ping', 'languages', 'parameters']
+    assert len(smoke.checks(app, raise_only=True)) == 1
+
+
+def test_run(app, http_server):
+    domain = http_server.partition('://')[2]
+    apps = [
+        app.replace(domain=domain, smoke_urls='/nonexisting'),
+        app.replace(name='other', domain=domain + '/other')]
+    results = list(smoke.run(apps, scheme='http'))
+    assert len(results) == 5
+    assert {r.check.url.replace(http_server, '') for r in results if not r.passed} == \
+        {'/nonexisting'}
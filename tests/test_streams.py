@@ -0,0 +1,107 @@
+import io
+import threading
+
+import pytest
+from fabric.api import settings
+
+from appconfig import streams
+
+
+class Channel(object):
+    def __init__(self, stdout=b'', stderr=b'', return_code=0):
+        self.stdout, self.stderr, self.return_code = io.BytesIO(stdout), stderr, return_code
+        self.command, self.stdin = None, b''
+
+    def exec_command(self, command):
+        self.command = command
+
+    def sendall(self, data):
+        self.stdin += data
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, n):
+        return self.stdout.read(n)
+
+    def makefile_stderr(self, mode):
+        return io.BytesIO(self.stderr)
+
+    def recv_exit_status(self):
+        return self.return_code
+
+
+@pytest.fixture
+def channels(mocker):
+    channels = []
+    client = mocker.Mock()
+    client.get_transport.return_value.open_session.side_effect = lambda: channels.pop(0)
+    mocker.patch('appconfig.streams.connections', {'host': client})
+    with settings(host_string='host', password='secret'):
+        yield channels
+
+
+def test_stream(channels):
+    sudo, dump = Channel(return_code=0), Channel(stdout=b'x' * 2500)
+    channels.extend([sudo, dump])
+    fp = io.BytesIO()
+    res = streams.stream('pg_dump db | gzip -c', fp, user='db', chunk_size=1000)
+    assert fp.getvalue() == b'x' * 2500 and res.bytes == 2500
+    assert dump.command.startswith("sudo -S -p '' -H -u db bash -c ")
+    assert 'set -o pipefail; pg_dump db | gzip -c' in dump.command
+    # No sudo password needed:
+    assert dump.stdin == b''
+
+
+def test_stream_password(channels):
+    dump = Channel(stdout=b'dump')
+    channels.extend([Channel(return_code=1), dump])
+    streams.stream('mysqldump', io.BytesIO(), input_lines=['mysql'])
+    assert dump.stdin == b'secret\nmysql\n'
+
+
+def test_stream_error(channels):
+    channels.extend([Channel(), Channel(stdout=b'partial', stderr=b'no such db', return_code=1)])
+    with pytest.raises(streams.StreamError, match='no such db'):
+        streams.stream('pg_dump db', io.BytesIO())
+
+
+def test_stream_stderr(channels):
+    class Channel_(Channel):
+        """A command which only writes to stdout once its stderr has been read."""
+        def __init__(self, *args, **kw):
+            Channel.__init__(self, *args, **kw)
+            self.stderr_read = threading.Event()
+
+        def recv(self, n):
+            assert self.stderr_read.wait(5), 'stdout blocked by unread stderr'
+            return Channel.recv(self, n)
+
+        def makefile_stderr(self, mode):
+            self.stderr_read.set()
+            return Channel.makefile_stderr(self, mode)
+
+    channels.extend([Channel(), Channel_(stdout=b'dump', stderr=b'warning' * 10000)])
+    fp = io.BytesIO()
+    assert streams.stream('pg_dump db', fp).bytes == 4 and fp.getvalue() == b'dump'
+
+
+def test_stream_plan(mocker):
+    sudo = mocker.patch('appconfig.streams.sudo')
+    with settings(appconfig_plan=True):
+        assert streams.stream('pg_dump db', io.BytesIO(), user='db').bytes == 0
+    assert sudo.call_args[1]['user'] == 'db'
+
+
+def test_dump_db(mocker, app):
+    from appconfig.tasks import other
+
+    stream = mocker.patch(
+        'appconfig.tasks.other.streams.stream',
+        side_effect=lambda cmd, fp, **kw: fp.write(b'dump') and streams.Transfer(4, 0.5))
+    dump = other.dump_db(app)
+    try:
+        assert dump.read_bytes() == b'dump'
+        assert stream.call_args[0][0] == 'pg_dump --no-owner --no-acl testapp | gzip -c'
+    finally:
+        dump.unlink()
@@ -1,9 +1,36 @@
+import base64
+
 from appconfig import systemd
+from appconfig.templating import checksum
+
+
+def _script(sudo):
+    # The batch script run with the last call of sudo:
+    return base64.b64decode(sudo.call_args[0][0].split()[1]).decode('utf8')
 
 
 def test_enable(app, testdir, mocker):
-    files = mocker.Mock(upload_template=mocker.Mock())
-    mocker.patch('appconfig.systemd.files', files)
-    mocker.patch('appconfig.systemd.sudo')
+    uploaded = {}
+    put = mocker.patch(
+        'appconfig.systemd.put',
+        side_effect=lambda fp, dest, **kw: uploaded.update({dest: fp.getvalue()}))
+    sudo = mocker.patch('appconfig.systemd.sudo', return_value='')
     systemd.enable(app, testdir / 'systemd')
-    assert files.upload_template.call_count == 3
+    assert put.call_count == len(uploaded) == 3
+    # One command each to compute checksums, set owners, and start and enable the units:
+    assert sudo.call_count == 3 and 'daemon-reload' in _script(sudo)
+
+    # Unchanged unit files are neither uploaded nor reloaded:
+    put.reset_mock()
+    sudo.reset_mock()
+    sudo.side_effect = lambda cmd: '\n'.join(
+        '{0}  {1}'.format(checksum(text), path) for path, text in uploaded.items())
+    systemd.enable(app, testdir / 'systemd')
+    assert not put.called
+    assert sudo.call_count == 2 and 'daemon-reload' not in _script(sudo)
+
+
+def test_uninstall(app, testdir, mocker):
+    sudo = mocker.patch('appconfig.systemd.sudo', return_value='')
+    systemd.uninstall(app, testdir / 'systemd')
+    assert sudo.call_count == 1
@@ -0,0 +1,36 @@
+from appconfig.templating import (
+    TEMPLATE_DIR, environment, render, checksum, remote_checksums, Uploads)
+
+
+def test_render(tmp_path):
+    (tmp_path / 'tmpl').write_text('{{ name }}\n', encoding='utf8')
+    assert render('tmpl', dict(name='x'), tmp_path) == 'x'
+    assert 'proxy_pass' in render('nginx-app.conf', dict(
+        app=None, env={}, auth='', admin_auth='', clld_dir=''))
+
+
+def test_remote_checksums(mocker):
+    assert remote_checksums([], None) == {}
+    sudo = mocker.Mock(return_value='abc  /a\nsha256sum: /b: No such file\ngarbage')
+    assert remote_checksums(['/a', '/b'], sudo) == {'/a': 'abc'}
+
+
+def test_uploads(tmp_path, mocker):
+    (tmp_path / 'tmpl').write_text('{{ name }}', encoding='utf8')
+    uploads = Uploads()
+    uploads.add('tmpl', '/a', dict(name='a'), tmp_path)
+    uploads.add('tmpl', '/b', dict(name='b'), tmp_path, mode='644', user='app')
+    assert len(uploads) == 2
+
+    sudo = mocker.Mock(return_value='{0}  /a'.format(checksum('a')))
+    put = mocker.Mock()
+    assert uploads.run(sudo=sudo, put=put) == ['/b']
+    assert len(uploads) == 0
+    assert put.call_args[0][1] == '/b' and put.call_args[1]['mode'] == '644'
+    # checksums and chown:
+    assert sudo.call_count == 2
+
+
+def test_environment(tmp_path):
+    assert environment() is environment(TEMPLATE_DIR)
+    assert environment(tmp_path) is not environment()
@@ -0,0 +1,155 @@
+import os
+import shlex
+import hashlib
+import subprocess
+
+import pytest
+from fabric.api import settings
+from fabric.operations import _AttributeString
+
+from appconfig import transfers
+
+
+def bash(command):
+    proc = subprocess.run(['bash', '-c', command], stdout=subprocess.PIPE)
+    res = _AttributeString(proc.stdout.decode('utf8').strip())
+    res.return_code, res.succeeded = proc.returncode, proc.returncode == 0
+    return res
+
+
+class File(object):
+    """Local file standing in for an SFTP file, which is interrupted after `fail_after` bytes."""
+
+    def __init__(self, fp, fail_after=None):
+        self.fp, self.fail_after = fp, fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fp.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def prefetch(self, size):
+        pass
+
+    def seek(self, offset):
+        self.fp.seek(offset)
+
+    def _interrupt(self, n):
+        if self.fail_after is not None:
+            if self.fail_after <= 0:
+                raise EOFError()
+            self.fail_after -= n
+
+    def read(self, n):
+        self._interrupt(n)
+        return self.fp.read(n)
+
+    def write(self, data):
+        self._interrupt(len(data))
+        self.fp.write(data)
+
+
+class SFTP(object):
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def open(self, path, mode):
+        return File(open(path, mode), self.fail_after)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def host(mocker, tmp_path):
+    sftps = [SFTP(fail_after=1), SFTP()]  # The first transfer is interrupted.
+    connections = mocker.MagicMock()
+    connections.__getitem__.return_value.open_sftp.side_effect = lambda: sftps.pop(0)
+    mocker.patch.multiple(
+        'appconfig.transfers',
+        connections=connections, run=bash, sudo=bash, CHUNK_SIZE=2,
+        REMOTE_DIR=str(tmp_path / 'part'))
+    with settings(host_string='host'):
+        yield connections
+
+
+def test_upload(host, tmp_path):
+    local = tmp_path / 'dump.sql.gz'
+    local.write_bytes(b'0123456789')
+    res = transfers.upload(local, tmp_path / 'remote.sql.gz')
+    assert (tmp_path / 'remote.sql.gz').read_bytes() == b'0123456789'
+    # Resumed after the first chunk was written:
+    assert res.bytes == 8 and host.connect.called
+    assert not list((tmp_path / 'part').iterdir())
+    # Up-to-date files aren't transferred again:
+    assert transfers.upload(local, tmp_path / 'remote.sql.gz').bytes == 0
+
+
+def test_download(host, tmp_path):
+    remote = tmp_path / 'db.sql.gz'
+    remote.write_bytes(b'0123456789')
+    res = transfers.download(remote, tmp_path / 'local.sql.gz')
+    assert (tmp_path / 'local.sql.gz').read_bytes() == b'0123456789'
+    assert res.bytes == 8
+    assert not (tmp_path / 'local.sql.gz.part').exists()
+
+
+def test_download_mismatch(host, tmp_path):
+    remote = tmp_path / 'db.sql.gz'
+    remote.write_bytes(b'0123456789')
+    # A stale part file, from another version of the remote file:
+    tmp_path.joinpath('local.sql.gz.part').write_bytes(b'abc')
+    with pytest.raises(transfers.TransferError):
+        transfers.download(remote, tmp_path / 'local.sql.gz')
+    assert not (tmp_path / 'local.sql.gz.part').exists()
+
+
+def test_fetch(mocker, tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'0123456789')
+    url, md5 = 'http://example.org/dump', hashlib.md5(b'0123456789').hexdigest()
+    part = tmp_path / transfers._fetch_part(url, tmp_path / 'dump', md5, None)
+    part.write_bytes(b'0123')
+
+    def run(command):
+        if command.startswith('curl'):
+            # Only the missing bytes are requested:
+            assert '-C -' in command
+            path = tmp_path / shlex.split(command)[-2]
+            offset = path.stat().st_size if path.exists() else 0
+            with path.open('ab') as fp:
+                fp.write(source.read_bytes()[offset:])
+            return bash('true')
+        return bash(command)
+
+    mocker.patch.multiple('appconfig.transfers', run=run, sudo=run)
+    res = transfers.fetch(url, tmp_path / 'dump', md5=md5)
+    assert tmp_path.joinpath('dump').read_bytes() == b'0123456789' and res.bytes == 10
+    # Already there:
+    assert transfers.fetch(url, tmp_path / 'dump', md5=md5).bytes == 0
+
+    tmp_path.joinpath('dump').unlink()
+    with pytest.raises(transfers.TransferError):
+        transfers.fetch(url, tmp_path / 'dump', size=3)
+
+    # Without checksum or size, a part file is never resumed:
+    tmp_path.joinpath(transfers._fetch_part(url, tmp_path / 'dump', None, None)).write_bytes(b'xx')
+    transfers.fetch(url, tmp_path / 'dump')
+    assert tmp_path.joinpath('dump').read_bytes() == b'0123456789'
+
+
+def test_plan(mocker):
+    put = mocker.patch('appconfig.transfers.put')
+    with settings(appconfig_plan=True):
+        assert transfers.upload('dump.sql.gz', '/tmp/dump.sql.gz').bytes == 0
+    assert put.called
@@ -0,0 +1,72 @@
+import pathlib
+
+import pytest
+
+from appconfig.wheelhouse import (
+    Wheelhouse, read_requirements, requirements_hash, local_tag, REMOTE_DIR)
+
+
+def test_read_requirements(tmp_path):
+    reqs = tmp_path / 'requirements.txt'
+    reqs.write_text(
+        'lxml==4.2.1\n-e git+https://github.com/clld/a.git#egg=a\n\nattrs==17.4.0\nclld\n')
+    with pytest.warns(UserWarning, match='unpinned'):
+        assert read_requirements(reqs) == ['attrs==17.4.0', 'lxml==4.2.1']
+    assert requirements_hash(['b', 'a']) == requirements_hash(['a', 'b'])
+
+
+def _pip_wheel(cmd):
+    wheel_dir = pathlib.Path(cmd[cmd.index('--wheel-dir') + 1])
+    for line in pathlib.Path(cmd[cmd.index('-r') + 1]).read_text().split():
+        name, _, version = line.partition('==')
+        wheel_dir.joinpath('{0}-{1}-py3-none-any.whl'.format(name, version)).write_text('')
+
+
+def test_wheels(tmp_path, mocker):
+    check_call = mocker.patch(
+        'appconfig.wheelhouse.subprocess.check_call', mocker.Mock(side_effect=_pip_wheel))
+    wh = Wheelhouse(directory=tmp_path)
+    wheels = wh.wheels(['attrs==17.4.0', 'lxml==4.2.1'])
+    assert [p.name for p in wheels] == [
+        'attrs-17.4.0-py3-none-any.whl', 'lxml-4.2.1-py3-none-any.whl']
+    # Wheels are cached per build host and tag:
+    assert all(p.parent == tmp_path / 'local' / local_tag() for p in wheels)
+
+    # Cached wheels are found via the manifest of the requirements:
+    assert wh.wheels(['lxml==4.2.1', 'attrs==17.4.0']) == wheels
+    assert check_call.call_count == 1
+
+    # Another set of requirements shares the pool of wheels:
+    wh.wheels(['attrs==17.4.0'])
+    assert len(list((tmp_path / 'local' / local_tag()).glob('*.whl'))) == 2
+
+
+def test_install(tmp_path, mocker):
+    mocker.patch('appconfig.wheelhouse.subprocess.check_call', mocker.Mock(side_effect=_pip_wheel))
+    sudo = mocker.Mock(side_effect=lambda cmd: local_tag() if 'sysconfig' in cmd
+                       else 'attrs-17.4.0-py3-none-any.whl\n')
+    put = mocker.Mock()
+    assert Wheelhouse(directory=tmp_path).install(
+        ['attrs==17.4.0', 'lxml==4.2.1'], sudo=sudo, put=put)
+    # Only missing wheels are uploaded:
+    assert put.call_count == 1 and 'lxml' in put.call_args[0][0]
+    assert sudo.call_args[0][0].startswith('pip install --no-index --find-links ' + REMOTE_DIR)
+
+
+def test_plan(tmp_path, mocker):
+    from fabric.api import settings
+
+    check_call = mocker.patch('appconfig.wheelhouse.subprocess.check_call')
+    with settings(appconfig_plan=True):
+        assert Wheelhouse(directory=tmp_path).wheels(['attrs==17.4.0']) == []
+    assert not check_call.called
+
+
+def test_install_other_platform(tmp_path, mocker):
+    check_call = mocker.patch('appconfig.wheelhouse.subprocess.check_call')
+    sudo = mocker.Mock(return_value='cp35-linux-x86_64')
+    wh = Wheelhouse(directory=tmp_path)
+    mocker.patch.object(Wheelhouse, 'tag', 'cp311-macosx-10.9-x86_64')
+    with pytest.warns(UserWarning, match='cannot be installed on cp35-linux-x86_64'):
+        assert not wh.install(['attrs==17.4.0'], sudo=sudo)
+    assert sudo.call_count == 1 and not check_call.called